@@ -17,7 +17,8 @@ do
   python ../fuzzydata/cli.py --wf_client=pandas \
                              --replay_dir=$outdir/pandas_1000/ \
                              --output_dir=$outdir/original_${scale}/ \
-                             --scale_artifact='{"artifact_0": '$scale'}'
+                             --scale_artifact='{"artifact_0": '$scale'}' \
+                             --seed=42 --cache_dir=$outdir/table_cache/
 done
 
 
@@ -0,0 +1,63 @@
+"""
+Startup-time benchmark for the fuzzydata CLI and clients.
+
+Runs each scenario in a fresh interpreter several times and reports the median wall time,
+along with the heavy engine modules that each scenario ended up importing.
+
+Usage: python startup_benchmark.py [--runs N]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+_REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_ENGINE_MODULES = ['pandas', 'numpy', 'networkx', 'sqlalchemy', 'faker', 'modin', 'dask', 'ray']
+
+_SCENARIOS = {
+    'interpreter': 'pass',
+    'cli --help': 'from fuzzydata.cli import setup_arguments\n'
+                  'try:\n    setup_arguments(["--help"])\nexcept SystemExit:\n    pass',
+    'pandas client': 'from fuzzydata.clients import supported_workflows\n'
+                     'supported_workflows["pandas"]',
+    'sql client': 'from fuzzydata.clients import supported_workflows\n'
+                  'supported_workflows["sql"]',
+    'pandas client + schema': 'from fuzzydata.clients import supported_workflows\n'
+                              'from fuzzydata.core.generator import generate_schema\n'
+                              'supported_workflows["pandas"]\n'
+                              'generate_schema(20)',
+}
+
+
+def run_scenario(code):
+    """ Run code in a fresh interpreter, return wall time and the engine modules it imported """
+    probe = f'{code}\nimport json, sys\n' \
+            f'print(json.dumps([m for m in {_ENGINE_MODULES!r} if m in sys.modules]))'
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable, '-c', probe], cwd=_REPO_DIR, capture_output=True, text=True,
+                            check=True).stdout
+    elapsed = time.perf_counter() - start
+    return elapsed, json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5, help='Number of runs per scenario (default 5)')
+    options = parser.parse_args()
+
+    print(f"{'scenario':<25}{'median (s)':>12}  imported engines")
+    for name, code in _SCENARIOS.items():
+        timings, modules = [], []
+        for _ in range(options.runs):
+            elapsed, modules = run_scenario(code)
+            timings.append(elapsed)
+        print(f"{name:<25}{statistics.median(timings):>12.3f}  {','.join(modules) or '-'}")
+
+
+if __name__ == '__main__':
+    main()
@@ -20,7 +20,6 @@ import json
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from fuzzydata.clients import supported_workflows
-from fuzzydata.core.generator import generate_workflow
 
 _LOG_LEVELS = {
     'critical': logging.CRITICAL,
@@ -84,6 +83,104 @@ def setup_arguments(args):
                         help="Replay existing workflow in directory",
                         type=str)
 
+    parser.add_argument("--replay_targets",
+                        help='JSON-encoded list of artifact labels e.g. ["artifact_5"]. Only replay the operations '
+                             'of --replay_dir needed to produce them',
+                        type=str)
+
+    parser.add_argument("--replay_workers",
+                        help="Number of threads replaying independent operations of --replay_dir concurrently. "
+                             "1 (default) replays serially, keeping per-operation timings isolated",
+                        type=int, default=1)
+
+    parser.add_argument("--lazy",
+                        help="Replay --replay_dir lazily: fuse chains of operations into a single expression or query "
+                             "instead of materializing intermediate artifacts consumed by only one operation",
+                        action='store_true')
+
+    parser.add_argument("--optimize",
+                        help="Replay --replay_dir with the rule-based optimizer, pushing project, select and sample "
+                             "below merges where the result stays equivalent",
+                        action='store_true')
+
+    parser.add_argument("--profile_steps",
+                        help="Time and measure every chained operation individually, materializing between steps, and "
+                             "record them in {wf_name}_step_perf linked to the perf record of their operation",
+                        action='store_true')
+
+    parser.add_argument("--file_format",
+                        help="Format to serialize artifacts to (Default csv, or the format of --replay_dir). Parquet "
+                             "and feather keep dtypes and require pyarrow",
+                        type=str, choices=['csv', 'parquet', 'feather'])
+
+    parser.add_argument("--compression",
+                        help="Compression codec of parquet (e.g. snappy, zstd, gzip) or feather (lz4, zstd, "
+                             "uncompressed) artifacts",
+                        type=str)
+
+    parser.add_argument("--csv_engine",
+                        help="Parser engine used to read CSV artifacts (Default: the pandas default)",
+                        type=str, choices=['c', 'python', 'pyarrow'])
+
+    parser.add_argument("--csv_chunk_size",
+                        help="Parse CSV artifacts in chunks of this many rows (c or python engine)",
+                        type=int)
+
+    parser.add_argument("--dedup_artifacts",
+                        help="Write artifacts identical to one already written as hard links to its file, and record "
+                             "the content hash of every artifact in {wf_name}_artifact_hashes.json",
+                        action='store_true')
+
+    parser.add_argument("--verify_hashes",
+                        help="Compare the artifacts replayed from --replay_dir with the content hashes it recorded",
+                        action='store_true')
+
+    parser.add_argument("--artifact_stats",
+                        help="Compute the row count, bytes and per-column null and distinct counts of every artifact "
+                             "once, and write them to {wf_name}_artifact_stats.json",
+                        action='store_true')
+
+    parser.add_argument("--memory_map",
+                        help="Memory-map parquet and feather artifacts of --replay_dir instead of reading them, "
+                             "uncompressed feather columns are then only paged in when an operation reads them. "
+                             "Feather artifacts are written uncompressed unless --compression is given",
+                        action='store_true')
+
+    parser.add_argument("--prune_columns",
+                        help="Load only the columns of every artifact of --replay_dir that the operations consuming it "
+                             "read",
+                        action='store_true')
+
+    parser.add_argument("--memory_budget_mb",
+                        help="MB of artifact data to keep in memory, least recently used artifacts are spilled to disk "
+                             "beyond that and reloaded when they are used again",
+                        type=float)
+
+    parser.add_argument("--evict_artifacts",
+                        help="During replay, write out and unload artifacts as soon as no pending operation "
+                             "consumes them",
+                        action='store_true')
+
+    parser.add_argument("--write_workers",
+                        help="Number of background threads writing out artifacts as soon as they are produced "
+                             "(Default 0, write all artifacts at the end)",
+                        type=int, default=0)
+
+    parser.add_argument("--checkpoint",
+                        help="Write out artifacts as they are produced and keep an operation log, so that an "
+                             "interrupted run can be continued with --resume",
+                        action='store_true')
+
+    parser.add_argument("--resume",
+                        help="Resume an interrupted run in --output_dir, skipping the artifacts it already completed "
+                             "(implies --checkpoint)",
+                        action='store_true')
+
+    parser.add_argument("--perf_stream",
+                        help="Stream performance records to {wf_name}_perf.{format} as they are recorded: jsonl, "
+                             "csv or none (default)",
+                        type=str, default='none', choices=['jsonl', 'csv', 'none'])
+
     parser.add_argument("--wf_options",
                         help="JSON-encoded workflow engine options like sql_string or modin_engine",
                         type=str)
@@ -97,6 +194,41 @@ def setup_arguments(args):
                              'e.g. {"artifact_0" : 1000000}',
                         type=str)
 
+    parser.add_argument("--seed",
+                        help="Seed for generated tables, the same seed generates the same base artifacts",
+                        type=int)
+
+    parser.add_argument("--gen_workers",
+                        help="Number of worker processes used to generate tables (Default 1)",
+                        type=int, default=1)
+
+    parser.add_argument("--stream_chunk_size",
+                        help="Generate base artifacts straight to disk in chunks of this many rows, "
+                             "bounding memory use by the chunk size instead of the number of rows",
+                        type=int)
+
+    parser.add_argument("--categorical",
+                        help="Store groupable columns with category dtype (dataframe clients only)",
+                        action='store_true')
+
+    parser.add_argument("--cache_dir",
+                        help="Directory to cache generated base artifacts in, keyed by schema, rows and --seed. "
+                             "Repeated runs with the same seed load cached tables instead of generating them again",
+                        type=str)
+
+    parser.add_argument("--cache_max_mb",
+                        help="Size cap of the table cache in MB, least recently used tables are evicted",
+                        type=float)
+
+    parser.add_argument("--monitor_interval",
+                        help="Seconds between two memory samples recorded in the performance output (Default 0.01). "
+                             "0 disables sampling and relies on the kernel's peak RSS counter (Linux only)",
+                        type=float)
+
+    parser.add_argument("--trace_allocations",
+                        help="Record bytes allocated by every step with tracemalloc (slows down allocations)",
+                        action='store_true')
+
     options = parser.parse_args(args)
 
     return options
@@ -110,13 +242,16 @@ def main(args):
     """
     options = setup_arguments(args)
 
+    # Imported here so that argument parsing (e.g. --help) does not need to load pandas and the faker providers
+    from fuzzydata.core.generator import generate_workflow
+
     # Set log level first
     logging.basicConfig(level=_LOG_LEVELS[options.log.lower()], format=_LOG_FORMAT)
     logger = logging.getLogger(__name__)
 
     logger.info(f"FuzzyData Config: {options}")
 
-    if os.path.exists(options.output_dir+'/artifacts/'):  # pragma: no cover
+    if os.path.exists(options.output_dir+'/artifacts/') and not options.resume:  # pragma: no cover
         sys.stderr.write(f'\nAn existing workflow exists in directory: {options.output_dir}, Overwrite (Y/N)?:')
         choice = input().lower()
         if choice in {'yes', 'y', 'ye', ''}:
@@ -131,6 +266,83 @@ def main(args):
     if options.wf_options:
         wf_options = json.loads(options.wf_options)
 
+    if options.seed is not None:
+        wf_options['seed'] = options.seed
+
+    if options.gen_workers > 1:
+        wf_options['gen_workers'] = options.gen_workers
+
+    if options.stream_chunk_size:
+        wf_options['stream_chunk_size'] = options.stream_chunk_size
+
+    if options.categorical:
+        wf_options['categorical'] = True
+
+    if options.cache_dir:
+        wf_options['cache_dir'] = options.cache_dir
+        if options.cache_max_mb:
+            wf_options['cache_max_bytes'] = int(options.cache_max_mb * 1024 * 1024)
+
+    if options.monitor_interval is not None:
+        wf_options['monitor_interval'] = options.monitor_interval
+
+    if options.replay_workers > 1:
+        wf_options['replay_workers'] = options.replay_workers
+
+    if options.lazy:
+        wf_options['lazy'] = True
+
+    if options.optimize:
+        wf_options['optimize'] = True
+
+    if options.profile_steps:
+        wf_options['profile_steps'] = True
+
+    if options.file_format:
+        wf_options['file_format'] = options.file_format
+
+    if options.compression:
+        wf_options['compression'] = options.compression
+
+    if options.csv_engine:
+        wf_options['csv_engine'] = options.csv_engine
+
+    if options.csv_chunk_size:
+        wf_options['csv_chunk_size'] = options.csv_chunk_size
+
+    if options.dedup_artifacts:
+        wf_options['dedup_artifacts'] = True
+
+    if options.verify_hashes:
+        wf_options['verify_hashes'] = True
+
+    if options.artifact_stats:
+        wf_options['artifact_stats'] = True
+
+    if options.memory_map:
+        wf_options['memory_map'] = True
+
+    if options.prune_columns:
+        wf_options['prune_columns'] = True
+
+    if options.memory_budget_mb is not None:
+        wf_options['memory_budget'] = int(options.memory_budget_mb * 1024 * 1024)
+
+    if options.evict_artifacts:
+        wf_options['evict_artifacts'] = True
+
+    if options.write_workers > 0:
+        wf_options['write_workers'] = options.write_workers
+
+    if options.checkpoint or options.resume:
+        wf_options['checkpoint'] = True
+
+    if options.perf_stream != 'none':
+        wf_options['perf_stream_format'] = options.perf_stream
+
+    if options.trace_allocations:
+        wf_options['trace_allocations'] = True
+
     if options.exclude_ops:
         exclude_ops = json.loads(options.exclude_ops)
 
@@ -143,13 +355,18 @@ def main(args):
         scale_artifact = {}
         if options.scale_artifact:
             scale_artifact = json.loads(options.scale_artifact)
+        replay_targets = None
+        if options.replay_targets:
+            replay_targets = json.loads(options.replay_targets)
         logger.info(f'Replaying Previous Workflow from directory {options.replay_dir}')
         workflow = supported_workflows[options.wf_client].load_workflow(input_dir=options.replay_dir,
                                                                         out_directory=options.output_dir,
                                                                         name=options.wf_name,
                                                                         replay=True,
                                                                         wf_options=wf_options,
-                                                                        scale_artifact=scale_artifact)
+                                                                        scale_artifact=scale_artifact,
+                                                                        resume=options.resume,
+                                                                        targets=replay_targets)
         workflow.serialize_workflow()
 
     else:
@@ -158,7 +375,7 @@ def main(args):
                                      base_shape=(options.columns, options.rows),
                                      out_directory=options.output_dir, bfactor=options.bfactor,
                                      wf_options=wf_options,
-                                     exclude_ops=exclude_ops, matfreq=options.matfreq)
+                                     exclude_ops=exclude_ops, matfreq=options.matfreq, resume=options.resume)
 
         # Generate Workflow calls serialize at the end.
 
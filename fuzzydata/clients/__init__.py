@@ -1,17 +1,51 @@
 import importlib
-from copy import deepcopy
+import importlib.util
+from collections.abc import Mapping
 
-from fuzzydata.clients.pandas import DataFrameWorkflow
-from fuzzydata.clients.sqlite import SQLWorkflow
-
-travis_workflows = {
-    'pandas': DataFrameWorkflow,
-    'sql': SQLWorkflow
+# client name -> (module, Workflow class name)
+_travis_clients = {
+    'pandas': ('fuzzydata.clients.pandas', 'DataFrameWorkflow'),
+    'sql': ('fuzzydata.clients.sqlite', 'SQLWorkflow'),
+}
+_modin_clients = {
+    'modin': ('fuzzydata.clients.modin', 'ModinWorkflow'),
 }
 
-supported_workflows = deepcopy(travis_workflows)
 
-modin_spec = importlib.util.find_spec('modin')
-if modin_spec:
-    from fuzzydata.clients.modin import ModinWorkflow
-    supported_workflows['modin'] = ModinWorkflow
+class WorkflowRegistry(Mapping):
+    """
+    Mapping of client name -> Workflow class. Client modules (and the engines they depend on) are only imported
+    when their Workflow class is looked up, so listing the available clients stays cheap.
+    """
+
+    def __init__(self, clients):
+        """
+        :param clients: Dict of client name -> (module name, Workflow class name)
+        """
+        self._clients = dict(clients)
+
+    def __getitem__(self, name):
+        module_name, class_name = self._clients[name]
+        return getattr(importlib.import_module(module_name), class_name)
+
+    def __iter__(self):
+        return iter(self._clients)
+
+    def __len__(self):
+        return len(self._clients)
+
+
+travis_workflows = WorkflowRegistry(_travis_clients)
+
+supported_workflows = WorkflowRegistry({
+    **_travis_clients,
+    **(_modin_clients if importlib.util.find_spec('modin') else {})
+})
+
+
+def __getattr__(name):
+    """ Lazily expose the Workflow classes of all clients as attributes of this package """
+    for module_name, class_name in {**_travis_clients, **_modin_clients}.values():
+        if name == class_name:
+            return getattr(importlib.import_module(module_name), class_name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -11,10 +11,9 @@ class ModinArtifact(DataFrameArtifact):
         kwargs.update({'pd': mpd})  # Force loading of the modin pandas library
         super(ModinArtifact, self).__init__(*args, **kwargs)
         self._deserialization_function = {
-            'csv': self.pd.read_csv
-        }
-        self._serialization_function = {
-            'csv': 'to_csv'
+            'csv': self.pd.read_csv,
+            'parquet': self.pd.read_parquet,
+            'feather': self.pd.read_feather,
         }
 
         self.operation_class = DataFrameOperation
@@ -38,4 +37,7 @@ class ModinWorkflow(Workflow):
         Engine.put(self.modin_engine)
 
     def initialize_new_artifact(self, label=None, filename=None, schema_map=None):
-        return ModinArtifact(label, filename=filename, schema_map=schema_map)
+        return ModinArtifact(label, filename=filename, schema_map=schema_map, categorical=self.categorical,
+                             file_format=self.file_format, compression=self.compression,
+                             csv_engine=self.csv_engine, csv_chunk_size=self.csv_chunk_size,
+                             csv_exact_floats=self.verify_hashes)
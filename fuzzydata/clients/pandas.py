@@ -1,11 +1,14 @@
 import logging
+import os
+import shutil
 from typing import List
 
 import pandas
 
-from fuzzydata.core.artifact import Artifact
-from fuzzydata.core.generator import generate_table
+from fuzzydata.core.artifact import Artifact, StatsAccumulator
+from fuzzydata.core.generator import generate_table, generate_table_chunks, get_schema_type_mapping
 from fuzzydata.core.operation import Operation, T
+from fuzzydata.core.plan import CompiledPlan, parse_literal
 from fuzzydata.core.workflow import Workflow
 
 logger = logging.getLogger(__name__)
@@ -15,36 +18,128 @@ class DataFrameArtifact(Artifact):
 
     def __init__(self, *args, **kwargs):
         self.pd = kwargs.pop("pd", pandas)
+        self.categorical = kwargs.pop("categorical", False)
         from_df = kwargs.pop("from_df", None)
         super(DataFrameArtifact, self).__init__(*args, **kwargs)
         self._deserialization_function = {
-            'csv': self.pd.read_csv
-        }
-        self._serialization_function = {
-            'csv': 'to_csv'
+            'csv': self.pd.read_csv,
+            'parquet': self.pd.read_parquet,
+            'feather': self.pd.read_feather,
         }
 
         self.operation_class = DataFrameOperation
         self.table = None
         self.in_memory = False
+        self._num_rows = None
+        self._spill_filename = None
 
         if from_df is not None:
             self.from_df(from_df)
 
-    def generate(self, num_rows, schema):
-        self.table = generate_table(num_rows, column_dict=schema, pd=self.pd)
+    @property
+    def table(self):
+        """ Dataframe of this artifact, reloaded on access if it was spilled or is only on disk at self.filename """
+        if not self.in_memory:
+            if self._spill_filename:
+                logger.debug(f'Reloading spilled {self.label} from {self._spill_filename}')
+                self._table = self.pd.read_pickle(self._spill_filename)
+                self.in_memory = True
+            elif self.filename and os.path.exists(self.filename):
+                logger.debug(f'Loading {self.label} from {self.filename}')
+                self.deserialize()
+        return self._table
+
+    @table.setter
+    def table(self, df):
+        self._table = df
+
+    @table.deleter
+    def table(self):
+        self._table = None
+        self.in_memory = False
+
+    def generate(self, num_rows, schema, **kwargs):
+        self.table = generate_table(num_rows, column_dict=schema, pd=self.pd, categorical=self.categorical, **kwargs)
         self.schema_map = schema
         self.in_memory = True
 
+    def generate_chunked(self, num_rows, schema, chunk_size, stats=False, **kwargs):
+        chunks = generate_table_chunks(num_rows, column_dict=schema, chunk_size=chunk_size,
+                                       categorical=self.categorical, **kwargs)
+        accumulator = StatsAccumulator() if stats else None
+        if accumulator:
+            chunks = self._accumulate(chunks, accumulator)
+        if self.file_format == 'csv':
+            for chunk in chunks:
+                first_chunk = chunk.index[0] == 0
+                chunk.to_csv(self.filename, mode='w' if first_chunk else 'a', header=first_chunk)
+        else:
+            self._write_arrow_chunks(chunks)
+
+        self.table = None
+        self.schema_map = schema
+        self.in_memory = False
+        self._num_rows = num_rows
+        if accumulator:
+            self._stats = accumulator.result()
+
+    @staticmethod
+    def _accumulate(chunks, accumulator):
+        for chunk in chunks:
+            accumulator.add(chunk)
+            yield chunk
+
+    def _write_arrow_chunks(self, chunks):
+        """ Stream chunks to a parquet or feather file with a pyarrow writer, without holding the whole table """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        writer = None
+        schema = None
+        try:
+            for chunk in chunks:
+                if self.file_format == 'feather':
+                    # The Arrow IPC file format cannot replace dictionaries between batches, so write categories as
+                    # plain values; they are categorized again when the artifact is loaded
+                    category_cols = chunk.columns[chunk.dtypes == 'category']
+                    chunk = chunk.astype({c: chunk[c].cat.categories.dtype for c in category_cols})
+                table = pa.Table.from_pandas(chunk, preserve_index=False, schema=schema)
+                if writer is None:
+                    schema = table.schema
+                    if self.file_format == 'parquet':
+                        writer = pq.ParquetWriter(self.filename, table.schema,
+                                                  **({'compression': self.compression} if self.compression else {}))
+                    else:
+                        compression = None if self.compression == 'uncompressed' else (self.compression or 'lz4')
+                        writer = pa.ipc.new_file(self.filename, table.schema,
+                                                 options=pa.ipc.IpcWriteOptions(compression=compression))
+                writer.write_table(table)
+        finally:
+            if writer is not None:
+                writer.close()
+
     def from_df(self, df):
-        self.table = self.pd.DataFrame(df)
+        self.table = self.categorize(self.pd.DataFrame(df))
         self.in_memory = True
 
-    def deserialize(self, filename=None):
+    def categorize(self, df):
+        """ Convert the object-typed groupable columns of df to category dtype if this artifact is categorical
+        :param df: Dataframe with (a subset of) the columns in this artifact's schema map
+        :return: Dataframe with category dtype for groupable columns
+        """
+        if not self.categorical or not self.schema_map:
+            return df
+        group_cols = [c for c in get_schema_type_mapping(self.schema_map)['groupable']
+                      if c in df.columns and df[c].dtype == object]
+        if group_cols:
+            df = df.astype({c: 'category' for c in group_cols})
+        return df
+
+    def deserialize(self, filename=None, columns=None, memory_map=False):
         if not filename:
             filename = self.filename
 
-        self.table = self._deserialization_function[self.file_format](filename)
+        self.table = self.categorize(self.read_table(filename, columns=columns, memory_map=memory_map))
         self.in_memory = True
 
     def serialize(self, filename=None):
@@ -52,25 +147,86 @@ class DataFrameArtifact(Artifact):
             filename = self.filename
 
         if self.in_memory:
-            serialization_method = getattr(self.table, self._serialization_function[self.file_format])
-            serialization_method(filename)
+            df = self.table
+        elif self._spill_filename:
+            # Write out spilled artifacts without keeping them in memory afterwards
+            df = self.pd.read_pickle(self._spill_filename)
+        else:
+            if self.filename and os.path.exists(self.filename) and \
+                    os.path.abspath(filename) != os.path.abspath(self.filename):
+                # Artifact was generated straight to disk, copy it over instead of loading it.
+                shutil.copyfile(self.filename, filename)
+            return
+
+        self.write_table(df, filename)
 
     def destroy(self):
         del self.table
+        if self._spill_filename:
+            if os.path.exists(self._spill_filename):
+                os.remove(self._spill_filename)
+            self._spill_filename = None
+
+    def restore(self):
+        # Loaded from self.filename on first access of the table
+        pass
+
+    def memory_usage(self) -> int:
+        if not self.in_memory or self._table is None:
+            return 0
+        usage = int(self._table.memory_usage(index=True, deep=False).sum())
+        object_cols = self._table.columns[self._table.dtypes == object]
+        if len(object_cols) and len(self._table.index):
+            # Estimate the size of python objects (strings) from a sample instead of measuring every value
+            sample = self._table[object_cols].head(1000)
+            per_row = (sample.memory_usage(index=False, deep=True).sum() -
+                       sample.memory_usage(index=False, deep=False).sum()) / len(sample.index)
+            usage += int(per_row * len(self._table.index))
+        return usage
+
+    def spill(self, filename):
+        if not self.in_memory:
+            return False
+        # Artifacts are immutable, so an earlier spill file is still valid
+        if self._spill_filename != filename:
+            self._table.to_pickle(filename)
+            self._spill_filename = filename
+        self._num_rows = len(self._table.index)
+        del self.table
+        return True
+
+    def unload(self, serialize=True):
+        if not self.in_memory and not self._spill_filename:
+            return False
+        if serialize:
+            self.serialize()
+        if self.in_memory:
+            self._num_rows = len(self._table.index)
+        self.destroy()
+        return True
 
     def to_df(self) -> pandas.DataFrame:
         return self.table
 
     def __len__(self):
-        if self.in_memory:
+        if self._stats is not None:
+            return self._stats['num_rows']
+        if self.in_memory or self._num_rows is None:
             return len(self.table.index)
+        return self._num_rows
 
 
 class DataFrameOperation(Operation['DataFrameArtifact']):
+    """
+    Chains operations on dataframes. Every chained operation generates code (self.code, kept for export) and is
+    compiled into a step of self.plan, which is what materialize() executes.
+    """
+
     def __init__(self, *args, **kwargs):
         self.artifact_class = kwargs.pop('artifact_class', DataFrameArtifact)
         super(DataFrameOperation, self).__init__(*args, **kwargs)
         self.code = 'self.sources[0].table' # Starting point for chained code generation.
+        self.plan = CompiledPlan()
 
     def apply(self, numeric_col: str, a: float, b: float) -> DataFrameArtifact:
         super(DataFrameOperation, self).apply(numeric_col, a, b)
@@ -84,7 +240,7 @@ class DataFrameOperation(Operation['DataFrameArtifact']):
     def groupby(self, group_columns: List[str], agg_columns: List[str], agg_function: str) -> T:
         super(DataFrameOperation, self).groupby(group_columns, agg_columns, agg_function)
         logger.debug(f"Groupby on {self.sources[0].label} : {group_columns}/{agg_columns}")
-        return f'[{group_columns+agg_columns}].groupby({group_columns}).{agg_function}().reset_index()'
+        return f'[{group_columns+agg_columns}].groupby({group_columns}, observed=True).{agg_function}().reset_index()'
 
     def project(self, output_cols: List[str]) -> T:
         super(DataFrameOperation, self).project(output_cols)
@@ -96,26 +252,69 @@ class DataFrameOperation(Operation['DataFrameArtifact']):
 
     def merge(self, key_col: List[str]) -> T:
         super(DataFrameOperation, self).merge(key_col)
-        return f'.merge(self.sources[1].table, on="{key_col}")'
+        return f'.merge(self.sources[{self.num_merges}].table, on="{key_col}")'
 
     def pivot(self, index_cols: List[str], columns: List[str], value_col: List[str], agg_func: str) -> T:
         super(DataFrameOperation, self).pivot(index_cols, columns, value_col, agg_func)
-        return f'.pivot_table(index={index_cols}, columns={columns},values={value_col},aggfunc="{agg_func}")'
+        return f'.pivot_table(index={index_cols}, columns={columns},values={value_col},aggfunc="{agg_func}",' \
+               f'observed=True)'
 
     def fill(self, col_name: str, old_value, new_value):
         super(DataFrameOperation, self).fill(col_name, old_value, new_value)
         return f'.replace({{ "{col_name}": {old_value} }}, {new_value})'
 
+    def _apply_step(self, numeric_col: str, a: float, b: float):
+        new_col_name = f"{numeric_col}__{int(a)}x_{int(b)}"
+        return lambda df: df.assign(**{new_col_name: lambda x: x[numeric_col] * a + b})
+
+    def _sample_step(self, frac: float):
+        return lambda df: df.sample(frac=frac)
+
+    def _groupby_step(self, group_columns: List[str], agg_columns: List[str], agg_function: str):
+        columns = list(group_columns) + list(agg_columns)
+        return lambda df: getattr(df[columns].groupby(group_columns, observed=True), agg_function)().reset_index()
+
+    def _project_step(self, output_cols: List[str]):
+        return lambda df: df[output_cols]
+
+    def _select_step(self, condition: str):
+        return lambda df: df.query(condition)
+
+    def _merge_step(self, key_col: List[str]):
+        source = self.sources[self.num_merges]
+        return lambda df: df.merge(source.table, on=key_col)
+
+    def _pivot_step(self, index_cols: List[str], columns: List[str], value_col: List[str], agg_func: str):
+        return lambda df: df.pivot_table(index=index_cols, columns=columns, values=value_col, aggfunc=agg_func,
+                                         observed=True)
+
+    def _fill_step(self, col_name: str, old_value, new_value):
+        # Values are given as code literals, e.g. '"Visa"'
+        old_value = parse_literal(old_value) if isinstance(old_value, str) else old_value
+        new_value = parse_literal(new_value) if isinstance(new_value, str) else new_value
+        return lambda df: df.replace({col_name: old_value}, new_value)
+
     def chain_operation(self, op, args):
-        self.code += getattr(self, op)(**args)
+        code = getattr(self, op)(**args)
+        self.code += code
+        self.plan.add(op, args, getattr(self, f'_{op}_step')(**args), code)
         super(DataFrameOperation, self).chain_operation(op, args)
 
+    def step_timings(self):
+        return self.plan.timings
+
     def materialize(self, new_label):
-        new_df = eval(self.code)
+        new_df = self.plan.run(self.sources[0].table, collectors=self.step_collectors)
         super(DataFrameOperation, self).materialize(new_label)
         return self.artifact_class(label=self.new_label,
                                    from_df=new_df,
-                                   schema_map=self.current_schema_map)
+                                   schema_map=self.current_schema_map,
+                                   categorical=getattr(self.sources[0], 'categorical', False),
+                                   file_format=self.sources[0].file_format,
+                                   compression=self.sources[0].compression,
+                                   csv_engine=self.sources[0].csv_engine,
+                                   csv_chunk_size=self.sources[0].csv_chunk_size,
+                                   csv_exact_floats=self.sources[0].csv_exact_floats)
 
 
 class DataFrameWorkflow(Workflow):
@@ -125,4 +324,7 @@ class DataFrameWorkflow(Workflow):
         self.operator_class = DataFrameOperation
 
     def initialize_new_artifact(self, label=None, filename=None, schema_map=None):
-        return DataFrameArtifact(label, filename=filename, schema_map=schema_map)
+        return DataFrameArtifact(label, filename=filename, schema_map=schema_map, categorical=self.categorical,
+                                 file_format=self.file_format, compression=self.compression,
+                                 csv_engine=self.csv_engine, csv_chunk_size=self.csv_chunk_size,
+                                 csv_exact_floats=self.verify_hashes)
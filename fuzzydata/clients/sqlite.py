@@ -1,4 +1,5 @@
 import math
+import time
 from typing import List
 
 import pandas
@@ -6,7 +7,8 @@ import sqlalchemy
 import logging
 
 from fuzzydata.core.artifact import Artifact
-from fuzzydata.core.generator import generate_table
+from fuzzydata.core.generator import generate_table, generate_table_chunks
+from fuzzydata.core.monitor import start_collectors, stop_collectors
 from fuzzydata.core.operation import Operation, T
 from fuzzydata.core.workflow import Workflow
 
@@ -26,15 +28,15 @@ class SQLArtifact(Artifact):
         self.pd = pandas
 
         self._deserialization_function = {
-            'csv': self.pd.read_csv
-        }
-        self._serialization_function = {
-            'csv': 'to_csv'
+            'csv': self.pd.read_csv,
+            'parquet': self.pd.read_parquet,
+            'feather': self.pd.read_feather,
         }
 
         self._get_table = f'SELECT * FROM `{self.label}`'
         self._del_table = f'DROP TABLE IF EXISTS `{self.label}`'
         self._num_rows = f'SELECT COUNT(*) FROM `{self.label}`'
+        self._row_count = None
 
         if self.from_sql:
             self.sql_engine.execute(self.from_sql)
@@ -44,47 +46,79 @@ class SQLArtifact(Artifact):
         elif from_df is not None:
             self.from_df(from_df)
 
-    def generate(self, num_rows, schema):
-        df = generate_table(num_rows, column_dict=schema)
+    def generate(self, num_rows, schema, **kwargs):
+        df = generate_table(num_rows, column_dict=schema, **kwargs)
         df.to_sql(self.label, con=self.sql_engine, if_exists='replace')
         self.schema_map = schema
         if self.sync_df:
             self.table = df
         # self.in_memory = True
 
+    def generate_chunked(self, num_rows, schema, chunk_size, stats=False, **kwargs):
+        # stats() is a single query over the table, nothing to gain from computing it on the chunks
+        for ix, chunk in enumerate(generate_table_chunks(num_rows, column_dict=schema, chunk_size=chunk_size,
+                                                         **kwargs)):
+            chunk.to_sql(self.label, con=self.sql_engine, if_exists='replace' if ix == 0 else 'append')
+        self.schema_map = schema
+
     def from_df(self, df):
         df.to_sql(self.label, con=self.sql_engine, if_exists='replace', index=False)
         if self.sync_df:
             self.table = df
 
-    def deserialize(self, filename=None):
+    def deserialize(self, filename=None, columns=None, memory_map=False):
         if not filename:
             filename = self.filename
 
-        df = self._deserialization_function[self.file_format](filename)
-        df.to_sql(self.label, con=self.sql_engine, if_exists='replace')
+        df = self.read_table(filename, columns=columns, memory_map=memory_map)
+        # Tables written from this database already carry their index as a column, do not add another one
+        df.to_sql(self.label, con=self.sql_engine, if_exists='replace', index='index' not in df.columns)
         if self.sync_df:
             self.table = df
         # self.in_memory = True
 
+    def restore(self):
+        # The table (or view) is still in the workflow's database unless the database was removed
+        inspector = sqlalchemy.inspect(self.sql_engine)
+        if self.label not in inspector.get_table_names() + inspector.get_view_names():
+            self.deserialize(self.filename)
+
     def serialize(self, filename=None):
         if not filename:
             filename = self.filename
 
         df = self.pd.read_sql(self._get_table, con=self.sql_engine)
-        serialization_method = getattr(df, self._serialization_function[self.file_format])
-        serialization_method(filename)
+        self.write_table(df, filename)
 
     def destroy(self):
         if self.sync_df:
             del self.table
-        self.sql_engine.execute(self._del_table)
+        if self.label in sqlalchemy.inspect(self.sql_engine).get_view_names():
+            self.sql_engine.execute(f'DROP VIEW IF EXISTS `{self.label}`')
+        else:
+            self.sql_engine.execute(self._del_table)
 
     def to_df(self):
         return self.pd.read_sql(self._get_table, con=self.sql_engine)
 
     def __len__(self):
-        return self.sql_engine.execute(self._num_rows).first()[0]
+        if self._stats is not None:
+            return self._stats['num_rows']
+        # Artifacts are immutable, count the rows of the (possibly deeply nested) view only once
+        if self._row_count is None:
+            self._row_count = self.sql_engine.execute(self._num_rows).first()[0]
+        return self._row_count
+
+    def compute_stats(self):
+        # A single aggregate query over the table or view instead of loading it
+        columns = list(self.sql_engine.execute(f'SELECT * FROM `{self.label}` LIMIT 0').keys())
+        aggregates = ''.join(f', COUNT(`{c}`), COUNT(DISTINCT `{c}`)' for c in columns)
+        row = self.sql_engine.execute(f'SELECT COUNT(*){aggregates} FROM `{self.label}`').first()
+        num_rows = row[0]
+        return {'num_rows': num_rows,
+                'bytes': None,
+                'columns': {c: {'nulls': num_rows - row[1 + 2 * ix], 'distinct': row[2 + 2 * ix]}
+                            for ix, c in enumerate(columns)}}
 
 
 class SQLOperation(Operation['SQLArtifact']):
@@ -96,10 +130,13 @@ class SQLOperation(Operation['SQLArtifact']):
             'mean': 'AVG'
         }
         self.code = f"SELECT * FROM `{self.sources[0].label}`"
+        self.stages = []  # Query of every chained operation, reading from {source}
+        self.stage_timings = []
 
     def sample(self, frac: float) -> SQLArtifact:
         super(SQLOperation, self).sample(frac)
-        num_rows = len(self.sources[0])
+        # Rows of the result chained so far, which is the source itself unless operations were chained before
+        num_rows = self.sources[0].sql_engine.execute(f'SELECT COUNT(*) FROM ({self.code})').first()[0]
         sample_rows = math.ceil(num_rows*frac)
         sql_sample_stmt = f"SELECT * FROM {{source}} ORDER BY RANDOM() " \
                           f"LIMIT {sample_rows} "
@@ -143,7 +180,7 @@ class SQLOperation(Operation['SQLArtifact']):
     def merge(self, key_col: List[str]) -> T:
         super(SQLOperation, self).merge(key_col)
         sql_select_stmt = f"SELECT * FROM {{source}} " \
-                          f"INNER JOIN `{self.sources[1].label}` " \
+                          f"INNER JOIN `{self.sources[self.num_merges].label}` " \
                           f"USING (`{key_col}`)"
         return sql_select_stmt
 
@@ -162,16 +199,52 @@ class SQLOperation(Operation['SQLArtifact']):
         new_code = getattr(self, op)(**args)
         logger.debug(f'Code before chaining: {self.code}')
         self.code = new_code.replace('{source}', f'({self.code})')
+        self.stages.append(new_code)
         logger.debug(f'Code after chaining: {self.code}')
+        super(SQLOperation, self).chain_operation(op, args)
+
+    def step_timings(self):
+        return self.stage_timings
+
+    def _run_stages(self):
+        """ Run the chained queries one at a time, each into a temporary table read by the next one, to time them """
+        self.stage_timings = []
+        source = f'`{self.sources[0].label}`'
+        with self.sources[0].sql_engine.connect() as con:
+            for ix, (op_dict, stage) in enumerate(zip(self.op_list, self.stages)):
+                table = f'`_{self.new_label}_stage_{ix}`'
+                states = start_collectors(self.step_collectors)
+                start_time = time.perf_counter()
+                con.execute(f'CREATE TEMP TABLE {table} AS {stage.replace("{source}", source)}')
+                end_time = time.perf_counter()
+                metrics = stop_collectors(self.step_collectors, states)
+                self.stage_timings.append({
+                    'step': ix,
+                    'op': op_dict['op'],
+                    **metrics,
+                    'start_time': start_time,
+                    'end_time': end_time,
+                    'elapsed_time': end_time - start_time
+                })
+                source = table
+            for ix in range(len(self.stages)):
+                con.execute(f'DROP TABLE IF EXISTS `_{self.new_label}_stage_{ix}`')
 
     def materialize(self, new_label):
         super(SQLOperation, self).materialize(new_label)
+        if self.step_collectors:
+            self._run_stages()
         logger.debug(f'Executing SQL code: {self.code}')
         self.code = f'CREATE VIEW `{self.new_label}` AS {self.code}'
         return self.artifact_class(label=self.new_label,
                                    sql_engine=self.sources[0].sql_engine,
                                    from_sql=self.code,
-                                   schema_map=self.current_schema_map)
+                                   schema_map=self.current_schema_map,
+                                   file_format=self.sources[0].file_format,
+                                   compression=self.sources[0].compression,
+                                   csv_engine=self.sources[0].csv_engine,
+                                   csv_chunk_size=self.sources[0].csv_chunk_size,
+                                   csv_exact_floats=self.sources[0].csv_exact_floats)
 
 
 class SQLWorkflow(Workflow):
@@ -180,9 +253,14 @@ class SQLWorkflow(Workflow):
         super(SQLWorkflow, self).__init__(*args, **kwargs)
         self.artifact_class = SQLArtifact
         self.operator_class = SQLOperation
+        # Every fused operation nests its query one subquery deeper, SQLite's parser overflows at about 15 levels
+        self.max_fused_ops = 8
         if not sql_string:
             sql_string = f"sqlite:///{self.out_dir}/{self.name}.db"
         self.sql_engine = sqlalchemy.create_engine(sql_string)
 
     def initialize_new_artifact(self, label=None, filename=None, schema_map=None):
-        return SQLArtifact(label, filename=filename, sql_engine=self.sql_engine, schema_map=schema_map)
+        return SQLArtifact(label, filename=filename, sql_engine=self.sql_engine, schema_map=schema_map,
+                           file_format=self.file_format, compression=self.compression,
+                           csv_engine=self.csv_engine, csv_chunk_size=self.csv_chunk_size,
+                           csv_exact_floats=self.verify_hashes)
@@ -8,42 +8,242 @@ This module contains the Artifact abstract base class definition for clients to
 :license: MIT, see LICENSE for more details.
 """
 
+import csv
+import hashlib
+import os
 from abc import abstractmethod, ABC
+from typing import Dict, List
 
+import numpy as np
 import pandas as pd
 import logging
+from pandas.api.types import union_categoricals
+from pandas.util import hash_pandas_object
+
+from fuzzydata.core.generator import get_inverse_function_dict, get_provider
 
 logger = logging.getLogger(__name__)
 
+# Formats artifacts can be serialized to. Parquet and Feather (Arrow IPC) keep dtypes and require pyarrow.
+SUPPORTED_FILE_FORMATS = ('csv', 'parquet', 'feather')
+
+
+def file_format_of(filename, default='csv') -> str:
+    """
+    :param filename: Filename of a serialized artifact
+    :param default: Format to assume if the extension of filename is not a supported format
+    :return: File format of the artifact, from the extension of its filename
+    """
+    extension = os.path.splitext(str(filename))[1].lstrip('.')
+    return extension if extension in SUPPORTED_FILE_FORMATS else default
+
+
+# Non-numeric providers whose values are not strings, their columns are left to type inference when reading CSV
+_INFERRED_PROVIDERS = ('boolean', 'pybool', 'unix_time')
+
+
+def schema_dtypes(schema_map: Dict, categorical=False) -> Dict:
+    """
+    Dtypes to parse the CSV columns of an artifact with, from its schema map. Columns of string providers are read as
+    strings, which keeps e.g. the leading zeros of postcodes and skips type inference, or as category if they are
+    groupable and categorical is set. Numeric columns are left to the parser, as operations may turn integers into
+    floats or fill them with NaNs.
+    :param schema_map: Mapping of column_name: faker_provider of the artifact
+    :param categorical: Read groupable string columns as category
+    :return: Dict of column label -> dtype
+    """
+    inverse = get_inverse_function_dict()
+    dtypes = {}
+    for col, spec in schema_map.items():
+        provider = get_provider(spec)
+        col_types = inverse.get(provider, [])
+        if not col_types or 'numeric' in col_types or provider in _INFERRED_PROVIDERS:
+            continue
+        dtypes[col] = 'category' if categorical and 'groupable' in col_types else str
+    return dtypes
+
+
+def csv_header(filename) -> List[str]:
+    """
+    :param filename: CSV file
+    :return: Column labels in the first line of the file
+    """
+    with open(filename, newline='') as infile:
+        return next(csv.reader(infile), [])
+
+
+def column_hash(values) -> str:
+    """
+    :param values: Series (or Index) of values
+    :return: Hex digest of the values, in order. Category columns hash like the values they hold.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(hash_pandas_object(values, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def content_hashes(df) -> Dict[str, str]:
+    """
+    Content hashes of a dataframe, computed column by column with pandas' vectorized hash_pandas_object()
+    :param df: Dataframe (pandas or API-compatible)
+    :return: Dict of column label -> hash of its values, with the hash of the index under None
+    """
+    if not isinstance(df, pd.DataFrame):
+        df = df._to_pandas()
+    hashes = {None: column_hash(df.index)}
+    for ix, col in enumerate(df.columns):
+        hashes[str(col)] = column_hash(df.iloc[:, ix])
+    return hashes
+
+
+def column_dtypes(df) -> Dict[str, str]:
+    """
+    :param df: Dataframe (pandas or API-compatible)
+    :return: Dict of column label -> name of its dtype, with the dtype of the index under None
+    """
+    dtypes = {None: str(df.index.dtype)}
+    for ix, col in enumerate(df.columns):
+        dtypes[str(col)] = str(df.dtypes.iloc[ix])
+    return dtypes
+
+
+def combine_hashes(hashes: Dict[str, str], dtypes: Dict[str, str] = None) -> str:
+    """
+    :param hashes: Column hashes returned by content_hashes()
+    :param dtypes: (optional) Column dtypes returned by column_dtypes(), to tell apart tables that hold the same values
+    with different dtypes (e.g. object and category columns)
+    :return: Hash of the whole table, which depends on the column labels, their order and the index as well
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for col, col_hash in hashes.items():
+        digest.update(f'{col}\x00{col_hash}\x00'.encode())
+    for col, dtype in (dtypes or {}).items():
+        digest.update(f'{col}\x01{dtype}\x00'.encode())
+    return digest.hexdigest()
+
+
+def table_stats(df, num_bytes=None) -> Dict:
+    """
+    :param df: Dataframe (pandas or API-compatible)
+    :param num_bytes: (optional) Bytes held in memory by the table
+    :return: Dict with the number of rows, bytes and, for every column, the number of null and distinct values
+    """
+    if not isinstance(df, pd.DataFrame):
+        df = df._to_pandas()
+    columns = {}
+    for ix, col in enumerate(df.columns):
+        values = df.iloc[:, ix]
+        columns[str(col)] = {'nulls': int(values.isna().sum()), 'distinct': int(values.nunique(dropna=True))}
+    return {'num_rows': len(df.index), 'bytes': num_bytes, 'columns': columns}
+
+
+class StatsAccumulator:
+    """
+    Computes the statistics of table_stats() over a table that is only seen chunk by chunk, e.g. while it is streamed
+    to disk. Only the distinct values of every column are kept.
+    """
+
+    def __init__(self):
+        self.num_rows = 0
+        self.nulls = {}
+        self.distinct = {}
+
+    def add(self, df) -> None:
+        """
+        :param df: Next chunk of the table (pandas dataframe)
+        """
+        self.num_rows += len(df.index)
+        for ix, col in enumerate(df.columns):
+            values = df.iloc[:, ix]
+            self.nulls[str(col)] = self.nulls.get(str(col), 0) + int(values.isna().sum())
+            self.distinct.setdefault(str(col), set()).update(values.dropna().unique())
+
+    def result(self, num_bytes=None) -> Dict:
+        """
+        :param num_bytes: (optional) Bytes held in memory by the table
+        :return: Statistics of all chunks added, see table_stats()
+        """
+        columns = {col: {'nulls': self.nulls[col], 'distinct': len(self.distinct[col])} for col in self.nulls}
+        return {'num_rows': self.num_rows, 'bytes': num_bytes, 'columns': columns}
+
+
+def flatten_table(df):
+    """
+    Prepare a dataframe for a columnar format (Parquet, Feather), which only supports string column labels and, for
+    Feather, a default index: MultiIndex columns (e.g. produced by a pivot) are joined into single labels, named index
+    levels (e.g. the index columns of a pivot) become columns and an unnamed index (e.g. left by a sample) is dropped.
+    :param df: Dataframe to be written
+    :return: Dataframe with string column labels and a default index
+    """
+    if isinstance(df.columns, pd.MultiIndex):
+        df = df.set_axis(['__'.join(str(x) for x in col if str(x) != '') for col in df.columns], axis=1)
+    if any(name is not None for name in df.index.names):
+        df = df.reset_index()
+    elif not (isinstance(df.index, pd.RangeIndex) and df.index.start == 0 and df.index.step == 1):
+        df = df.reset_index(drop=True)
+    if not all(isinstance(c, str) for c in df.columns):
+        df = df.set_axis([str(c) for c in df.columns], axis=1)
+    return df
+
 
 class Artifact(ABC):
     """
     Generic Artifact representation
     """
     def __init__(self, label, schema_map=None, filename=None, file_format='csv',
-                 in_memory=False):
+                 in_memory=False, compression=None, csv_engine=None, csv_chunk_size=None, csv_exact_floats=False):
         """ Artifact Instantiation Method
         :param label: The label to provide for this artifact
         :param schema_map: Mapping of column_name: faker_provider for this artifact
         :param filename: Path to filename to be used for serialization
-        :param file_format: File format to be used for this artifact serialization (default CSV)
+        :param file_format: File format to be used for this artifact serialization, one of SUPPORTED_FILE_FORMATS
+        (default CSV)
         :param in_memory: Flag if the artifact is in memory or not
+        :param compression: (optional) Compression codec for parquet (e.g. snappy, zstd, gzip) and feather (lz4, zstd,
+        uncompressed) serialization, the library default if not specified
+        :param csv_engine: (optional) Parser engine used to read CSV files (c, python or pyarrow), the pandas default if
+        not specified
+        :param csv_chunk_size: (optional) Parse CSV files in chunks of this many rows, with the c or python engine
+        :param csv_exact_floats: Parse floats in CSV files back to exactly the values written (slower with the c
+        engine), e.g. to verify content hashes
         """
+        if file_format not in SUPPORTED_FILE_FORMATS:
+            raise ValueError(f'Unsupported file format {file_format}, expected one of {SUPPORTED_FILE_FORMATS}')
         self.filename = filename
         self.label = label
         self.in_memory = in_memory
         self.file_format = file_format
+        self.compression = compression
+        self.csv_engine = csv_engine
+        self.csv_chunk_size = csv_chunk_size
+        self.csv_exact_floats = csv_exact_floats
         self.schema_map = schema_map
+        self._hashes = None
+        self._dtypes = None
+        self._stats = None
 
         logger.debug(f'New Artifact: {label}')
 
     @abstractmethod
-    def generate(self, num_rows, schema):
+    def generate(self, num_rows, schema, **kwargs):
         """ Abstract method which invokes generate_table function and stores it somehow
         :param num_rows: Number of rows to be generated
         :param schema: Mapping of column_name: faker_provider for this artifact
+        :param kwargs: Additional generation options passed on to generate_table (e.g. pool_sizes)
         """
 
+    def generate_chunked(self, num_rows, schema, chunk_size, stats=False, **kwargs):
+        """ Generate this artifact chunk by chunk, writing each chunk out as soon as it is produced, so that memory
+        use is bounded by chunk_size instead of num_rows. Clients that support streaming generation override this.
+        :param num_rows: Number of rows to be generated
+        :param schema: Mapping of column_name: faker_provider for this artifact
+        :param chunk_size: Number of rows generated and written at a time
+        :param stats: Also compute the statistics of the artifact (see stats()) from the chunks, instead of reading
+        the whole table back later
+        :param kwargs: Additional generation options passed on to generate_table_chunks
+        """
+        raise NotImplementedError(f'Streaming generation is not supported by {self.__class__.__name__}')
+
     @abstractmethod
     def from_df(self, df):
         """ Abstract method which accepts a dataframe as input and stores inside this artifact object
@@ -51,9 +251,11 @@ class Artifact(ABC):
         """
 
     @abstractmethod
-    def deserialize(self, filename):
+    def deserialize(self, filename, columns=None, memory_map=False):
         """ Abstract method to load artifact from disk using some serialization method
         :param filename: Filename to be written out to
+        :param columns: (optional) Load only these columns
+        :param memory_map: Memory-map the file instead of reading it, for the formats that support it
         """
 
     @abstractmethod
@@ -66,6 +268,183 @@ class Artifact(ABC):
     def destroy(self):
         """ Destructor when this artifact needs to deleted from memory"""
 
+    def write_table(self, df, filename) -> None:
+        """ Write a dataframe holding the data of this artifact to filename in this artifact's file format, with its
+        compression. Clients serializing through dataframes use this.
+        :param df: Dataframe (pandas or API-compatible) to be written
+        :param filename: Filename to be written to
+        """
+        if self.file_format == 'csv':
+            df.to_csv(filename)
+            return
+        options = {'compression': self.compression} if self.compression else {}
+        df = flatten_table(df)
+        if self.file_format == 'parquet':
+            df.to_parquet(filename, index=False, **options)
+        else:
+            df.to_feather(filename, **options)
+
+    def read_table(self, filename, columns=None, memory_map=False):
+        """ Read a dataframe from filename, in the file format given by its extension (this artifact's file format if
+        the extension is not a supported format). Clients deserializing through dataframes use this.
+        :param filename: Filename to be read from
+        :param columns: (optional) Read only these columns, the others are never parsed (CSV) or paged in (Parquet,
+        Feather)
+        :param memory_map: Memory-map Parquet and Feather files instead of reading them. Uncompressed Feather files are
+        converted to pandas without copying the numeric columns, so their pages are only faulted in when a column is
+        accessed and are shared through the OS page cache with every other process mapping the same file.
+        :return: The dataframe
+        """
+        file_format = file_format_of(filename, self.file_format)
+        if memory_map and file_format == 'feather' and self.pd is pd:
+            import pyarrow as pa
+            from pyarrow import feather
+            allocated = pa.total_allocated_bytes()
+            table = feather.read_table(filename, columns=columns, memory_map=True)
+            if pa.total_allocated_bytes() - allocated > table.nbytes // 2:
+                # Compressed buffers are decompressed into arrow's memory pool instead of being read from the map
+                logger.warning(f'{filename} is compressed, memory-mapping it does not avoid copying it into memory. '
+                               f"Write feather artifacts with compression='uncompressed' to map them.")
+            # split_blocks keeps one block per column, so that columns are not consolidated (copied) together
+            return table.to_pandas(split_blocks=True)
+        if file_format == 'csv':
+            return self.read_csv(filename, columns=columns)
+        options = {}
+        if columns is not None:
+            options['columns'] = columns
+        if memory_map and file_format == 'parquet' and self.pd is pd:
+            options['memory_map'] = True
+        return self._deserialization_function[file_format](filename, **options)
+
+    def read_csv(self, filename, columns=None):
+        """ Read a CSV file written by write_table(), driven by the schema map of this artifact if it has one: the index
+        written by to_csv() is restored instead of being read as an "Unnamed: 0" column, columns are parsed with the
+        dtypes of schema_dtypes() and only the columns given are parsed at all.
+        :param filename: Filename to be read from
+        :param columns: (optional) Read only these columns
+        :return: The dataframe
+        """
+        options = {'engine': self.csv_engine} if self.csv_engine else {}
+        if self.csv_exact_floats and self.csv_engine in (None, 'c'):
+            # Floats are written with repr(), the default parser may be off by one unit in the last place
+            options['float_precision'] = 'round_trip'
+        header = csv_header(filename)
+        if self.schema_map:
+            dtypes = schema_dtypes(self.schema_map, categorical=getattr(self, 'categorical', False))
+            options['dtype'] = {c: t for c, t in dtypes.items() if c in header}
+        has_index = bool(header) and header[0] == ''
+        if has_index:
+            options['index_col'] = 0
+        if columns is not None:
+            wanted = set(columns)
+            # Positions rather than labels, so that the unnamed index column can be kept as well
+            options['usecols'] = [ix for ix, c in enumerate(header) if c in wanted or (ix == 0 and has_index)]
+        if not self.csv_chunk_size or self.pd is not pd:
+            return self._deserialization_function['csv'](filename, **options)
+
+        # Keep the values of every column in separate arrays and drop each chunk once it is parsed, then join the
+        # arrays column by column, so that at most one column is held twice rather than the whole table
+        values, index, labels = {}, [], None
+        for chunk in self._deserialization_function['csv'](filename, chunksize=self.csv_chunk_size, **options):
+            labels = chunk.columns
+            index.append(chunk.index)
+            for ix, col in enumerate(labels):
+                column = chunk.iloc[:, ix]
+                values.setdefault(col, []).append(column.array if column.dtype == 'category'
+                                                  else column.to_numpy(copy=True))
+            del chunk
+        if labels is None:
+            return self._deserialization_function['csv'](filename, **options)
+        index = index[0].append(index[1:])
+        series = []
+        for col in labels:
+            parts = values.pop(col)
+            # Every chunk has its own categories, union_categoricals() recodes them to their union once
+            joined = union_categoricals(parts) if isinstance(parts[0], pd.Categorical) else np.concatenate(parts)
+            del parts
+            series.append(pd.Series(joined, index=index, name=col, copy=False))
+        return pd.concat(series, axis=1, copy=False)
+
+    def content_hashes(self) -> Dict[str, str]:
+        """ Content hashes of the columns of this artifact, see content_hashes(). Artifacts are immutable, so they are
+        computed once and cached.
+        :return: Dict of column label -> hash of its values, with the hash of the index under None
+        """
+        if self._hashes is None:
+            df = self.to_df()
+            self._hashes, self._dtypes = content_hashes(df), column_dtypes(df)
+        return self._hashes
+
+    def content_hash(self, with_dtypes=False) -> str:
+        """ Hash of the content of this artifact, equal for artifacts holding the same table
+        :param with_dtypes: Whether the hash also depends on the column dtypes, e.g. to tell apart the files of columnar
+        formats, which store them
+        :return: Hex digest
+        """
+        hashes = self.content_hashes()
+        return combine_hashes(hashes, self._dtypes if with_dtypes else None)
+
+    def stats(self) -> Dict:
+        """ Statistics of this artifact (see table_stats()), computed once and cached as artifacts are immutable
+        :return: Dict with num_rows, bytes and the nulls and distinct values of every column
+        """
+        if self._stats is None:
+            self._stats = self.compute_stats()
+        return self._stats
+
+    @property
+    def has_stats(self) -> bool:
+        """ Whether the statistics of this artifact are available without computing them """
+        return self._stats is not None
+
+    def seed_stats(self, stats: Dict, columns: List[str] = None) -> None:
+        """ Use statistics recorded earlier, e.g. by the workflow that is being replayed, instead of computing them
+        :param stats: Dict returned by stats()
+        :param columns: (optional) Only these columns of the artifact were loaded
+        """
+        self._stats = {
+            'num_rows': stats['num_rows'],
+            # The bytes depend on the client and on how the artifact was loaded
+            'bytes': self.memory_usage() or None,
+            'columns': {col: col_stats for col, col_stats in stats['columns'].items()
+                        if columns is None or col in columns},
+        }
+
+    def compute_stats(self) -> Dict:
+        """ Compute the statistics of this artifact from its dataframe. Clients that can compute them where the data
+        is kept (e.g. in a database) override this.
+        :return: Dict with num_rows, bytes and the nulls and distinct values of every column
+        """
+        df = self.to_df()
+        return table_stats(df, num_bytes=self.memory_usage() or None)
+
+    def restore(self):
+        """ Restore this artifact from self.filename, written by an earlier run of the workflow that is being resumed.
+        Clients that can load artifacts lazily or keep them elsewhere override this.
+        """
+        self.deserialize(self.filename)
+
+    def memory_usage(self) -> int:
+        """ Approximate number of bytes held in memory by this artifact, 0 for clients that keep data elsewhere """
+        return 0
+
+    def spill(self, filename) -> bool:
+        """ Move the in-memory data of this artifact to filename to release memory, it is reloaded transparently on
+        next access. Unlike serialize(), the spill format must be lossless. Clients that hold data in memory override
+        this.
+        :param filename: Filename to spill to
+        :return: True if memory was released
+        """
+        return False
+
+    def unload(self, serialize=True) -> bool:
+        """ Serialize this artifact to self.filename and release its memory, for artifacts that are no longer
+        needed in memory. Clients that hold data in memory override this.
+        :param serialize: Write the artifact to self.filename first, False if it was already written there
+        :return: True if memory was released
+        """
+        return False
+
     @abstractmethod
     def to_df(self) -> pd.DataFrame:
         """ Return a dataframe representation of this artifact
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+"""
+fuzzydata.core.cache
+~~~~~~~~~~~~
+This module contains an on-disk cache of generated tables, so that repeated runs can skip table generation
+:copyright: (c) Suhail Rehman 2022
+:license: MIT, see LICENSE for more details.
+"""
+
+import glob
+import hashlib
+import json
+import logging
+import os
+from importlib import metadata
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Version of the tables generated for the same parameters, part of every cache key. Bump it whenever a change to the
+# generator (e.g. how values are sampled) changes its output, so that stale tables are not served from old caches.
+CACHE_VERSION = 1
+
+
+def _generator_versions():
+    """ Versions of the libraries that generated tables depend on, part of every cache key """
+    try:
+        faker_version = metadata.version('faker')
+    except metadata.PackageNotFoundError:
+        faker_version = None
+    return {'cache': CACHE_VERSION, 'faker': faker_version, 'numpy': np.__version__}
+
+
+class TableCache:
+    """
+    Content-addressed cache of generated tables stored as pickle files in a directory. Entries are keyed by
+    everything that determines a generated table (schema map, number of rows, seed and generation options, along with
+    the generator and library versions), and the least recently used entries are evicted once the cache grows over
+    max_bytes.
+    """
+
+    def __init__(self, directory, max_bytes=None):
+        """
+        Open (or create) a table cache in directory
+        :param directory: Directory to store the cached tables in
+        :param max_bytes: (optional) Size cap for the cache in bytes, unbounded if not specified
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def make_key(**kwargs) -> str:
+        """
+        Compute the cache key for a table, which also depends on CACHE_VERSION and the faker and numpy versions
+        :param kwargs: JSON-serializable parameters that determine the table contents
+        :return: hex digest identifying the table
+        """
+        payload = {'params': kwargs, 'versions': _generator_versions()}
+        return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f'{key}.pkl')
+
+    def get(self, key) -> pd.DataFrame:
+        """
+        Load a table from the cache
+        :param key: Cache key from make_key
+        :return: The cached dataframe, or None on a cache miss
+        """
+        path = self._path(key)
+        if not os.path.exists(path):
+            self.misses += 1
+            logger.debug(f'Table cache miss: {key}')
+            return None
+        # Refresh the modification time, which is used as the LRU order
+        os.utime(path)
+        self.hits += 1
+        logger.info(f'Loading cached table {path}')
+        return pd.read_pickle(path)
+
+    def put(self, key, df) -> None:
+        """
+        Store a table in the cache and evict old entries if the cache is over its size cap
+        :param key: Cache key from make_key
+        :param df: Dataframe to be cached
+        """
+        path = self._path(key)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        pd.DataFrame(df).to_pickle(tmp_path)
+        os.replace(tmp_path, path)
+        self.evict(keep=path)
+
+    def evict(self, keep=None) -> None:
+        """
+        Delete least recently used entries until the cache fits within max_bytes
+        :param keep: (optional) Path of an entry that must not be evicted, e.g. the one just written
+        """
+        if self.max_bytes is None:
+            return
+        entries = sorted(glob.glob(os.path.join(self.directory, '*.pkl')), key=os.path.getmtime)
+        total = sum(os.path.getsize(e) for e in entries)
+        for entry in entries:
+            if total <= self.max_bytes:
+                break
+            if entry == keep:
+                continue
+            total -= os.path.getsize(entry)
+            logger.info(f'Evicting cached table {entry}')
+            os.remove(entry)
@@ -1,19 +1,22 @@
 import itertools
 import os
 import string
+import sys
 from collections import defaultdict
 
 import pandas
 import numpy as np
 import logging
 
-from functools import partial
-from typing import Callable, Dict, List
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
+from typing import Callable, Dict, Iterator, List
 
 import pandas as pd
-from faker import Faker
 from itertools import chain
 
+from fuzzydata.core.cache import TableCache
+
 
 logging.getLogger('faker').setLevel(logging.ERROR)
 logger = logging.getLogger(__name__)
@@ -22,6 +25,13 @@ logger = logging.getLogger(__name__)
 _THIS_DIR = os.path.dirname(os.path.abspath(__file__))
 _UNIQUE_DICTIONARY = string.ascii_letters+string.digits
 
+# Maximum number of distinct values drawn from a faker provider for a single column
+_DEFAULT_POOL_SIZE = 10000
+# Maximum number of top-up rounds when a provider returns duplicate values while filling a pool
+_POOL_DRAW_ROUNDS = 3
+# Value distributions supported in column specs, see get_column_spec
+_DISTRIBUTIONS = ('uniform', 'zipf')
+
 
 def load_function_dict(directory=_THIS_DIR+'/config/'):
     return {
@@ -40,43 +50,297 @@ def generate_inverse_function_dict(function_dict):
     return inv_functions
 
 
-_gen_functions = load_function_dict()
-logger.debug(_gen_functions)
-_faker_cols = list(set(chain(*_gen_functions.values())))
-_inv_gen_functions = generate_inverse_function_dict(_gen_functions)
+@lru_cache(maxsize=None)
+def get_function_dict():
+    """ Faker provider tables (column type -> providers), read from the config directory on first use """
+    function_dict = load_function_dict()
+    logger.debug(function_dict)
+    return function_dict
+
+
+@lru_cache(maxsize=None)
+def get_faker_cols():
+    """ List of all faker providers in the provider tables """
+    return list(set(chain(*get_function_dict().values())))
+
+
+@lru_cache(maxsize=None)
+def get_inverse_function_dict():
+    """ Mapping of faker provider -> list of column types it belongs to """
+    return generate_inverse_function_dict(get_function_dict())
 
 
 def generate_prefix(symbol_dict: str, size: int=5) -> str:
     return ''.join(np.random.choice(list(symbol_dict), size))
 
 
-def generate_table(num_rows: int=100, column_dict: Dict=None, pd=pandas, key_series=None) -> pandas.DataFrame:
+def get_provider(spec) -> str:
+    """ Return the faker provider of a schema map entry (a provider name or a column spec dict) """
+    return spec if isinstance(spec, str) else spec['provider']
+
+
+def get_column_spec(spec) -> Dict:
+    """
+    Normalize a schema map entry into a column spec. Schema map entries are either a faker provider name, or a dict
+    with a 'provider' key and any of the following value distribution settings:
+        cardinality: Number of distinct values in the column (default: pool size of the provider)
+        distribution: 'uniform' (default) or 'zipf'
+        exponent: Zipf exponent s, the k-th most frequent value is drawn with probability ~ 1/k^s (default 1.0)
+        hot_fraction: Fraction of rows set to the single most frequent value, on top of the distribution (default 0.0)
+    :param spec: Schema map entry
+    :return: Dict with the provider and all of the settings above
+    """
+    if isinstance(spec, str):
+        spec = {'provider': spec}
+    column_spec = {'cardinality': None, 'distribution': 'uniform', 'exponent': 1.0, 'hot_fraction': 0.0, **spec}
+    if column_spec['distribution'] not in _DISTRIBUTIONS:
+        raise ValueError(f"Unknown distribution {column_spec['distribution']} for {column_spec['provider']}, "
+                         f"expected one of {_DISTRIBUTIONS}")
+    if not 0.0 <= column_spec['hot_fraction'] <= 1.0:
+        raise ValueError(f"hot_fraction must be within [0, 1], got {column_spec['hot_fraction']}")
+    return column_spec
+
+
+def is_skewed(column_spec: Dict) -> bool:
+    """ Check if a column spec (see get_column_spec) describes a non-uniform value distribution """
+    return column_spec['distribution'] != 'uniform' or column_spec['hot_fraction'] > 0
+
+
+def zipf_cdf(num_values: int, exponent: float=1.0) -> np.ndarray:
+    """ Cumulative distribution of a Zipf distribution with exponent over ranks 1..num_values """
+    weights = 1.0 / np.arange(1, num_values + 1) ** exponent
+    cdf = np.cumsum(weights)
+    return cdf / cdf[-1]
+
+
+def _uniform_ints(u: np.ndarray, low, high) -> np.ndarray:
+    """ Map uniform [0, 1) draws to integers in [low, high] """
+    return (low + u * (high - low + 1)).astype(np.int64)
+
+
+def _random_number(rng: np.random.Generator, n: int) -> np.ndarray:
+    # faker: randint(0, 10**digits - 1) with digits in [1, 9]
+    u = rng.random((n, 2))
+    return (u[:, 1] * 10 ** _uniform_ints(u[:, 0], 1, 9)).astype(np.int64)
+
+
+def _pyfloat(rng: np.random.Generator, n: int) -> np.ndarray:
+    # faker: random sign, right_digits in [1, 14] and left_digits = 15 - right_digits, each filled with random digits
+    u = rng.random((n, 4))
+    right_digits = _uniform_ints(u[:, 0], 1, sys.float_info.dig - 1)
+    sign = np.where(u[:, 1] < 0.5, 1.0, -1.0)
+    left = np.floor(u[:, 2] * 10.0 ** (sys.float_info.dig - right_digits))
+    right = np.floor(u[:, 3] * 10.0 ** right_digits)
+    return sign * (left + right / 10.0 ** right_digits)
+
+
+# Native numpy generators for numeric faker providers, producing int64/float64 columns with the same value ranges
+# as their faker counterparts. Each takes a numpy Generator and a number of rows, and only uses rng.random() with a
+# fixed number of draws per row so that chunked generation stays identical to generating a column in one go.
+_NUMERIC_GENERATORS = {
+    'pyint': lambda rng, n: _uniform_ints(rng.random(n), 0, 9999),
+    'random_int': lambda rng, n: _uniform_ints(rng.random(n), 0, 9999),
+    'random_digit': lambda rng, n: _uniform_ints(rng.random(n), 0, 9),
+    'random_number': _random_number,
+    'randomize_nb_elements': lambda rng, n: _uniform_ints(rng.random(n), 60, 140) * 10 // 100,
+    'pyfloat': _pyfloat,
+}
+
+
+def generate_value_pool(provider: str, pool_size: int, seed: np.random.SeedSequence = None) -> np.ndarray:
+    """
+    Draw a pool of up to pool_size distinct values from a faker provider (or its native numpy generator).
+    Providers with a small domain (e.g. am_pm) stop early once a round of draws yields no new values.
+    :param provider: Faker provider name
+    :param pool_size: Maximum number of distinct values in the pool
+    :param seed: (optional) SeedSequence used to seed the Faker instance drawing the pool
+    :return: numpy array of distinct values, with the dtype inferred from the provider output
+    """
+    if provider in _NUMERIC_GENERATORS:
+        draw = partial(_NUMERIC_GENERATORS[provider], np.random.default_rng(seed))
+    else:
+        from faker import Faker  # Deferred, importing faker is slow and not needed for numeric providers
+        faker = Faker()
+        if seed is not None:
+            faker.seed_instance(int(seed.generate_state(1)[0]))
+        draw = lambda n: [faker.format(provider) for _ in range(n)]
+
+    pool = pandas.Series(draw(pool_size)).unique()
+    for _ in range(_POOL_DRAW_ROUNDS):
+        if len(pool) >= pool_size:
+            break
+        extra = pandas.Series(draw(pool_size - len(pool)))
+        new_pool = pandas.unique(pandas.concat([pandas.Series(pool), extra], ignore_index=True))
+        if len(new_pool) == len(pool):
+            break
+        pool = new_pool
+    return pool
+
+
+def sample_from_pool(pool: np.ndarray, num_rows: int, rng: np.random.Generator, categorical: bool=False,
+                     cdf: np.ndarray=None, hot_fraction: float=0.0):
+    """
+    Fill a column of num_rows values by sampling (with replacement) from a value pool, uniformly unless cdf or
+    hot_fraction are specified. Indices are derived from rng.random(), which consumes a fixed number of draws per
+    row, so sampling a column in consecutive pieces from the same rng gives the same values as sampling it in one go.
+    :param pool: Array of distinct values to sample from, ordered by rank for skewed distributions
+    :param num_rows: Number of values to generate
+    :param rng: numpy Generator used for sampling
+    :param categorical: Return a pandas Categorical with the pool as categories instead of an array of values
+    :param cdf: (optional) Cumulative probabilities of drawing each pool value, e.g. from zipf_cdf
+    :param hot_fraction: Fraction of rows that take the first pool value regardless of the distribution
+    :return: numpy array (or pandas Categorical) of num_rows values
+    """
+    if hot_fraction > 0:
+        draws = rng.random((num_rows, 2))
+        hot, u = draws[:, 0] < hot_fraction, draws[:, 1]
+    else:
+        u = rng.random(num_rows)
+
+    if cdf is None:
+        codes = (u * len(pool)).astype(np.int64)
+    else:
+        codes = np.minimum(np.searchsorted(cdf, u, side='right'), len(pool) - 1)
+
+    if hot_fraction > 0:
+        codes[hot] = 0
+
+    if categorical:
+        return pandas.Categorical.from_codes(codes, categories=pool)
+    return pool[codes]
+
+
+def generate_column_samplers(column_dict: Dict, num_rows: int, pool_sizes: Dict[str, int]=None, seed: int=None,
+                             num_workers: int=1, categorical: bool=False) -> List[Callable[[int], np.ndarray]]:
+    """
+    Prepare a sampler for every column in column_dict. A sampler is a function that takes a number of rows and
+    returns the next that many values of its column. Numeric providers with a native numpy generator are sampled
+    directly unless they are listed in pool_sizes or have distribution settings, all other providers draw a bounded
+    pool of values from faker up front and sample from it according to their column spec (see get_column_spec).
+    :param column_dict: Schema Mapping (column_label->faker_provider or column spec) as a Dict
+    :param num_rows: Number of rows to be generated, pools never exceed this size
+    :param pool_sizes: (optional) Dict of faker_provider->maximum number of distinct values to draw for it.
+                       Providers not listed use _DEFAULT_POOL_SIZE.
+    :param seed: (optional) Seed for the table. Every column gets its own seed derived from it, so the generated
+                 table only depends on seed, num_rows and column_dict. Drawn from np.random if not specified.
+    :param num_workers: Number of worker processes used to draw the value pools of the columns (default 1, serial)
+    :param categorical: Sample groupable columns as pandas Categoricals (default False)
+    :return: List of samplers in column_dict order
+    """
+    if pool_sizes is None:
+        pool_sizes = {}
+    if seed is None:
+        seed = np.random.randint(0, 2**32 - 1)
+
+    specs = [get_column_spec(spec) for spec in column_dict.values()]
+    providers = [spec['provider'] for spec in specs]
+    # Separate (pool, sampling) seed pair per column
+    column_seeds = [c.spawn(2) for c in np.random.SeedSequence(seed).spawn(len(providers))]
+    pooled = [ix for ix, (p, spec) in enumerate(zip(providers, specs))
+              if p not in _NUMERIC_GENERATORS or p in pool_sizes or spec['cardinality'] or is_skewed(spec)]
+    pool_size_list = [specs[ix]['cardinality'] or pool_sizes.get(providers[ix], _DEFAULT_POOL_SIZE) for ix in pooled]
+    pool_args = ([providers[ix] for ix in pooled],
+                 [max(1, min(num_rows, size)) for size in pool_size_list],
+                 [column_seeds[ix][0] for ix in pooled])
+
+    if num_workers > 1:
+        logger.debug(f'Drawing value pools with {num_workers} worker processes')
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            pools = dict(zip(pooled, executor.map(generate_value_pool, *pool_args)))
+    else:
+        pools = dict(zip(pooled, map(generate_value_pool, *pool_args)))
+
+    samplers = []
+    for ix, provider in enumerate(providers):
+        rng = np.random.default_rng(column_seeds[ix][1])
+        if ix in pools:
+            spec = specs[ix]
+            as_category = categorical and 'groupable' in get_inverse_function_dict()[provider]
+            cdf = zipf_cdf(len(pools[ix]), spec['exponent']) if spec['distribution'] == 'zipf' else None
+            samplers.append(partial(sample_from_pool, pools[ix], rng=rng, categorical=as_category, cdf=cdf,
+                                    hot_fraction=spec['hot_fraction']))
+        else:
+            samplers.append(partial(_NUMERIC_GENERATORS[provider], rng))
+    return samplers
+
+
+def generate_table(num_rows: int=100, column_dict: Dict=None, pd=pandas, key_series=None,
+                   pool_sizes: Dict[str, int]=None, seed: int=None, num_workers: int=1,
+                   categorical: bool=False, cache: TableCache=None) -> pandas.DataFrame:
     """
     Generate a table with a given schema and number of rows
     :param num_rows: Number of rows desired in the table
     :param column_dict: Schema Mapping (column_label->faker_provider) as a Dict
     :param pd: pandas library to be used to generated (default pandas), you can also use modin.pandas
     :param key_series: A pd.Series object that contains a key column to be left-appended to the df. Overrides num_rows.
+    :param pool_sizes: (optional) Dict of faker_provider->maximum number of distinct values to draw for it.
+                       Providers not listed use _DEFAULT_POOL_SIZE.
+    :param seed: (optional) Seed for the table, see generate_column_samplers.
+    :param num_workers: Number of worker processes used to draw the value pools of the columns (default 1, serial)
+    :param categorical: Emit columns with groupable providers as pandas category dtype (default False)
+    :param cache: (optional) TableCache to load the table from or store it in. Only tables with a seed and no
+                  key_series are cached, since other tables cannot be reproduced from their parameters.
     :return: Dataframe with generated table according to spec.
     """
-    faker = Faker()
+    cache_key = None
+    if cache is not None and seed is not None and key_series is None:
+        cache_key = cache.make_key(column_dict=column_dict, num_rows=num_rows, seed=seed, pool_sizes=pool_sizes,
+                                   categorical=categorical)
+        cached_df = cache.get(cache_key)
+        if cached_df is not None:
+            return pd.DataFrame(cached_df)
 
     series_list = []
     label_list = []
 
     if key_series is not None:
+        num_rows = len(key_series.index)
         series_list.append(key_series)
         label_list.append(key_series.name)
         logger.info(f'Generating right-merge df df with {num_rows} rows and {len(column_dict.keys())} columns')
     else:
         logger.info(f'Generating base df with {num_rows} rows and {len(column_dict.keys())} columns')
 
-    for label, column in column_dict.items():
-        series_list.append(pd.Series((faker.format(column) for _ in range(num_rows))))
+    samplers = generate_column_samplers(column_dict, num_rows, pool_sizes=pool_sizes, seed=seed,
+                                        num_workers=num_workers, categorical=categorical)
+
+    for label, sampler in zip(column_dict.keys(), samplers):
+        series_list.append(pd.Series(sampler(num_rows)))
         label_list.append(label)
 
     logger.debug(f'Column list: {label_list}')
-    return pd.concat(series_list, axis=1, keys=label_list)
+    df = pd.concat(series_list, axis=1, keys=label_list)
+    if cache_key is not None:
+        cache.put(cache_key, df)
+    return df
+
+
+def generate_table_chunks(num_rows: int=100, column_dict: Dict=None, chunk_size: int=100000,
+                          pool_sizes: Dict[str, int]=None, seed: int=None, num_workers: int=1,
+                          categorical: bool=False) -> Iterator[pandas.DataFrame]:
+    """
+    Generate a table with a given schema and number of rows as a stream of pandas dataframes of at most chunk_size
+    rows each. Only the value pools and the current chunk are held in memory. For the same arguments, the
+    concatenated chunks are identical to the output of generate_table.
+    :param num_rows: Number of rows desired in the table
+    :param column_dict: Schema Mapping (column_label->faker_provider) as a Dict
+    :param chunk_size: Maximum number of rows per chunk
+    :param pool_sizes: (optional) Dict of faker_provider->maximum number of distinct values to draw for it.
+    :param seed: (optional) Seed for the table, see generate_column_samplers.
+    :param num_workers: Number of worker processes used to draw the value pools of the columns (default 1, serial)
+    :param categorical: Emit columns with groupable providers as pandas category dtype (default False)
+    :return: Iterator of dataframes, indexed by their row number in the full table.
+    """
+    logger.info(f'Generating base df with {num_rows} rows and {len(column_dict.keys())} columns '
+                f'in chunks of {chunk_size} rows')
+    samplers = generate_column_samplers(column_dict, num_rows, pool_sizes=pool_sizes, seed=seed,
+                                        num_workers=num_workers, categorical=categorical)
+
+    for start in range(0, num_rows, chunk_size):
+        stop = min(start + chunk_size, num_rows)
+        logger.debug(f'Generating rows {start}-{stop}')
+        yield pandas.DataFrame({label: sampler(stop - start) for label, sampler in zip(column_dict.keys(), samplers)},
+                               index=pandas.RangeIndex(start, stop))
 
 
 def generate_schema(num_cols: int, unique_prefix: Callable = partial(generate_prefix, _UNIQUE_DICTIONARY, size=5)) -> Dict[str, str]:
@@ -87,9 +351,10 @@ def generate_schema(num_cols: int, unique_prefix: Callable = partial(generate_pr
     :return: Dict of column_label->faker provider as per spec.
     """
     column_dict = {}
-    num_col_types = len(_gen_functions.keys())
+    gen_functions = get_function_dict()
+    num_col_types = len(gen_functions.keys())
     if num_cols < num_col_types:
-        random_selection = np.random.choice(_faker_cols, size=num_cols)
+        random_selection = np.random.choice(get_faker_cols(), size=num_cols)
     else:
         # Better randomization of columns to ensure at least one of each type are generated
         random_selection = []
@@ -97,8 +362,8 @@ def generate_schema(num_cols: int, unique_prefix: Callable = partial(generate_pr
         while sum(num_array) < num_cols:
             ix = np.random.randint(0, 4)
             num_array[ix] += 1
-        for ix, col_type in enumerate(_gen_functions.keys()):
-            random_selection.extend(np.random.choice(_gen_functions[col_type], size=num_array[ix]))
+        for ix, col_type in enumerate(gen_functions.keys()):
+            random_selection.extend(np.random.choice(gen_functions[col_type], size=num_array[ix]))
 
     logger.debug(random_selection)
     column_dict.update({f'{unique_prefix()}__{r}': r for r in random_selection})
@@ -110,7 +375,7 @@ def get_schema_type_mapping(column_dict):
     # Do not need inverse schema maps yet...
     schema_type_mapping = defaultdict(list)
     for col, faker_type in column_dict.items():
-        for col_type in _inv_gen_functions[faker_type]:
+        for col_type in get_inverse_function_dict()[get_provider(faker_type)]:
             schema_type_mapping[col_type].append(col)
 
     logger.debug(f'Inverse ColumnType Mapping: {schema_type_mapping}')
@@ -151,6 +416,9 @@ def generate_pkfk_join_table(source_table, source_schema: Dict['str', 'str'],
                              key_col: str, new_col_size=None, pd=pandas):
     """
     Generates a randomized PK-FK table (right table) for a merge/join operation, given a source schema and key_column.
+    If the key column spec in source_schema is skewed (see get_column_spec), the right table keys are drawn from the
+    source keys with the same distribution, ranked by their frequency in the source table. Hot keys then repeat on
+    both sides of the merge and some cold keys are left out.
     :param source_table: Source table to be joined.
     :param source_schema: Source Schema.
     :param key_col: Column Label to be used as a key.
@@ -158,7 +426,16 @@ def generate_pkfk_join_table(source_table, source_schema: Dict['str', 'str'],
     :param pd: pandas library to be used.
     :return:
     """
-    key_values = list(set(source_table[key_col].values))
+    key_spec = get_column_spec(source_schema[key_col])
+    if is_skewed(key_spec):
+        key_counts = source_table[key_col].value_counts()
+        ranked_keys = key_counts[key_counts > 0].index.to_numpy()
+        cdf = zipf_cdf(len(ranked_keys), key_spec['exponent']) if key_spec['distribution'] == 'zipf' else None
+        rng = np.random.default_rng(np.random.randint(0, 2**32 - 1))
+        key_values = sample_from_pool(ranked_keys, len(ranked_keys), rng, cdf=cdf,
+                                      hot_fraction=key_spec['hot_fraction'])
+    else:
+        key_values = list(set(source_table[key_col].values))
     key_series = pd.Series(data=key_values, name=key_col)
     if not new_col_size:
         new_col_size = np.random.randint(2, max(3, len(source_table.columns)+1))
@@ -271,7 +548,8 @@ def generate_ops_choices(schema: Dict[str, str], num_rows: int, exclude: List[st
 
 
 def generate_workflow(workflow_class, name='wf', num_versions=10, base_shape=(10, 1000),
-                      out_directory='/tmp/dataset', bfactor=1.0, matfreq=1, wf_options={}, exclude_ops=[]):
+                      out_directory='/tmp/dataset', bfactor=1.0, matfreq=1, wf_options={}, exclude_ops=[],
+                      resume=False):
     """
     Generate a workflow for a given client and parameters
     :param workflow_class: Workflow class to be used (DataFrameWorkflow, ModinWorkflow, or SQLWorkflow)
@@ -283,10 +561,14 @@ def generate_workflow(workflow_class, name='wf', num_versions=10, base_shape=(10
     :param matfreq: Number of operations to perform before materialization (default 1)
     :param wf_options: Workflow class options as a dict (e.g. SQL string or Modin engine)
     :param exclude_ops: List of string operations to be avoided during generation.
+    :param resume: Resume an interrupted run in out_directory, continuing after the last artifact it completed
     :return: Workflow object of desired type.
     """
+    if resume:
+        wf_options = {**wf_options, 'checkpoint': True}
     wf = workflow_class(name=name, out_directory=out_directory, **wf_options)
-    wf.generate_base_artifact(num_cols=base_shape[0], num_rows=base_shape[1])
+    if not resume or not wf.resume():
+        wf.generate_base_artifact(num_cols=base_shape[0], num_rows=base_shape[1])
 
     num_generated = len(wf.artifact_list)
     artifact_exclusions = []
@@ -327,7 +609,7 @@ def generate_workflow(workflow_class, name='wf', num_versions=10, base_shape=(10
                                                                           key_col=selected_op['args']['key_col'])
                         right_df_label = wf.generate_next_label()
                         right_artifact = wf.initialize_new_artifact(label=right_df_label,
-                                                                    filename=f"{wf.artifact_dir}/{right_df_label}.csv",
+                                                                    filename=f"{wf.artifact_dir}/{right_df_label}.{wf.file_format}",
                                                                     schema_map=right_schema)
                         right_artifact.from_df(right_df)
                         wf.add_artifact(right_artifact)
@@ -339,6 +621,7 @@ def generate_workflow(workflow_class, name='wf', num_versions=10, base_shape=(10
                         logger.info(f"Chaining Operation: {selected_op['op']}")
                         wf.chain_to_current_operation([selected_op])
                         if force_materialize:
+                            num_ops += 1  # The merge still has to be executed below
                             break
                     except NotImplementedError as e:
                         logger.warning(f'Attempting an operation that is not implemented for this workflow type:'
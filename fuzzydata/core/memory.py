@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+
+"""
+fuzzydata.core.memory
+~~~~~~~~~~~~
+This module contains the memory manager that bounds the memory held by the artifacts of a workflow
+:copyright: (c) Suhail Rehman 2022
+:license: MIT, see LICENSE for more details.
+"""
+
+import logging
+import os
+import threading
+from collections import Counter, OrderedDict
+from typing import Dict, List
+
+from fuzzydata.core.artifact import Artifact
+from fuzzydata.core.writer import ArtifactWriter
+
+logger = logging.getLogger(__name__)
+
+
+class ArtifactMemoryManager:
+    """
+    Keeps track of the artifacts of a workflow that hold their data in memory and releases them when they are no
+    longer needed or when they exceed a memory budget:
+
+    * When the pending operations are known in advance (replay), every artifact is reference-counted by the number of
+      pending operations that consume it. Once the last consumer has executed, the artifact is written out to its file
+      in the workflow's artifact directory and unloaded.
+    * When the artifacts held in memory exceed memory_budget bytes, the least recently used ones that are not the
+      source of a running operation are spilled to spill_dir and transparently reloaded the next time they are used.
+
+    Peak memory then scales with the frontier of the workflow DAG instead of the number of artifacts.
+    """
+
+    def __init__(self, artifact_dir: str, spill_dir: str, memory_budget: int = None, evict_consumed: bool = False,
+                 writer: ArtifactWriter = None):
+        """
+        :param artifact_dir: Directory the artifacts of the workflow are serialized to
+        :param spill_dir: Directory to spill artifacts to when the memory budget is exceeded
+        :param memory_budget: (optional) Bytes of artifact data to keep in memory, unbounded if not specified
+        :param evict_consumed: Unload artifacts once all their pending consumers have executed (default False)
+        :param writer: (optional) Write-behind writer of the workflow, evicted artifacts it has written are not
+        written out again
+        """
+        self.artifact_dir = artifact_dir
+        self.spill_dir = spill_dir
+        self.memory_budget = memory_budget
+        self.evict_consumed = evict_consumed
+        self.writer = writer
+
+        self.artifacts = {}
+        self.consumers = Counter()
+        self.tracking_consumers = False
+        self.pinned = Counter()
+        # label -> estimated bytes of every artifact held in memory, in least recently used order
+        self.resident = OrderedDict()
+        self._lock = threading.RLock()
+
+        self.spills = 0
+        self.evictions = 0
+
+    def set_pending_operations(self, op_list: List[Dict]) -> None:
+        """
+        Reference-count artifacts by the number of operations in op_list that consume them
+        :param op_list: List of serialized operations (Dicts with "sources") to be executed
+        """
+        with self._lock:
+            self.consumers = Counter(s for opl in op_list for s in opl['sources'])
+            self.tracking_consumers = self.evict_consumed
+
+    def register(self, artifact: Artifact) -> None:
+        """
+        Start managing a new artifact of the workflow
+        :param artifact: The artifact
+        """
+        with self._lock:
+            self.artifacts[artifact.label] = artifact
+            self._refresh()
+            if self.tracking_consumers and self.consumers[artifact.label] == 0:
+                self._evict(artifact)
+            self._enforce_budget()
+
+    def acquire(self, artifacts: List[Artifact]) -> None:
+        """
+        Pin the source artifacts of an operation about to be executed, so they are not spilled while in use
+        :param artifacts: The source artifacts of the operation
+        """
+        with self._lock:
+            for artifact in artifacts:
+                self.pinned[artifact.label] += 1
+            self._refresh()
+        # Reload spilled sources outside the lock, so other operations can proceed meanwhile
+        for artifact in artifacts:
+            artifact.to_df()
+        with self._lock:
+            self._refresh()
+            self._enforce_budget()
+
+    def release(self, artifacts: List[Artifact]) -> None:
+        """
+        Unpin the source artifacts of an operation that has executed and evict the ones without pending consumers
+        :param artifacts: The source artifacts of the operation
+        """
+        with self._lock:
+            for artifact in artifacts:
+                self.pinned[artifact.label] -= 1
+                if self.tracking_consumers:
+                    self.consumers[artifact.label] -= 1
+                    if self.consumers[artifact.label] <= 0 and self.pinned[artifact.label] <= 0:
+                        self._evict(artifact)
+            self._enforce_budget()
+
+    def _refresh(self) -> None:
+        # Artifacts can be (re)loaded behind our back, e.g. by reading their table, so sync the resident set
+        for label, artifact in self.artifacts.items():
+            if artifact.in_memory:
+                if label not in self.resident:
+                    self.resident[label] = artifact.memory_usage()
+                if self.pinned[label] > 0:
+                    self.resident.move_to_end(label)
+            else:
+                self.resident.pop(label, None)
+
+    def _evict(self, artifact: Artifact) -> None:
+        if not artifact.filename:
+            artifact.filename = os.path.join(self.artifact_dir, f'{artifact.label}.{artifact.file_format}')
+        written = self.writer and self.writer.is_written(artifact.label, artifact.filename)
+        if artifact.unload(serialize=not written):
+            logger.info(f'Evicted {artifact.label}, written to {artifact.filename}')
+            self.evictions += 1
+            self.resident.pop(artifact.label, None)
+
+    def _enforce_budget(self) -> None:
+        if self.memory_budget is None:
+            return
+        total = sum(self.resident.values())
+        for label in list(self.resident):
+            if total <= self.memory_budget:
+                break
+            if self.pinned[label] > 0:
+                continue
+            os.makedirs(self.spill_dir, exist_ok=True)
+            if self.artifacts[label].spill(os.path.join(self.spill_dir, f'{label}.pkl')):
+                logger.info(f'Spilled {label} to {self.spill_dir} '
+                            f'({total} bytes in memory, budget {self.memory_budget})')
+                self.spills += 1
+                total -= self.resident.pop(label)
@@ -1,35 +1,332 @@
+# -*- coding: utf-8 -*-
+
+"""
+fuzzydata.core.monitor
+~~~~~~~~~~~~
+This module contains a low-overhead memory sampler and the pluggable metrics collectors used to annotate the
+performance records of a workflow
+:copyright: (c) Suhail Rehman 2022
+:license: MIT, see LICENSE for more details.
+"""
+
+import gc
+import logging
+import threading
 import time
+import tracemalloc
+from typing import Dict, List
+
 import psutil
-import os
-import threading
+
+logger = logging.getLogger(__name__)
+
+# Seconds between two RSS samples taken by the background thread of a Monitor
+DEFAULT_MONITOR_INTERVAL = 0.01
+
+
+# Running monitors per process id. The kernel's peak RSS counter is per process, so it is only reset by a monitor
+# started while no other monitor of the process is running
+_active_monitors = {}
+_active_lock = threading.Lock()
+
+
+def reset_peak_rss(pid) -> bool:
+    """
+    Reset the kernel's peak RSS counter (VmHWM) of a process to its current RSS. Only supported on Linux.
+    :param pid: Process id
+    :return: True if the counter was reset, False if it is not available
+    """
+    try:
+        with open(f'/proc/{pid}/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def read_peak_rss(pid):
+    """
+    Read the kernel's peak RSS counter (VmHWM) of a process
+    :param pid: Process id
+    :return: Peak RSS in bytes, or None if it is not available
+    """
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
 
 
 class Monitor:
+    """
+    Samples the resident set size (RSS) of a process every `interval` seconds on a background thread, between calls
+    to start() and stop(). Where the kernel exposes a resettable peak RSS counter (Linux), it is reset on start() and
+    read on stop(), so the reported peak does not depend on the sampling interval; an interval <= 0 then disables the
+    sampling thread altogether. The time spent taking samples is measured and reported as the monitor's overhead.
 
-    def __init__(self, pid):
+    The peak RSS counter is per process, and resetting it would shrink the peak seen by any other running monitor.
+    Only a monitor started while no other monitor of the process is running uses the counter; nested or concurrent
+    monitors (e.g. of the steps of an operation, or of operations replayed in parallel) report the peak of their
+    samples instead, and hand it on to the monitors still running when they stop, so that the peak of an operation
+    covers the peaks of its steps.
+    """
+
+    def __init__(self, pid=None, interval=DEFAULT_MONITOR_INTERVAL):
+        """
+        :param pid: (optional) Process id to be monitored, the current process if not specified
+        :param interval: Seconds between two RSS samples, <= 0 only samples at start() and stop()
+        """
         self.p = psutil.Process(pid)
-        self.count = 0
-        self.memSum = 0
-        # self.cpuSum = 0
-        self.interval = 0
-        self.sign = False
-
-    def begin(self):
-        self.interval = 0.00000001  # 获取内存使用情况轮询时间间隔
-        while True:
-            if self.sign:
-                break
-            # cpu_percent = self.p.cpu_percent(interval=0.5)
-            mem_percent = self.p.memory_percent()
-            self.memSum += mem_percent
-            # self.cpuSum += cpu_percent
-            self.count += 1
-            time.sleep(self.interval)
-
-    def end(self) -> float:
-        self.sign = True
-        time.sleep(self.interval)
-        if self.count > 0:
-            return self.memSum / self.count
-        else:
-            return 0
+        self.interval = interval
+        self.samples = 0
+        self.rss_sum = 0
+        self.start_rss = 0
+        self.peak_rss = 0
+        self.overhead = 0.0
+        self._kernel_peak = False
+        self._nested_peak = 0
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def _sample(self) -> int:
+        start = time.perf_counter()
+        rss = self.p.memory_info().rss
+        self.samples += 1
+        self.rss_sum += rss
+        self.peak_rss = max(self.peak_rss, rss)
+        self.overhead += time.perf_counter() - start
+        return rss
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            self._sample()
+
+    def start(self):
+        """ Start monitoring the process """
+        with _active_lock:
+            running = _active_monitors.setdefault(self.p.pid, [])
+            self._kernel_peak = reset_peak_rss(self.p.pid) if not running else False
+            running.append(self)
+        self.start_rss = self._sample()
+        if self.interval and self.interval > 0:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> Dict:
+        """
+        Stop monitoring the process
+        :return: Dict with the average memory usage in % of total memory (mem), peak RSS and RSS growth in bytes
+        (peak_rss, delta_rss), and the number of samples taken along with the seconds spent taking them
+        (monitor_samples, monitor_overhead)
+        """
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join()
+        end_rss = self._sample()
+        if self._kernel_peak:
+            self.peak_rss = max(self.peak_rss, read_peak_rss(self.p.pid) or 0)
+        with _active_lock:
+            running = _active_monitors[self.p.pid]
+            running.remove(self)
+            # The monitors still running overlap this one, e.g. the operation around a step, and cover its peak too
+            self.peak_rss = max(self.peak_rss, self._nested_peak)
+            for monitor in running:
+                monitor._nested_peak = max(monitor._nested_peak, self.peak_rss)
+        return {
+            'mem': 100.0 * self.rss_sum / self.samples / psutil.virtual_memory().total,
+            'peak_rss': self.peak_rss,
+            'delta_rss': end_rss - self.start_rss,
+            'monitor_samples': self.samples,
+            'monitor_overhead': self.overhead,
+        }
+
+
+class MetricsCollector:
+    """
+    Base class of the metrics collectors that annotate every generate, load and operation in the performance records
+    of a workflow. A collector is shared by all the steps of a workflow, so any per-step state is returned by start()
+    and handed back to stop() instead of being stored on the collector. Clients can subclass this to add
+    engine-specific counters, see Workflow.add_metrics_collector().
+    """
+
+    # Labels of the perf record columns filled in by this collector
+    fields = ()
+
+    def start(self):
+        """
+        Start measuring a step
+        :return: State to be passed to stop()
+        """
+        return None
+
+    def stop(self, state) -> Dict:
+        """
+        Stop measuring a step
+        :param state: The value returned by the matching start()
+        :return: Dict of field -> value for this step
+        """
+        return {}
+
+
+class MemoryCollector(MetricsCollector):
+    """ Average, peak and delta RSS of the process, sampled by a Monitor """
+
+    fields = ('mem', 'peak_rss', 'delta_rss', 'monitor_samples', 'monitor_overhead')
+
+    def __init__(self, interval=DEFAULT_MONITOR_INTERVAL):
+        """
+        :param interval: Seconds between two RSS samples, see Monitor
+        """
+        self.interval = interval
+
+    def start(self):
+        return Monitor(interval=self.interval).start()
+
+    def stop(self, state) -> Dict:
+        return state.stop()
+
+
+class CPUTimeCollector(MetricsCollector):
+    """ User and system CPU seconds used by the process """
+
+    fields = ('cpu_user', 'cpu_system')
+
+    def __init__(self):
+        self.p = psutil.Process()
+
+    def start(self):
+        return self.p.cpu_times()
+
+    def stop(self, state) -> Dict:
+        end = self.p.cpu_times()
+        return {'cpu_user': end.user - state.user, 'cpu_system': end.system - state.system}
+
+
+class IOCollector(MetricsCollector):
+    """ Bytes read from and written to disk by the process, NaN where the platform does not expose I/O counters """
+
+    fields = ('io_read_bytes', 'io_write_bytes')
+
+    def __init__(self):
+        self.p = psutil.Process()
+
+    def _counters(self):
+        try:
+            return self.p.io_counters()
+        except (AttributeError, psutil.Error):
+            return None
+
+    def start(self):
+        return self._counters()
+
+    def stop(self, state) -> Dict:
+        end = self._counters()
+        if state is None or end is None:
+            return {'io_read_bytes': float('nan'), 'io_write_bytes': float('nan')}
+        return {'io_read_bytes': end.read_bytes - state.read_bytes,
+                'io_write_bytes': end.write_bytes - state.write_bytes}
+
+
+class _GCTracker:
+    """ Cumulative number of garbage collections and seconds spent in them, maintained through gc.callbacks """
+
+    def __init__(self):
+        self.collections = 0
+        self.pause_time = 0.0
+        self._start = None
+        self._installed = False
+
+    def install(self):
+        if not self._installed:
+            gc.callbacks.append(self._callback)
+            self._installed = True
+
+    def _callback(self, phase, info):
+        if phase == 'start':
+            self._start = time.perf_counter()
+        elif self._start is not None:
+            self.collections += 1
+            self.pause_time += time.perf_counter() - self._start
+            self._start = None
+
+
+_gc_tracker = _GCTracker()
+
+
+class GCCollector(MetricsCollector):
+    """ Number of garbage collections and the seconds the interpreter was paused for them """
+
+    fields = ('gc_collections', 'gc_pause')
+
+    def __init__(self):
+        _gc_tracker.install()
+
+    def start(self):
+        return _gc_tracker.collections, _gc_tracker.pause_time
+
+    def stop(self, state) -> Dict:
+        return {'gc_collections': _gc_tracker.collections - state[0],
+                'gc_pause': _gc_tracker.pause_time - state[1]}
+
+
+class AllocationCollector(MetricsCollector):
+    """
+    Peak and net bytes allocated by Python code, through tracemalloc. Tracing slows down allocations noticeably,
+    so this collector is only enabled on request (Workflow trace_allocations option).
+    """
+
+    fields = ('alloc_peak', 'alloc_net')
+
+    def start(self):
+        started = not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start()
+        elif hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        return started, tracemalloc.get_traced_memory()[0]
+
+    def stop(self, state) -> Dict:
+        started, start_current = state
+        current, peak = tracemalloc.get_traced_memory()
+        if started:
+            tracemalloc.stop()
+        return {'alloc_peak': peak - start_current, 'alloc_net': current - start_current}
+
+
+def default_collectors(monitor_interval=DEFAULT_MONITOR_INTERVAL, trace_allocations=False) -> List[MetricsCollector]:
+    """
+    Build the metrics collectors used by a workflow unless configured otherwise
+    :param monitor_interval: Seconds between two RSS samples, see Monitor
+    :param trace_allocations: Also collect allocated bytes with tracemalloc (default False)
+    :return: List of collectors
+    """
+    collectors = [MemoryCollector(monitor_interval), CPUTimeCollector(), IOCollector(), GCCollector()]
+    if trace_allocations:
+        collectors.append(AllocationCollector())
+    return collectors
+
+
+def start_collectors(collectors: List[MetricsCollector]) -> List:
+    """
+    Start measuring a step with all collectors
+    :param collectors: List of collectors
+    :return: List of per-collector states to be passed to stop_collectors()
+    """
+    return [c.start() for c in collectors]
+
+
+def stop_collectors(collectors: List[MetricsCollector], states: List) -> Dict:
+    """
+    Stop measuring a step with all collectors, in reverse order of start_collectors()
+    :param collectors: List of collectors
+    :param states: The value returned by the matching start_collectors()
+    :return: Dict of field -> value from all collectors
+    """
+    metrics = {}
+    for collector, state in reversed(list(zip(collectors, states))):
+        metrics.update(collector.stop(state))
+    return metrics
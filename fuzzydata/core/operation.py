@@ -10,13 +10,11 @@ This module contains the abstract implementation of an operation in fuzzydata
 
 import logging
 import time
-import threading
-import os
 from abc import ABC, abstractmethod
 from typing import List, TypeVar, Generic, Dict
 
 from fuzzydata.core.artifact import Artifact
-from fuzzydata.core.monitor import Monitor
+from fuzzydata.core.monitor import MetricsCollector, default_collectors, start_collectors, stop_collectors
 
 T = TypeVar('T')
 
@@ -30,6 +28,7 @@ class Operation(Generic[T], ABC):
         :param sources: List of source artifacts for this operation.
         """
         self.mem = None
+        self.resource_stats = {}
         self.sources = sources
         self.new_label = None
         self.dest_schema_map = None
@@ -37,12 +36,16 @@ class Operation(Generic[T], ABC):
         # Operation Timings
         self.start_time = None
         self.end_time = None
+        self.step_collectors = None  # Collectors measuring every chained operation individually, if instrumented
 
         # Code Generation Variables
         self.code = ''
         self.current_schema_map = self.sources[0].schema_map
         self.num_operations = 0
+        self.num_merges = 0  # The k-th merge chained joins with self.sources[k]
         self.op_list = []  # List[Dict] of op names and args to chain together.
+        self.fused = []  # Labels of the intermediate artifacts fused into this operation instead of materialized
+        self.original_op_list = None  # Chain of operations as given, if the optimizer reordered it into op_list
 
     def add_source_artifact(self, s_artifact: Artifact) -> None:
         """Add a source artifact to this operation. """
@@ -105,11 +108,13 @@ class Operation(Generic[T], ABC):
     @abstractmethod
     def merge(self, key_col: List[str]) -> T:
         """
-        Merge the source artifacts defined in this operation on key_column
+        Merge the current result with the next source artifact of this operation on key_column, i.e. the k-th merge
+        chained joins with self.sources[k]
         :param key_col: The common column to be used for the merge.
         :return:
         """
-        self.current_schema_map = {**self.current_schema_map, **self.sources[1].schema_map}
+        self.num_merges += 1
+        self.current_schema_map = {**self.current_schema_map, **self.sources[self.num_merges].schema_map}
         pass
 
     @abstractmethod
@@ -162,39 +167,58 @@ class Operation(Generic[T], ABC):
         """
         self.new_label = new_label
 
-    def execute(self, new_label) -> T:
+    def execute(self, new_label, collectors: List[MetricsCollector] = None,
+                step_collectors: List[MetricsCollector] = None) -> T:
         """
         Execute all stacked/chained operations and generate a new artifact with label "new_label"
         Add performance information to the operation object.
         :param new_label: The new label of the artifact to be produced.
+        :param collectors: (optional) Metrics collectors to measure the operation with, see default_collectors()
+        :param step_collectors: (optional) Metrics collectors to measure every chained operation with individually.
+        Clients then materialize the result of every step, see step_timings()
         :return: The new artifact that is produced.
         """
         logger.debug(f"Before Op: {self.sources[0].to_df().columns}")
         logger.debug(f"Operation Code: {self.code}")
+        if collectors is None:
+            collectors = default_collectors()
         # 监视内存占用
-        monitor = Monitor(os.getpid())
-        thread = threading.Thread(target=monitor.begin)
-        thread.start()
+        states = start_collectors(collectors)
+        self.step_collectors = step_collectors
 
         self.start_time = time.perf_counter()
         result = self.materialize(new_label)
         self.end_time = time.perf_counter()
 
-        self.mem = monitor.end()
+        self.resource_stats = stop_collectors(collectors, states)
+        self.mem = self.resource_stats.get('mem')
         logger.debug(f"After Op: {result.to_df()}")
         return result
 
+    def step_timings(self) -> List[Dict]:
+        """
+        Timings of the individual chained operations in the last execution, for clients that execute them one by one
+        :return: List of Dicts with the step index, op, start_time, end_time and elapsed_time of every step, along with
+        the metrics of the step_collectors if any
+        """
+        return []
+
     def get_execution_time(self):
         """ Get the execution time for this operation"""
         return self.end_time - self.start_time
 
     def to_dict(self) -> dict:
         """ Return a dictionary representation of this operation"""
-        return {
+        op_dict = {
             'sources': [s.label for s in self.sources],
             'new_label': self.new_label,
             'op_list': self.op_list,
         }
+        if self.fused:
+            op_dict['fused'] = self.fused
+        if self.original_op_list is not None:
+            op_dict['original_op_list'] = self.original_op_list
+        return op_dict
 
     def __str__(self):
         return str(self.to_dict())
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+"""
+fuzzydata.core.oplog
+~~~~~~~~~~~~
+This module contains the append-only operation log and artifact completion markers used to resume workflows
+:copyright: (c) Suhail Rehman 2022
+:license: MIT, see LICENSE for more details.
+"""
+
+import json
+import logging
+import os
+import threading
+from typing import Dict, List
+
+logger = logging.getLogger(__name__)
+
+
+def marker_filename(filename) -> str:
+    """
+    :param filename: Filename of a serialized artifact
+    :return: Filename of the completion marker of the artifact
+    """
+    return f'{filename}.done'
+
+
+def write_marker(filename, **info) -> None:
+    """
+    Mark a serialized artifact as completely written
+    :param filename: Filename of the serialized artifact
+    :param info: Additional JSON-serializable information to store in the marker
+    """
+    with open(marker_filename(filename), 'w') as f:
+        json.dump({'size': os.path.getsize(filename), **info}, f)
+
+
+def remove_marker(filename) -> None:
+    """
+    Remove the completion marker of an artifact that is about to be overwritten
+    :param filename: Filename of the serialized artifact
+    """
+    if os.path.exists(marker_filename(filename)):
+        os.remove(marker_filename(filename))
+
+
+def is_complete(filename) -> bool:
+    """
+    Check whether a serialized artifact was completely written
+    :param filename: Filename of the serialized artifact
+    :return: True if the artifact has a completion marker matching its size on disk
+    """
+    try:
+        with open(marker_filename(filename)) as f:
+            return json.load(f)['size'] == os.path.getsize(filename)
+    except (OSError, ValueError, KeyError):
+        return False
+
+
+class OperationLog:
+    """
+    Append-only log of the artifacts added to a workflow, in the order they were added, as one JSON record per line.
+    Every record is flushed to disk before the artifact is written out, so after a crash the log together with the
+    completion markers of the artifacts tells which artifacts can be reused.
+    """
+
+    def __init__(self, filename):
+        """
+        :param filename: Filename of the log, appended to if it exists
+        """
+        self.filename = filename
+        self._lock = threading.Lock()
+
+    def append(self, record: Dict) -> None:
+        """
+        Append a record to the log and flush it to disk
+        :param record: JSON-serializable dict
+        """
+        line = json.dumps(record, default=str)
+        with self._lock:
+            with open(self.filename, 'a') as f:
+                f.write(line + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+
+    def read(self) -> List[Dict]:
+        """
+        Read all records in the log. A partially written last record (after a crash) is ignored.
+        :return: List of records in the order they were appended
+        """
+        records = []
+        if not os.path.exists(self.filename):
+            return records
+        with open(self.filename) as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    logger.warning(f'Ignoring truncated record in {self.filename}')
+        return records
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+
+"""
+fuzzydata.core.optimizer
+~~~~~~~~~~~~
+This module contains a rule-based optimizer that reorders chained operations to shrink the inputs of merges
+:copyright: (c) Suhail Rehman 2022
+:license: MIT, see LICENSE for more details.
+"""
+
+import logging
+import re
+from typing import Callable, Dict, List
+
+logger = logging.getLogger(__name__)
+
+# Identifiers and `quoted` column labels in a select condition
+_CONDITION_TOKENS = re.compile(r'`([^`]+)`|([A-Za-z_][A-Za-z0-9_]*)')
+
+
+def condition_columns(condition: str, columns: List[str]) -> set:
+    """
+    :param condition: Condition of a select operation, e.g. `col > 5`
+    :param columns: Candidate column labels
+    :return: The columns referenced by the condition
+    """
+    tokens = {quoted or name for quoted, name in _CONDITION_TOKENS.findall(condition)}
+    return tokens & set(columns)
+
+
+def next_columns(columns: List[str], op_dict: Dict, merge_columns: List[str] = None):
+    """
+    Columns of the result of an operation, following the schema maps computed by Operation
+    :param columns: Columns of the input of the operation
+    :param op_dict: Dict with the "op" and "args" of the operation
+    :param merge_columns: Columns of the artifact joined by a merge
+    :return: Columns of the result, None if they cannot be determined (pivot)
+    """
+    op, args = op_dict['op'], op_dict['args']
+    if op == 'apply':
+        return columns + [f"{args['numeric_col']}__{args['a']}x_{args['b']}"]
+    if op == 'groupby':
+        return list(args['group_columns']) + list(args['agg_columns'])
+    if op == 'project':
+        return list(args['output_cols'])
+    if op == 'merge':
+        return columns + [c for c in merge_columns if c not in columns]
+    if op == 'pivot':
+        return None
+    return columns
+
+
+def optimize_op_list(op_list: List[Dict], source_columns: List[List[str]],
+                     merge_preserves_rows: Callable[[int, str], bool] = None) -> List[Dict]:
+    """
+    Reorder a chain of operations so that merges join smaller inputs, keeping the result equivalent:
+
+    * merge -> project: the columns that are not needed after the merge are projected away before it as well, the
+      project after the merge is kept to restore the order of the columns
+    * merge -> select: a condition on columns of the left side only is applied before the merge
+    * merge -> sample: the sample is taken before the merge, if merge_preserves_rows says that the merge produces
+      exactly one row per row of its left side
+
+    The k-th merge of the chain joins with the artifact with columns source_columns[k], as in Operation.merge(). Rules
+    are applied until none matches; operations after a pivot are left alone.
+    :param op_list: List of Dicts with the "op" and "args" of every operation, in chaining order
+    :param source_columns: Columns of every source artifact of the operation
+    :param merge_preserves_rows: (optional) Callable (k, key_col) -> True if the k-th merge on key_col keeps the rows
+    of its left side one to one, i.e. the keys of the right side are unique and contain every left key
+    :return: The optimized list of operations, op_list itself if no rule applies
+    """
+    optimized = list(op_list)
+    changed = True
+    while changed:
+        changed = False
+        columns = list(source_columns[0])
+        num_merges = 0
+        filled = set()
+        for ix in range(len(optimized) - 1):
+            op_dict, next_dict = optimized[ix], optimized[ix + 1]
+            if op_dict['op'] == 'merge':
+                num_merges += 1
+                right = list(source_columns[num_merges])
+                rewrite = _rewrite_merge(op_dict, next_dict, columns, right, num_merges, filled,
+                                         source_columns[0], merge_preserves_rows)
+                if rewrite:
+                    optimized[ix:ix + 2] = rewrite
+                    changed = True
+                    break
+            elif op_dict['op'] == 'fill':
+                filled.add(op_dict['args']['col_name'])
+            columns = next_columns(columns, op_dict, right if op_dict['op'] == 'merge' else None)
+            if columns is None:
+                break
+
+    if optimized != op_list:
+        logger.info(f"Optimized {[x['op'] for x in op_list]} into {[x['op'] for x in optimized]}")
+        return optimized
+    return op_list
+
+
+def _rewrite_merge(merge_dict, next_dict, left, right, k, filled, first_columns, merge_preserves_rows):
+    key_col = merge_dict['args']['key_col']
+    # Columns on both sides are suffixed by the merge, leave those alone
+    if set(left) & set(right) - {key_col}:
+        return None
+
+    if next_dict['op'] == 'project':
+        keep = [c for c in left if c in next_dict['args']['output_cols'] or c == key_col]
+        if len(keep) < len(left):
+            return [{'op': 'project', 'args': {'output_cols': keep}}, merge_dict, next_dict]
+
+    elif next_dict['op'] == 'select':
+        used = condition_columns(next_dict['args']['condition'], left + right)
+        if used and not used & (set(right) - {key_col}):
+            return [next_dict, merge_dict]
+
+    elif next_dict['op'] == 'sample':
+        # The left keys come from the first source unchanged unless a fill rewrote them
+        if merge_preserves_rows and key_col in first_columns and key_col not in filled and \
+                merge_preserves_rows(k, key_col):
+            return [next_dict, merge_dict]
+
+    return None
+
+
+def required_columns(op_list: List[Dict], source_columns: List[List[str]]) -> List:
+    """
+    Columns of every source artifact that a chain of operations reads, i.e. the columns that can be pruned when the
+    sources are loaded without changing the result of the operation.
+    :param op_list: List of Dicts with the "op" and "args" of every operation, in chaining order
+    :param source_columns: Columns of every source artifact of the operation
+    :return: List with the set of required columns of every source, None for a source whose columns are all required
+    (e.g. when the result keeps every column)
+    """
+    # Columns of the input of every operation, to split the columns after a merge between its two sides
+    inputs = []
+    columns = list(source_columns[0])
+    num_merges = 0
+    for op_dict in op_list:
+        if columns is None:
+            return [None] * len(source_columns)
+        inputs.append(columns)
+        merge_columns = None
+        if op_dict['op'] == 'merge':
+            num_merges += 1
+            merge_columns = source_columns[num_merges]
+        columns = next_columns(columns, op_dict, merge_columns)
+
+    universe = {c for cols in source_columns for c in cols}
+    required = [None] * len(source_columns)
+    needed = None  # Columns needed after the current operation, None for all of them
+    for ix in reversed(range(len(op_list))):
+        op, args = op_list[ix]['op'], op_list[ix]['args']
+        if op == 'project':
+            needed = set(args['output_cols'])
+        elif op == 'groupby':
+            needed = set(args['group_columns']) | set(args['agg_columns'])
+        elif op == 'pivot':
+            needed = set(args['index_cols']) | set(args['columns']) | set(args['value_col'])
+        elif op == 'merge':
+            key_col = args['key_col']
+            right = set(source_columns[num_merges])
+            required[num_merges] = None if needed is None else (needed & right) | {key_col}
+            needed = None if needed is None else (needed & set(inputs[ix])) | {key_col}
+            num_merges -= 1
+        elif needed is None:
+            continue
+        elif op == 'select':
+            needed |= condition_columns(args['condition'], universe | needed)
+        elif op == 'apply':
+            needed = (needed - set(next_columns([], op_list[ix]))) | {args['numeric_col']}
+        elif op == 'fill':
+            needed |= {args['col_name']}
+    required[0] = needed
+    return required
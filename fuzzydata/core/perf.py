@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+
+"""
+fuzzydata.core.perf
+~~~~~~~~~~~~
+This module contains the recorder for the performance records of a workflow
+:copyright: (c) Suhail Rehman 2022
+:license: MIT, see LICENSE for more details.
+"""
+
+import csv
+import json
+import logging
+import math
+import os
+import threading
+from array import array
+from typing import Iterable
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Columns shared by every kind of record (generate, load, operation, serialize), metrics collectors add their fields
+PERF_COLUMNS = ('kind', 'src', 'dst', 'op', 'args', 'code', 'cache', 'bytes',
+                'start_time', 'end_time', 'elapsed_time')
+
+# Columns of the per-step records of chained operations, linked to the record of their operation by its index (parent)
+STEP_PERF_COLUMNS = ('kind', 'parent', 'step', 'op', 'args', 'start_time', 'end_time', 'elapsed_time')
+
+# Columns holding labels, ids and code, every other column is numeric
+_OBJECT_COLUMNS = {'kind', 'src', 'dst', 'op', 'args', 'code', 'cache', 'parent', 'step'}
+
+PERF_STREAM_FORMATS = ('csv', 'jsonl')
+
+
+class PerfRecorder:
+    """
+    Collects performance records in columnar buffers (an array of doubles per numeric column) with a fixed set of
+    columns for every kind of record, and optionally streams every record to an append-only CSV or JSONL file as soon
+    as it is recorded, so that the records of a run survive a crash.
+    """
+
+    def __init__(self, stream_filename=None, stream_format='jsonl', append=False,
+                 columns: Iterable[str] = PERF_COLUMNS):
+        """
+        :param stream_filename: (optional) File to stream records to
+        :param stream_format: Format of the stream file, csv or jsonl (default jsonl)
+        :param append: Append to an existing stream file instead of overwriting it (default False). The indices of
+        new records then continue after the records already in the file.
+        :param columns: Columns of the records, more can be added with add_columns() before the first record
+        """
+        if stream_format not in PERF_STREAM_FORMATS:
+            raise ValueError(f'Unsupported perf stream format {stream_format}, expected one of {PERF_STREAM_FORMATS}')
+        self.columns = []
+        self.buffers = {}
+        self.num_records = 0
+        self.stream_filename = stream_filename
+        self.stream_format = stream_format
+        self._stream = None
+        self._csv_writer = None
+        self._append = append
+        self._lock = threading.Lock()
+        # Index of the first record, records of an earlier run streamed to the same file come before it
+        self.offset = self._count_streamed() if append else 0
+        self.add_columns(columns)
+
+    def _count_streamed(self) -> int:
+        if not self.stream_filename or not os.path.exists(self.stream_filename):
+            return 0
+        with open(self.stream_filename, newline='') as infile:
+            if self.stream_format == 'csv':
+                # Count records rather than lines, values (e.g. code) may span several lines
+                return max(sum(1 for _ in csv.reader(infile)) - 1, 0)
+            return sum(1 for line in infile if line.strip())
+
+    def add_columns(self, columns: Iterable[str]) -> None:
+        """
+        Add columns to the records, this is only possible before the first record is added
+        :param columns: Labels of the new columns, existing ones are ignored
+        """
+        new_columns = [c for c in columns if c not in self.buffers]
+        if new_columns and self.num_records:
+            raise ValueError(f'Cannot add perf columns {new_columns} after records have been added')
+        for c in new_columns:
+            self.columns.append(c)
+            self.buffers[c] = [] if c in _OBJECT_COLUMNS else array('d')
+
+    def record(self, kind: str, **values) -> int:
+        """
+        Add a record
+        :param kind: Kind of the record, e.g. generate, load, operation or serialize
+        :param values: Column label -> value, missing columns are empty
+        :return: Index of the new record, counting from offset
+        """
+        unknown = set(values) - set(self.buffers)
+        if unknown:
+            raise ValueError(f'Unknown perf columns {sorted(unknown)}')
+        values['kind'] = kind
+        row = []
+        with self._lock:
+            for c in self.columns:
+                value = values.get(c)
+                if c in _OBJECT_COLUMNS:
+                    self.buffers[c].append(value)
+                else:
+                    value = math.nan if value is None else float(value)
+                    self.buffers[c].append(value)
+                row.append(value)
+            self.num_records += 1
+            if self.stream_filename:
+                self._stream_row(row)
+            return self.offset + self.num_records - 1
+
+    def _stream_row(self, row) -> None:
+        if self._stream is None:
+            self._stream = open(self.stream_filename, 'a' if self._append else 'w', newline='')
+            self._append = True
+            if self.stream_format == 'csv':
+                self._csv_writer = csv.writer(self._stream)
+                if self._stream.tell() == 0:
+                    self._csv_writer.writerow([''] + self.columns)
+        if self.stream_format == 'csv':
+            self._csv_writer.writerow([self.offset + self.num_records - 1] + ['' if v is None else v for v in row])
+        else:
+            record = {c: (None if isinstance(v, float) and math.isnan(v) else v) for c, v in zip(self.columns, row)}
+            self._stream.write(json.dumps(record, default=str) + '\n')
+        self._stream.flush()
+
+    def to_df(self) -> pd.DataFrame:
+        """
+        :return: Dataframe with one row per record, indexed from offset
+        """
+        with self._lock:
+            return pd.DataFrame({c: np.array(self.buffers[c]) if isinstance(self.buffers[c], array)
+                                 else list(self.buffers[c]) for c in self.columns}, columns=self.columns,
+                                index=pd.RangeIndex(self.offset, self.offset + self.num_records))
+
+    def __len__(self):
+        return self.num_records
+
+    def close(self) -> None:
+        """ Close the stream file """
+        with self._lock:
+            if self._stream is not None:
+                self._stream.close()
+                self._stream = None
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+"""
+fuzzydata.core.plan
+~~~~~~~~~~~~
+This module contains compiled operation plans: chains of callables executed step by step with per-step timings
+:copyright: (c) Suhail Rehman 2022
+:license: MIT, see LICENSE for more details.
+"""
+
+import ast
+import functools
+import logging
+import time
+from typing import Any, Callable, Dict, List
+
+from fuzzydata.core.monitor import MetricsCollector, start_collectors, stop_collectors
+
+logger = logging.getLogger(__name__)
+
+
+@functools.lru_cache(maxsize=1024)
+def parse_literal(code: str) -> Any:
+    """
+    Parse a Python literal given as code (e.g. '"Visa"' or '3.5'), as used in the arguments of some operations.
+    Results are cached, so repeated operations parse each literal only once.
+    :param code: Code of the literal
+    :return: The value of the literal, or code itself if it is not a valid literal
+    """
+    try:
+        return ast.literal_eval(code)
+    except (ValueError, SyntaxError):
+        return code
+
+
+class PlanStep:
+    """ A single operation of a plan: a callable taking the result of the previous step and returning a new one """
+
+    def __init__(self, op: str, args: Dict, fn: Callable, code: str = ''):
+        """
+        :param op: Label of the operation, e.g. sample
+        :param args: Arguments of the operation
+        :param fn: Callable executing the operation on the result of the previous step
+        :param code: (optional) Code equivalent to fn, kept for exporting the plan
+        """
+        self.op = op
+        self.args = args
+        self.fn = fn
+        self.code = code
+
+
+class CompiledPlan:
+    """
+    Chain of operations compiled into callables. Running the plan calls every step on the result of the previous one,
+    without generating and re-parsing code, and times every step.
+    """
+
+    def __init__(self):
+        self.steps: List[PlanStep] = []
+        self.timings: List[Dict] = []
+
+    def add(self, op: str, args: Dict, fn: Callable, code: str = '') -> None:
+        """
+        Append a step to the plan
+        :param op: Label of the operation
+        :param args: Arguments of the operation
+        :param fn: Callable executing the operation on the result of the previous step
+        :param code: (optional) Code equivalent to fn
+        """
+        self.steps.append(PlanStep(op, args, fn, code))
+
+    def run(self, data, collectors: List[MetricsCollector] = None):
+        """
+        Execute the plan
+        :param data: Input of the first step
+        :param collectors: (optional) Metrics collectors to measure every step with, their metrics are added to the
+        timings of the steps
+        :return: Output of the last step
+        """
+        self.timings = []
+        for ix, step in enumerate(self.steps):
+            states = start_collectors(collectors) if collectors else None
+            start_time = time.perf_counter()
+            data = step.fn(data)
+            end_time = time.perf_counter()
+            metrics = stop_collectors(collectors, states) if collectors else {}
+            self.timings.append({
+                'step': ix,
+                'op': step.op,
+                **metrics,
+                'start_time': start_time,
+                'end_time': end_time,
+                'elapsed_time': end_time - start_time
+            })
+            logger.debug(f'Plan step {ix} ({step.op}) took {end_time - start_time:.4f}s')
+        return data
+
+    @property
+    def code(self) -> str:
+        """ Code equivalent to the plan, concatenated from the code of its steps """
+        return ''.join(step.code for step in self.steps)
+
+    def __len__(self):
+        return len(self.steps)
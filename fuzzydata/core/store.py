@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+
+"""
+fuzzydata.core.store
+~~~~~~~~~~~~
+This module contains the artifact store that writes artifacts with identical content only once
+:copyright: (c) Suhail Rehman 2022
+:license: MIT, see LICENSE for more details.
+"""
+
+import json
+import logging
+import os
+import threading
+from typing import Dict, List
+
+from fuzzydata.core.artifact import Artifact
+
+logger = logging.getLogger(__name__)
+
+
+class ArtifactStore:
+    """
+    Content-addressed index of the artifact files of a workflow. Every artifact written is recorded with its content
+    hash; an artifact whose content (and file format) matches one already written is hard linked to that file instead
+    of being serialized again. Columnar formats store the column dtypes as well, so their files are only shared by
+    artifacts with the same dtypes. The hashes are written to a JSON file and double as checksums to verify a replay
+    with, these ignore the dtypes.
+    """
+
+    def __init__(self):
+        self.files = {}  # (content hash, file format, compression) -> (absolute filename, label)
+        self.hashes = {}  # label -> {'hash', 'columns', 'duplicate_of'}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(artifact: Artifact):
+        # CSV files do not keep dtypes (they are restored from the schema map), Parquet and Feather files do
+        with_dtypes = artifact.file_format != 'csv'
+        return artifact.content_hash(with_dtypes=with_dtypes), artifact.file_format, artifact.compression
+
+    def link(self, artifact: Artifact, filename: str) -> bool:
+        """
+        Link filename to the file of an artifact with the same content, if one was written already
+        :param artifact: The artifact to be written
+        :param filename: Filename the artifact is to be written to
+        :return: True if filename now holds the artifact, False if it still has to be serialized (and add()ed)
+        """
+        key = self._key(artifact)
+        with self._lock:
+            existing, existing_label = self.files.get(key, (None, None))
+        if not existing or not os.path.exists(existing) or existing == os.path.abspath(filename):
+            return False
+        try:
+            tmp_filename = f'{filename}.link'
+            os.link(existing, tmp_filename)
+            os.replace(tmp_filename, filename)
+        except OSError as e:
+            # e.g. a different file system, fall back to writing the artifact
+            logger.debug(f'Could not link {filename} to {existing}: {e}')
+            return False
+        logger.debug(f'Linked {artifact.label} to identical artifact {existing}')
+        # An artifact written again, e.g. to another directory, is not a duplicate of itself
+        self._record(artifact, duplicate_of=existing_label if existing_label != artifact.label else None)
+        return True
+
+    def add(self, artifact: Artifact, filename: str) -> None:
+        """
+        Record an artifact written to filename
+        :param artifact: The artifact
+        :param filename: Filename the artifact was written to
+        """
+        key = self._key(artifact)
+        with self._lock:
+            self.files.setdefault(key, (os.path.abspath(filename), artifact.label))
+        self._record(artifact, duplicate_of=None)
+
+    def _record(self, artifact: Artifact, duplicate_of=None) -> None:
+        hashes = artifact.content_hashes()
+        with self._lock:
+            self.hashes[artifact.label] = {
+                'hash': artifact.content_hash(),
+                'index': hashes[None],
+                'columns': {col: col_hash for col, col_hash in hashes.items() if col is not None},
+                'format': [artifact.file_format, artifact.compression],
+                'duplicate_of': duplicate_of,
+            }
+
+    def write(self, filename: str) -> None:
+        """
+        Write the hashes of all recorded artifacts to a JSON file
+        :param filename: JSON filename
+        """
+        with self._lock:
+            hashes = dict(self.hashes)
+        with open(filename, 'w') as outfile:
+            outfile.write(json.dumps(hashes, indent=2))
+
+
+def verify_hashes(artifacts: Dict[str, Artifact], expected: Dict[str, Dict]) -> Dict[str, List[str]]:
+    """
+    Compare the content of artifacts with hashes recorded by an ArtifactStore, e.g. to check a replay
+    :param artifacts: Dict of label -> artifact
+    :param expected: Dict of label -> record, as written by ArtifactStore.write()
+    :return: Dict of label -> labels of the columns that differ (including "index" and missing or extra columns),
+    for every artifact that does not match
+    """
+    mismatches = {}
+    for label, artifact in artifacts.items():
+        if label not in expected or artifact.content_hash() == expected[label]['hash']:
+            continue
+        hashes = artifact.content_hashes()
+        columns = {col: col_hash for col, col_hash in hashes.items() if col is not None}
+        differ = ['index'] if hashes[None] != expected[label]['index'] else []
+        differ += [col for col in expected[label]['columns'].keys() | columns.keys()
+                   if columns.get(col) != expected[label]['columns'].get(col)]
+        mismatches[label] = sorted(differ)
+    return mismatches
@@ -4,20 +4,30 @@ import glob
 import os
 import logging
 import json
-import time
 import threading
+import time
 
 from abc import ABC, abstractmethod
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from typing import Dict, List
 
 import networkx as nx
 import numpy as np
 import pandas as pd
 
-from fuzzydata.core.artifact import Artifact
+from fuzzydata.core.artifact import Artifact, SUPPORTED_FILE_FORMATS
+from fuzzydata.core.cache import TableCache
 from fuzzydata.core.generator import generate_schema
+from fuzzydata.core.memory import ArtifactMemoryManager
 from fuzzydata.core.operation import Operation
-from fuzzydata.core.monitor import Monitor
+from fuzzydata.core.optimizer import optimize_op_list, required_columns
+from fuzzydata.core.perf import PerfRecorder, STEP_PERF_COLUMNS
+from fuzzydata.core.store import ArtifactStore, verify_hashes
+from fuzzydata.core.oplog import OperationLog, is_complete, remove_marker, write_marker
+from fuzzydata.core.writer import ArtifactWriter
+from fuzzydata.core.monitor import DEFAULT_MONITOR_INTERVAL, MetricsCollector, default_collectors, \
+    start_collectors, stop_collectors
 
 logger = logging.getLogger(__name__)
 
@@ -28,11 +38,60 @@ class Workflow(ABC):
     the workflow as required.
     """
 
-    def __init__(self, name='wf', out_directory='/tmp/fuzzydata/wf/'):
+    def __init__(self, name='wf', out_directory='/tmp/fuzzydata/wf/', pool_sizes=None, seed=None, gen_workers=1,
+                 stream_chunk_size=None, categorical=False, cache_dir=None, cache_max_bytes=None,
+                 monitor_interval=DEFAULT_MONITOR_INTERVAL, trace_allocations=False, replay_workers=1,
+                 memory_budget=None, evict_artifacts=False, write_workers=0, checkpoint=False,
+                 perf_stream_format=None, lazy=False, optimize=False, profile_steps=False, file_format='csv',
+                 compression=None, memory_map=False, prune_columns=False, csv_engine=None, csv_chunk_size=None,
+                 dedup_artifacts=False, verify_hashes=False, artifact_stats=False):
         """
         Create a new workflow with a specified name
         :param name: Name of the workflow
         :param out_directory: Output Directory for this workflow
+        :param pool_sizes: (optional) Dict of faker_provider->number of distinct values drawn when generating tables
+        :param seed: (optional) Seed for generated tables, makes generated artifacts reproducible across runs
+        :param gen_workers: Number of worker processes used to generate tables (default 1)
+        :param stream_chunk_size: (optional) Generate base artifacts straight to disk in chunks of this many rows
+        :param categorical: Store groupable columns with category dtype, for clients that support it (default False)
+        :param cache_dir: (optional) Directory of a TableCache for generated base artifacts. Only used with a seed.
+        :param cache_max_bytes: (optional) Size cap of the table cache in bytes, least recently used tables are evicted
+        :param monitor_interval: Seconds between two memory samples taken while timing generate, load and operations.
+        <= 0 relies on the kernel's peak RSS counter only (Linux)
+        :param trace_allocations: Also record bytes allocated by every step with tracemalloc, slows down allocations
+        :param replay_workers: Number of threads replaying independent operations concurrently. 1 (default) replays
+        serially, which keeps the timings and resource metrics of every operation isolated
+        :param memory_budget: (optional) Bytes of artifact data to keep in memory, least recently used artifacts are
+        spilled to disk beyond that and reloaded when used again
+        :param evict_artifacts: During replay, write out and unload artifacts once no pending operation consumes them
+        :param write_workers: Number of background threads writing out every artifact as soon as it is produced.
+        0 (default) writes all artifacts in serialize_workflow()
+        :param checkpoint: Write out every artifact as soon as it is produced and keep an append-only operation log
+        ({name}_oplog.jsonl) with artifact completion markers, so that an interrupted run can be resumed with resume()
+        :param perf_stream_format: (optional) Stream every performance record to {name}_perf.{format} as it is
+        recorded, csv or jsonl. By default records are only kept in memory until write_perf()
+        :param lazy: During replay, keep intermediate artifacts consumed by a single operation as plans and fuse them
+        into that operation instead of materializing them, see fuse_op_list()
+        :param optimize: During replay, reorder the chained operations of every operation with the rule-based
+        optimizer (fuzzydata.core.optimizer) so that merges join smaller inputs
+        :param profile_steps: Time and measure every chained operation of an operation individually, materializing
+        the result of every step, and record them in a child perf table ({name}_step_perf) linked to the perf record
+        of the operation
+        :param file_format: Format the artifacts of this workflow are serialized to: csv (default), parquet or feather
+        :param compression: (optional) Compression codec of parquet or feather artifacts, the library default if not
+        specified
+        :param memory_map: During replay, memory-map parquet and feather source artifacts instead of reading them, see
+        Artifact.read_table(). Feather artifacts are then written uncompressed unless a compression is given.
+        :param prune_columns: During replay, load only the columns of every source artifact that the operations
+        consuming it read, see required_source_columns()
+        :param csv_engine: (optional) Parser engine used to read CSV artifacts: c, python or pyarrow
+        :param csv_chunk_size: (optional) Parse CSV artifacts in chunks of this many rows, see Artifact.read_csv()
+        :param dedup_artifacts: Hash the content of every artifact written, write artifacts identical to one already
+        written as hard links to its file and record the hashes in {name}_artifact_hashes.json, see ArtifactStore
+        :param verify_hashes: After a replay, compare the replayed artifacts with the hashes recorded by the loaded
+        workflow, see verify_replay()
+        :param artifact_stats: Compute the statistics of every artifact (rows, bytes, null and distinct values of every
+        column) once when it is added, and write them to {name}_artifact_stats.json, see Artifact.stats()
         """
 
         self.name = name
@@ -45,15 +104,81 @@ class Workflow(ABC):
 
         self.artifact_class = None
         self.operator_class = None
+        if file_format not in SUPPORTED_FILE_FORMATS:
+            raise ValueError(f'Unsupported file format {file_format}, expected one of {SUPPORTED_FILE_FORMATS}')
+        self.file_format = file_format
+        if memory_map and file_format == 'feather' and compression is None:
+            # Only uncompressed feather files are mapped without copying, write them so for replays to map them
+            compression = 'uncompressed'
+        self.compression = compression
+        if csv_engine == 'pyarrow' and csv_chunk_size:
+            raise ValueError('csv_chunk_size is not supported by the pyarrow CSV engine, use the c or python engine')
+        self.csv_engine = csv_engine
+        self.csv_chunk_size = csv_chunk_size
 
         self.operation_list = []
 
-        self.perf_records = []
+        self.perf = PerfRecorder(stream_filename=f"{self.out_dir}/{name}_perf.{perf_stream_format}"
+                                 if perf_stream_format else None,
+                                 stream_format=perf_stream_format or 'jsonl', append=checkpoint)
+        self.profile_steps = profile_steps
+        self.step_perf = PerfRecorder(stream_filename=f"{self.out_dir}/{name}_step_perf.{perf_stream_format}"
+                                      if perf_stream_format and profile_steps else None,
+                                      stream_format=perf_stream_format or 'jsonl', append=checkpoint,
+                                      columns=STEP_PERF_COLUMNS)
 
         self.current_operation = None
 
+        # Guards the artifacts, operation list and perf records when operations are executed concurrently
+        self._lock = threading.RLock()
+        self.replay_workers = replay_workers
+        self.lazy = lazy
+        # Most operations fused into one, clients whose fused code nests (e.g. SQL subqueries) set a limit
+        self.max_fused_ops = None
+        self.optimize = optimize
+        self.memory_map = memory_map
+        self.prune_columns = prune_columns
+
+        # Options passed on to generate_table whenever this workflow generates a table
+        self.generation_options = {
+            'pool_sizes': pool_sizes,
+            'seed': seed,
+            'num_workers': gen_workers,
+        }
+        self.stream_chunk_size = stream_chunk_size
+        self.categorical = categorical
+        self.table_cache = TableCache(cache_dir, max_bytes=cache_max_bytes) if cache_dir else None
+        self.oplog = OperationLog(f"{self.out_dir}/{self.name}_oplog.jsonl") if checkpoint else None
+        self.artifact_store = ArtifactStore() if dedup_artifacts else None
+        self.verify_hashes = verify_hashes
+        self.hash_mismatches = {}
+        self.artifact_stats = artifact_stats
+        self.source_stats = {}  # label -> stats recorded by the workflow being replayed, see load_workflow()
+        self.artifact_writer = None
+        if write_workers or checkpoint:
+            self.artifact_writer = ArtifactWriter(max_workers=max(1, write_workers), on_written=self._artifact_written,
+                                                  store=self.artifact_store)
+        self.memory_manager = None
+        if memory_budget is not None or evict_artifacts:
+            self.memory_manager = ArtifactMemoryManager(self.artifact_dir, f"{self.out_dir}/spill/",
+                                                        memory_budget=memory_budget, evict_consumed=evict_artifacts,
+                                                        writer=self.artifact_writer)
+        self.metrics_collectors = default_collectors(monitor_interval, trace_allocations=trace_allocations)
+        self.perf.add_columns(f for c in self.metrics_collectors for f in c.fields)
+        self.step_perf.add_columns(f for c in self.metrics_collectors for f in c.fields)
+
         logger.info(f'Creating new Workflow {self.name}')
 
+    def add_metrics_collector(self, collector: MetricsCollector) -> None:
+        """
+        Record the metrics of an additional collector for every generate, load and operation of this workflow.
+        Collectors have to be added before the first performance record.
+        :param collector: The metrics collector, e.g. with engine-specific counters
+        """
+        self.perf.add_columns(collector.fields)
+        self.step_perf.add_columns(collector.fields)
+        self.metrics_collectors.append(collector)
+
     def generate_next_label(self):
         """ Generate a new label for the next artifact in the form of "artifact_N" """
         return f"artifact_{len(self)}"
@@ -69,6 +194,14 @@ class Workflow(ABC):
         """
         pass
 
+    def add_perf_record(self, record: Dict) -> int:
+        """
+        Add a row to the performance records of this workflow
+        :param record: Dict of column label -> value, with the kind of record (generate, load, operation, serialize)
+        :return: Index of the new row
+        """
+        return self.perf.record(**record)
+
     def add_artifact(self, artifact: Artifact,
                      from_artifacts: List[Artifact] = None, operation: Operation = None) -> None:
         """
@@ -78,6 +211,48 @@ class Workflow(ABC):
         :param from_artifacts: (optional) Source artifacts from which this new artifact was derived
         :param operation: Operation used to derive this new artifact
         """
+        sources = [u.label for u in from_artifacts] if from_artifacts else []
+        code = operation.code if operation else None
+        self._add_to_graph(artifact, sources, code)
+
+        if self.artifact_stats and not artifact.has_stats:
+            self._collect_stats(artifact)
+
+        filename = f"{self.artifact_dir}/{artifact.label}.{artifact.file_format}"
+        if self.oplog:
+            remove_marker(filename)
+            self.oplog.append({
+                'label': artifact.label,
+                'schema_map': artifact.schema_map,
+                'file_format': artifact.file_format,
+                'sources': sources,
+                'code': code,
+                'operation': operation.to_dict() if operation else None,
+            })
+
+        if self.artifact_writer:
+            self.artifact_writer.submit(artifact, filename)
+
+        if self.memory_manager:
+            self.memory_manager.register(artifact)
+
+    def _collect_stats(self, artifact: Artifact) -> None:
+        """
+        Compute the statistics of an artifact (see Artifact.stats()) with a 'stats' perf record
+        :param artifact: The artifact
+        """
+        start_time = time.perf_counter()
+        artifact.stats()
+        end_time = time.perf_counter()
+        self.add_perf_record({
+            'kind': 'stats',
+            'src': artifact.label,
+            'start_time': start_time,
+            'end_time': end_time,
+            'elapsed_time': end_time - start_time
+        })
+
+    def _add_to_graph(self, artifact: Artifact, sources: List[str], code: str) -> None:
         self.graph.add_node(artifact.label,
                             **{
                                 'schema_map': artifact.schema_map,
@@ -89,11 +264,57 @@ class Workflow(ABC):
         self.artifact_list.append(artifact.label)
         self.artifact_dict[artifact.label] = artifact
 
-        if from_artifacts:
-            for u in from_artifacts:
-                self.graph.add_edge(u.label, v, **{
-                    'code': operation.code,
-                })
+        for u in sources:
+            self.graph.add_edge(u, v, **{
+                'code': code,
+            })
+
+    def _artifact_written(self, record: Dict) -> None:
+        self.add_perf_record(record)
+        if self.oplog:
+            write_marker(record['dst'], label=record['src'])
+
+    def resume(self, contiguous=True) -> int:
+        """
+        Restore the artifacts of an interrupted run of this workflow from the operation log and the artifacts
+        completely written to the artifact directory. Requires the workflow to be created with checkpoint=True.
+        :param contiguous: Only restore artifacts added before the first incomplete one, so that newly added artifacts
+        continue the artifact_N numbering (generation). Otherwise restore every complete artifact whose sources are
+        restored as well (replay).
+        :return: Number of artifacts restored
+        """
+        if not self.oplog:
+            raise RuntimeError('Resuming a workflow requires checkpoint=True')
+
+        # The last record of a label wins, artifacts added again after an earlier resume replace the old ones
+        records = {}
+        for record in self.oplog.read():
+            records[record['label']] = record
+
+        discarded = []
+        for label, record in records.items():
+            filename = f"{self.artifact_dir}/{label}.{record['file_format']}"
+            if (contiguous and discarded) or not is_complete(filename) or \
+                    not all(s in self.artifact_dict for s in record['sources']):
+                discarded.append(record)
+                continue
+
+            logger.info(f'Resuming with artifact {label} from {filename}')
+            artifact = self.initialize_new_artifact(label=label, filename=filename, schema_map=record['schema_map'])
+            artifact.restore()
+            self._add_to_graph(artifact, record['sources'], record['code'])
+            if record['operation']:
+                self.operation_list.append(record['operation'])
+            self.artifact_writer.mark_written(label, filename)
+            if self.memory_manager:
+                self.memory_manager.register(artifact)
+
+        # Drop whatever the interrupted run left behind for the other artifacts (e.g. views in a database)
+        for record in reversed(discarded):
+            self.initialize_new_artifact(label=record['label'], schema_map=record['schema_map']).destroy()
+
+        logger.info(f'Resumed {len(self)} artifacts of workflow {self.name}')
+        return len(self)
 
     def generate_base_artifact(self, num_rows=100, num_cols=10, column_maps=None, label: str = None) -> Artifact:
         """
@@ -110,30 +331,37 @@ class Workflow(ABC):
             label = self.generate_next_label()
 
         # 监视内存占用
-        monitor = Monitor(os.getpid())
-        thread = threading.Thread(target=monitor.begin)
-        thread.start()
+        states = start_collectors(self.metrics_collectors)
 
         start_time = time.perf_counter()
-        new_artifact = self.initialize_new_artifact(label=label, filename=f"{self.artifact_dir}/{label}.csv",
+        new_artifact = self.initialize_new_artifact(label=label,
+                                                    filename=f"{self.artifact_dir}/{label}.{self.file_format}",
                                                     schema_map=column_maps)
-        new_artifact.generate(num_rows, column_maps)
+        cache_hits = self.table_cache.hits if self.table_cache else 0
+        if self.stream_chunk_size:
+            new_artifact.generate_chunked(num_rows, column_maps, chunk_size=self.stream_chunk_size,
+                                          stats=self.artifact_stats, **self.generation_options)
+        else:
+            new_artifact.generate(num_rows, column_maps, cache=self.table_cache, **self.generation_options)
         end_time = time.perf_counter()
 
-        mem = monitor.end()
+        metrics = stop_collectors(self.metrics_collectors, states)
+
+        cache_status = np.nan
+        if self.table_cache and not self.stream_chunk_size and self.generation_options['seed'] is not None:
+            cache_status = 'hit' if self.table_cache.hits > cache_hits else 'miss'
 
         self.add_artifact(new_artifact)
 
-        self.perf_records.append(pd.Series({
-            'src': np.nan,
+        self.add_perf_record({
+            'kind': 'generate',
             'dst': label,
-            'op': 'generate',
-            'args': np.nan,
-            'mem': mem,
+            'cache': cache_status,
+            **metrics,
             'start_time': start_time,
             'end_time': end_time,
             'elapsed_time': end_time - start_time
-        }).to_frame().T)
+        })
 
         return new_artifact
 
@@ -147,14 +375,17 @@ class Workflow(ABC):
             raise RuntimeError
         return True
 
-    def initialize_operation(self, artifacts: List[Artifact]) -> Operation:
+    def initialize_operation(self, artifacts: List[Artifact], set_current=True) -> Operation:
         """
         Initializes a new operation to be performed on "artifacts"
         :param artifacts: List of artifacts to be operated upon.
+        :param set_current: Make the new operation the current operation of this workflow (default True)
         :return: Operation object ready to add tranformations to
         """
-        self.current_operation = self.operator_class(sources=artifacts, artifact_class=self.artifact_class)
-        return self.current_operation
+        operation = self.operator_class(sources=artifacts, artifact_class=self.artifact_class)
+        if set_current:
+            self.current_operation = operation
+        return operation
 
     def chain_to_current_operation(self, op_list: List[Dict]) -> None:
         """
@@ -172,44 +403,77 @@ class Workflow(ABC):
         :param new_label: The new label to assign to the new artifact generated by the operation
         :return: Artifact object representing the new artifact.
         """
-        new_artifact = None
         self.validate_current_operation()
+        new_artifact = self.execute_operation(self.current_operation, new_label)
+        self.current_operation = None
+        return new_artifact
+
+    def execute_operation(self, operation: Operation, new_label) -> Artifact:
+        """
+        Execute a stacked operation to generate a new artifact with label "new_label" and record it in the workflow.
+        Unlike execute_current_operation(), this does not touch the current operation, so independent operations can
+        be executed from several threads at once.
+        :param operation: The operation to be executed
+        :param new_label: The new label to assign to the new artifact generated by the operation
+        :return: Artifact object representing the new artifact.
+        """
         if not new_label:
-            new_label = self.generate_next_label()
+            with self._lock:
+                new_label = self.generate_next_label()
+        if self.memory_manager:
+            self.memory_manager.acquire(operation.sources)
         try:
-            new_artifact = self.current_operation.execute(new_label)
-            self.add_artifact(new_artifact, from_artifacts=self.current_operation.sources,
-                              operation=self.current_operation)
+            new_artifact = operation.execute(new_label, collectors=self.metrics_collectors,
+                                             step_collectors=self.metrics_collectors if self.profile_steps else None)
 
             # TODO: Exception Handling and return value on op failure / empty df
 
-            # Add operation to op list
-            self.operation_list.append(self.current_operation.to_dict())
+            # From the table just produced, before it can be spilled, and outside the lock so that concurrent
+            # operations are not serialized on it
+            if self.artifact_stats:
+                self._collect_stats(new_artifact)
 
-            # Add performance information
-            self.perf_records.append(pd.Series({
-                'src': tuple(x.label for x in self.current_operation.sources),
-                'dst': self.current_operation.new_label,
-                'op_list': '+'.join([x['op'] for x in self.current_operation.op_list]),
-                'code': self.current_operation.code,
-                'mem': self.current_operation.mem,
-                'start_time': self.current_operation.start_time,
-                'end_time': self.current_operation.end_time,
-                'elapsed_time': self.current_operation.get_execution_time()
-            }).to_frame().T)
+            with self._lock:
+                self.add_artifact(new_artifact, from_artifacts=operation.sources, operation=operation)
 
-            self.current_operation = None
+                # Add operation to op list
+                self.operation_list.append(operation.to_dict())
+
+                # Add performance information
+                parent = self.add_perf_record({
+                    'kind': 'operation',
+                    'src': tuple(x.label for x in operation.sources),
+                    'dst': operation.new_label,
+                    'op': '+'.join([x['op'] for x in operation.op_list]),
+                    'args': json.dumps([x['args'] for x in operation.op_list], default=str),
+                    'code': operation.code,
+                    **operation.resource_stats,
+                    'start_time': operation.start_time,
+                    'end_time': operation.end_time,
+                    'elapsed_time': operation.get_execution_time()
+                })
+                if self.profile_steps:
+                    for timing in operation.step_timings():
+                        self.step_perf.record('step', parent=parent,
+                                              args=json.dumps(operation.op_list[timing['step']]['args'], default=str),
+                                              **timing)
 
             return new_artifact
 
         except (NameError, ValueError) as e:
-            logger.error(f'Could not execute Operation: {self.current_operation.op_list}')
-            op_dict = self.current_operation.to_dict()
+            logger.error(f'Could not execute Operation: {operation.op_list}')
+            op_dict = operation.to_dict()
             op_dict['status'] = 'error'
-            self.operation_list.append(op_dict)
-            self.serialize_workflow()
+            with self._lock:
+                self.operation_list.append(op_dict)
+                self.serialize_workflow()
             raise e
 
+        finally:
+            # Unpin the sources whether or not the operation succeeded, so that the budget can evict them again
+            if self.memory_manager:
+                self.memory_manager.release(operation.sources)
+
     def generate_artifact_from_operation_list(self, artifacts: List[Artifact], op_list: List[Dict],
                                               new_label: str = None) -> Artifact:
         """
@@ -241,14 +505,36 @@ class Workflow(ABC):
         artifact_dir = f"{output_dir}/artifacts/"
         os.makedirs(artifact_dir, exist_ok=True)
 
-        # Write out all artifacts
+        if self.artifact_writer:
+            self.artifact_writer.close()
+
+        # Write out all artifacts, except the ones the write-behind writer already wrote there
         for label, artifact in self.artifact_dict.items():
+            filename = f"{artifact_dir}/{label}.{artifact.file_format}"
+            if self.artifact_writer and self.artifact_writer.is_written(label, filename):
+                continue
             logger.debug(f"Serialization {label}, {artifact.label}")
-            artifact.serialize(filename=f"{artifact_dir}/{label}.{artifact.file_format}")
+            start_time = time.perf_counter()
+            if not self.artifact_store or not self.artifact_store.link(artifact, filename):
+                artifact.serialize(filename=filename)
+                if self.artifact_store:
+                    self.artifact_store.add(artifact, filename)
+            end_time = time.perf_counter()
+            self.add_perf_record({
+                'kind': 'serialize',
+                'src': label,
+                'dst': filename,
+                'bytes': os.path.getsize(filename) if os.path.exists(filename) else np.nan,
+                'start_time': start_time,
+                'end_time': end_time,
+                'elapsed_time': end_time - start_time
+            })
 
         # Write out Operation List JSON
         with open(f"{output_dir}/{self.name}_operations.json", 'w') as outfile:
             outfile.write(json.dumps({'name': self.name,
+                                      'file_format': self.file_format,
+                                      'compression': self.compression,
                                       'operation_list': [op for op in self.operation_list]
                                       }, indent=2))
 
@@ -260,12 +546,20 @@ class Workflow(ABC):
         with open(f"{output_dir}/{self.name}_schema_map.json", 'w') as outfile:
             outfile.write(json.dumps(schema_map_dict, indent=2))
 
+        if self.artifact_store:
+            self.artifact_store.write(f"{output_dir}/{self.name}_artifact_hashes.json")
+
+        if self.artifact_stats:
+            with open(f"{output_dir}/{self.name}_artifact_stats.json", 'w') as outfile:
+                outfile.write(json.dumps({label: artifact.stats() for label, artifact in self.artifact_dict.items()},
+                                         indent=2))
+
         # Write out performance table
         self.write_perf()
 
     @classmethod
     def load_workflow(cls, input_dir: str, out_directory: str, name=None, replay=False,
-                      wf_options={}, scale_artifact={}) -> Workflow:
+                      wf_options={}, scale_artifact={}, resume=False, targets: List[str] = None) -> Workflow:
         """
         Load a workflow from disk, usually for replay
         :param input_dir: Input workflow directory
@@ -274,6 +568,8 @@ class Workflow(ABC):
         :param replay: Replay the workflow? Default False.
         :param wf_options: Dict of workflow options
         :param scale_artifact: Dict of artifact labels and scale factor if scaling is required.
+        :param resume: Resume an interrupted replay into out_directory, skipping artifacts it already completed
+        :param targets: (optional) Only replay the operations needed to produce the artifacts with these labels
         :return:
         """
         try:
@@ -286,14 +582,27 @@ class Workflow(ABC):
             if name is None:
                 name = ops['name']
 
+            # Artifacts are written in the format of the loaded workflow unless specified otherwise
+            source_format = ops.get('file_format', 'csv')
+            wf_options = {'file_format': source_format, 'compression': ops.get('compression'), **wf_options}
+            if resume:
+                wf_options = {**wf_options, 'checkpoint': True}
             workflow = cls(name=name, out_directory=out_directory, **wf_options)
 
             if replay:
+                if resume:
+                    workflow.resume(contiguous=False)
+                stats_files = glob.glob(f"{input_dir}/*_artifact_stats.json")
+                if stats_files:
+                    with open(stats_files[0], 'r') as infile:
+                        workflow.source_stats = json.load(infile)
                 schema_map_file = glob.glob(f"{input_dir}/*_schema_map.json")[0]
                 with open(schema_map_file, 'r') as infile:
                     all_schema_maps = json.load(infile)
                 workflow.replay_op_list(artifact_dir, op_list=ops['operation_list'], all_schema_maps=all_schema_maps,
-                                        scale_artifact=scale_artifact)
+                                        scale_artifact=scale_artifact, targets=targets, source_format=source_format)
+                if workflow.verify_hashes:
+                    workflow.verify_replay(input_dir)
                 workflow.write_perf()
 
             # Revisit copying the workflow graph over, currently replay does this for us.
@@ -304,69 +613,317 @@ class Workflow(ABC):
         except FileNotFoundError as e:
             logger.error(f"Error Loading Workflow from {input_dir}: {e}")
 
-    def replay_op_list(self, artifact_dir: str, op_list=None, all_schema_maps=None, scale_artifact={}) -> None:
+    def verify_replay(self, input_dir: str) -> Dict[str, List[str]]:
+        """
+        Compare the artifacts of this workflow with the content hashes recorded by the workflow in input_dir (written
+        with dedup_artifacts). Artifacts of nondeterministic operations (sample) and pruned source artifacts differ.
+        :param input_dir: Directory of the replayed workflow
+        :return: Dict of label -> columns that differ, for every artifact that does not match, also kept in
+        self.hash_mismatches
+        """
+        hash_files = glob.glob(f"{input_dir}/*_artifact_hashes.json")
+        if not hash_files:
+            logger.warning(f'No artifact hashes to verify the replay with in {input_dir}')
+            return {}
+        with open(hash_files[0], 'r') as infile:
+            expected = json.load(infile)
+
+        self.hash_mismatches = verify_hashes(self.artifact_dict, expected)
+        for label, columns in self.hash_mismatches.items():
+            logger.warning(f'Replayed artifact {label} differs from the original in {columns}')
+        logger.info(f'Verified {len(set(expected) & set(self.artifact_dict))} artifacts, '
+                    f'{len(self.hash_mismatches)} differ')
+        return self.hash_mismatches
+
+    def replay_op_list(self, artifact_dir: str, op_list=None, all_schema_maps=None, scale_artifact={},
+                       targets: List[str] = None, source_format: str = None) -> None:
         """
-        Replay the operation list given by "op_list" using artifacts in "artifact_dir"
+        Replay the operation list given by "op_list" using artifacts in "artifact_dir". With replay_workers > 1,
+        operations whose sources are available are executed concurrently on a thread pool, following the dependencies
+        between operations; otherwise they are executed one at a time, in order.
         :param artifact_dir: Directory containing all the artifact
         :param op_list: List of operations to be performed (List of Dicts)
         :param all_schema_maps: Dict containing the schema map for all source artifacts in the workflow
         :param scale_artifact: Scaling factor for each artifact, if needed.
+        :param targets: (optional) Labels of the artifacts to be replayed. Only the operations needed to produce them
+        are executed and only the source artifacts they need are loaded.
+        :param source_format: (optional) File format of the artifacts in artifact_dir, the format of this workflow if
+        not specified
         :return: None
         """
+        if targets:
+            op_list = self.select_target_operations(op_list, targets, all_schema_maps)
+            produced = {opl['new_label'] for opl in op_list}
+            for target in targets:
+                # Targets that are source artifacts themselves only need to be loaded
+                if target not in produced and target not in self.artifact_dict:
+                    self.load_source_artifact(artifact_dir, target, all_schema_maps, scale_artifact, source_format)
+
+        # Operations whose artifacts were restored by resume() are not replayed again
+        op_list = [opl for opl in op_list if opl['new_label'] not in self.artifact_dict]
+
+        if self.lazy:
+            op_list = self.fuse_op_list(op_list, keep=targets, max_ops=self.max_fused_ops)
+
+        if self.memory_manager:
+            self.memory_manager.set_pending_operations(op_list)
+
+        source_columns = self.required_source_columns(op_list, all_schema_maps) if self.prune_columns else {}
+
+        if self.replay_workers > 1:
+            self._replay_op_list_parallel(artifact_dir, op_list, all_schema_maps, scale_artifact, source_format,
+                                          source_columns)
+            return
+
         for opl in op_list:
             for source in opl['sources']:
                 if source not in self.artifact_dict.keys():
-                    # TODO: Handle PK-FK merges properly - if DF is merge input, we need to maintain the keyspace and
-                    # column schema maybe?
-                    # 放缩artifact
-                    if source in scale_artifact.keys():
-                        logger.info(f"Scaling up Artifact {source} to size {scale_artifact[source]}")
-                        source_artifact = self.generate_base_artifact(num_rows=scale_artifact[source],
-                                                                      label=source,
-                                                                      column_maps=all_schema_maps[source])
-                    else:
-                        logger.info(f"Loading Pre-Generated Artifact: {source} ")
-                        source_artifact = self.initialize_new_artifact(label=source, schema_map=all_schema_maps[source])
-
-                        # 监视内存占用
-                        monitor = Monitor(os.getpid())
-                        thread = threading.Thread(target=monitor.begin)
-                        thread.start()
-
-                        start_time = time.perf_counter()
-                        source_artifact.deserialize(filename=f"{artifact_dir}/{source}.{source_artifact.file_format}")
-                        end_time = time.perf_counter()
-                        mem = monitor.end()
-                        self.perf_records.append(pd.Series({
-                            'src': source,
-                            'dst': np.nan,
-                            'op': 'load',
-                            'args': np.nan,
-                            "mem": mem,
-                            'start_time': start_time,
-                            'end_time': end_time,
-                            'elapsed_time': end_time - start_time
-                        }).to_frame().T)
-                        self.add_artifact(source_artifact)
-
-            logger.info(f"Replaying Operation List: {tuple(a for a in opl['sources'])} "
-                        f"=====> {opl['new_label']}")
-            self.generate_artifact_from_operation_list([self.artifact_dict[x] for x in opl['sources']],
-                                                       opl['op_list'], new_label=opl['new_label'])
-
-    def write_perf(self, filename=None):
+                    self.load_source_artifact(artifact_dir, source, all_schema_maps, scale_artifact, source_format,
+                                              columns=source_columns.get(source))
+
+            self.replay_operation(opl)
+
+    @staticmethod
+    def select_target_operations(op_list: List[Dict], targets: List[str], all_schema_maps: Dict = None) -> List[Dict]:
+        """
+        Select the operations needed to produce a set of target artifacts, i.e. the operations producing the targets
+        and all of their ancestors in the lineage graph
+        :param op_list: List of operations (List of Dicts)
+        :param targets: Labels of the target artifacts
+        :param all_schema_maps: (optional) Dict containing the schema map for all artifacts, to validate the targets
+        :return: The selected operations, in the order of op_list
+        """
+        lineage = nx.DiGraph()
+        for opl in op_list:
+            lineage.add_node(opl['new_label'])
+            for source in opl['sources']:
+                lineage.add_edge(source, opl['new_label'])
+
+        known = set(lineage.nodes()) | set(all_schema_maps or {})
+        unknown = [t for t in targets if t not in known]
+        if unknown:
+            raise ValueError(f'Unknown replay targets {unknown}')
+
+        needed = set(targets)
+        for target in targets:
+            if target in lineage:
+                needed |= nx.ancestors(lineage, target)
+        selected = [opl for opl in op_list if opl['new_label'] in needed]
+        logger.info(f'Replaying {len(selected)} of {len(op_list)} operations for targets {targets}')
+        return selected
+
+    @staticmethod
+    def fuse_op_list(op_list: List[Dict], keep: List[str] = None, max_ops: int = None) -> List[Dict]:
+        """
+        Fuse linear chains of operations: an intermediate artifact consumed by exactly one later operation, as its
+        first source, is not materialized. Its operation is prepended to the consuming operation instead, whose code
+        then runs as a single expression (or query) from the first unfused source.
+        :param op_list: List of operations (List of Dicts) in execution order
+        :param keep: (optional) Labels of artifacts to materialize regardless, e.g. replay targets
+        :param max_ops: (optional) Most operations in a fused operation, longer chains are materialized in between
+        :return: List of fused operations, each with the labels of the artifacts fused into it under "fused"
+        """
+        keep = set(keep or [])
+        consumers = Counter(s for opl in op_list for s in opl['sources'])
+        first_sources = Counter(opl['sources'][0] for opl in op_list if opl['sources'])
+
+        plans = {}  # label -> operation producing an unmaterialized artifact
+        fused_list = []
+        for opl in op_list:
+            head = opl['sources'][0] if opl['sources'] else None
+            if head in plans:
+                plan = plans.pop(head)
+                if max_ops and len(plan['op_list']) + len(opl['op_list']) > max_ops:
+                    # Too long to run as one expression, materialize the chain so far and start a new one from it
+                    fused_list.append(plan)
+                else:
+                    opl = {'sources': plan['sources'] + opl['sources'][1:],
+                           'new_label': opl['new_label'],
+                           'op_list': plan['op_list'] + opl['op_list'],
+                           'fused': plan.get('fused', []) + [head]}
+
+            label = opl['new_label']
+            # Pivots change the shape of the columns and always end a chain, see generate_workflow()
+            ends_chain = any(op_dict['op'] == 'pivot' for op_dict in opl['op_list'])
+            if consumers[label] == 1 and first_sources[label] == 1 and label not in keep and not ends_chain:
+                plans[label] = opl
+            else:
+                fused_list.append(opl)
+
+        logger.info(f'Fused {len(op_list)} operations into {len(fused_list)}')
+        return fused_list
+
+    @staticmethod
+    def required_source_columns(op_list: List[Dict], all_schema_maps: Dict) -> Dict[str, List[str]]:
+        """
+        Columns of every source artifact read by the operations of op_list, see fuzzydata.core.optimizer.required_columns
+        :param op_list: List of operations (List of Dicts)
+        :param all_schema_maps: Dict containing the schema map for all source artifacts in the workflow
+        :return: Dict of artifact label -> its required columns, in schema order. Artifacts whose columns are all
+        required, or whose schema is not known, are left out.
+        """
+        required = {}
+        for opl in op_list:
+            schemas = [list(all_schema_maps.get(s) or {}) for s in opl['sources']]
+            # Operations on artifacts without a known schema read every column of their sources
+            per_source = required_columns(opl['op_list'], schemas) if all(schemas) else [None] * len(schemas)
+            for source, columns in zip(opl['sources'], per_source):
+                if columns is None or required.get(source, set()) is None:
+                    required[source] = None
+                else:
+                    required[source] = required.get(source, set()) | columns
+        return {source: [c for c in all_schema_maps[source] if c in columns]
+                for source, columns in required.items()
+                if columns is not None and not set(all_schema_maps[source]) <= columns}
+
+    def _replay_op_list_parallel(self, artifact_dir, op_list, all_schema_maps, scale_artifact,
+                                 source_format=None, source_columns=None) -> None:
+        produced = {opl['new_label']: ix for ix, opl in enumerate(op_list)}
+        source_columns = source_columns or {}
+
+        # Source artifacts that no operation produces are loaded (or scaled up) before replay starts
+        for opl in op_list:
+            for source in opl['sources']:
+                if source not in produced and source not in self.artifact_dict.keys():
+                    self.load_source_artifact(artifact_dir, source, all_schema_maps, scale_artifact, source_format,
+                                              columns=source_columns.get(source))
+
+        # Dependency DAG between operations: number of unfinished parent operations, and children of each operation
+        waiting_on = [0] * len(op_list)
+        children = [[] for _ in op_list]
+        for ix, opl in enumerate(op_list):
+            parents = {produced[s] for s in opl['sources'] if s in produced and produced[s] != ix}
+            waiting_on[ix] = len(parents)
+            for parent in parents:
+                children[parent].append(ix)
+
+        with ThreadPoolExecutor(max_workers=self.replay_workers) as executor:
+            running = {executor.submit(self.replay_operation, op_list[ix]): ix
+                       for ix, count in enumerate(waiting_on) if count == 0}
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    ix = running.pop(future)
+                    if future.exception():
+                        for pending in running:
+                            pending.cancel()
+                        raise future.exception()
+                    for child in children[ix]:
+                        waiting_on[child] -= 1
+                        if waiting_on[child] == 0:
+                            running[executor.submit(self.replay_operation, op_list[child])] = child
+
+    def replay_operation(self, opl: Dict) -> Artifact:
+        """
+        Replay a single serialized operation, whose source artifacts must already be in this workflow
+        :param opl: Dict with the "sources", "op_list" and "new_label" of the operation
+        :return: Artifact generated by the operation
+        """
+        logger.info(f"Replaying Operation List: {tuple(a for a in opl['sources'])} "
+                    f"=====> {opl['new_label']}")
+        operation = self.initialize_operation([self.artifact_dict[x] for x in opl['sources']], set_current=False)
+        operation.fused = list(opl.get('fused', []))
+        op_list = opl['op_list']
+        if self.optimize:
+            sources = operation.sources
+            op_list = optimize_op_list(op_list, [list(s.schema_map or {}) for s in sources],
+                                       merge_preserves_rows=lambda k, key_col:
+                                       self.merge_preserves_rows(sources[0], sources[k], key_col))
+            if op_list is not opl['op_list']:
+                operation.original_op_list = opl['op_list']
+        for op_dict in op_list:
+            operation.chain_operation(op_dict['op'], op_dict['args'])
+        return self.execute_operation(operation, opl['new_label'])
+
+    @staticmethod
+    def merge_preserves_rows(left: Artifact, right: Artifact, key_col: str) -> bool:
+        """
+        Check whether merging left with right on key_col yields exactly one row per row of left
+        :param left: Left artifact of the merge
+        :param right: Right artifact of the merge
+        :param key_col: Label of the key column
+        :return: True if the keys of right are unique and contain every key of left
+        """
+        right_keys = right.to_df()[key_col]
+        if not right_keys.is_unique:
+            return False
+        return bool(left.to_df()[key_col].isin(right_keys).all())
+
+    def load_source_artifact(self, artifact_dir: str, source: str, all_schema_maps: Dict,
+                             scale_artifact={}, source_format: str = None, columns: List[str] = None) -> Artifact:
+        """
+        Load a pre-generated source artifact for replay from "artifact_dir", or generate it if it is to be scaled.
+        :param artifact_dir: Directory containing all the artifact
+        :param source: Label of the artifact
+        :param all_schema_maps: Dict containing the schema map for all source artifacts in the workflow
+        :param scale_artifact: Scaling factor for each artifact, if needed.
+        :param source_format: (optional) File format of the artifact in artifact_dir, the format of this workflow if
+        not specified
+        :param columns: (optional) Load only these columns of the artifact, its schema map is restricted to them
+        :return: The loaded artifact
+        """
+        # TODO: Handle PK-FK merges properly - if DF is merge input, we need to maintain the keyspace and
+        # column schema maybe?
+        # 放缩artifact
+        if source in scale_artifact.keys():
+            logger.info(f"Scaling up Artifact {source} to size {scale_artifact[source]}")
+            return self.generate_base_artifact(num_rows=scale_artifact[source], label=source,
+                                               column_maps=all_schema_maps[source])
+
+        logger.info(f"Loading Pre-Generated Artifact: {source} ")
+        schema_map = all_schema_maps[source]
+        if columns is not None:
+            logger.info(f"Loading {len(columns)} of {len(schema_map)} columns of {source}")
+            schema_map = {c: schema_map[c] for c in columns}
+        source_artifact = self.initialize_new_artifact(label=source, schema_map=schema_map)
+
+        # 监视内存占用
+        states = start_collectors(self.metrics_collectors)
+
+        start_time = time.perf_counter()
+        source_artifact.deserialize(filename=f"{artifact_dir}/{source}.{source_format or self.file_format}",
+                                    columns=columns, memory_map=self.memory_map)
+        end_time = time.perf_counter()
+        metrics = stop_collectors(self.metrics_collectors, states)
+        if source in self.source_stats:
+            source_artifact.seed_stats(self.source_stats[source], columns=columns)
+        self.add_perf_record({
+            'kind': 'load',
+            'src': source,
+            **metrics,
+            'start_time': start_time,
+            'end_time': end_time,
+            'elapsed_time': end_time - start_time
+        })
+        self.add_artifact(source_artifact)
+        return source_artifact
+
+    def write_perf(self, filename=None, step_filename=None):
         """
         Write all performance information to filenme
         :param filename: Filename to write performance CSV file to (default is {name}_perf.csv in wf directory
+        :param step_filename: Filename to write the per-step records to, if any (default is {name}_step_perf.csv in
+        wf directory)
         :return: None
         """
         if not filename:
             filename = f"{self.out_dir}/{self.name}_perf.csv"
-
-        if self.perf_records:
-            pd.concat(self.perf_records, ignore_index=True).to_csv(filename)
-        else:
-            logger.warning('No Performance Data to be Written')
+        if not step_filename:
+            step_filename = f"{self.out_dir}/{self.name}_step_perf.csv"
+
+        for recorder, recorder_filename in ((self.perf, filename), (self.step_perf, step_filename)):
+            if recorder.stream_filename and \
+                    os.path.abspath(recorder_filename) == os.path.abspath(recorder.stream_filename):
+                # Already written record by record
+                continue
+            if len(recorder):
+                recorder.to_df().to_csv(recorder_filename)
+            elif recorder is self.perf:
+                logger.warning('No Performance Data to be Written')
+
+        # Release the stream files, records added later reopen them in append mode
+        self.perf.close()
+        self.step_perf.close()
 
     def select_random_artifact(self, bfactor=0.5, exclude: List[str] = None) -> Artifact:
         """
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+
+"""
+fuzzydata.core.writer
+~~~~~~~~~~~~
+This module contains the write-behind writer that serializes artifacts in the background as they are produced
+:copyright: (c) Suhail Rehman 2022
+:license: MIT, see LICENSE for more details.
+"""
+
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict
+
+from fuzzydata.core.artifact import Artifact
+from fuzzydata.core.store import ArtifactStore
+
+logger = logging.getLogger(__name__)
+
+
+class ArtifactWriter:
+    """
+    Serializes artifacts on a pool of background threads, so that writing an artifact overlaps with producing the
+    next one. At most max_pending artifacts are queued or being written at a time; submitting more blocks until a
+    write finishes. Every artifact is written to a temporary file first and then moved into place, so a crash never
+    leaves a partially written artifact behind.
+    """
+
+    def __init__(self, max_workers=1, max_pending=None, on_written: Callable[[Dict], None] = None,
+                 store: ArtifactStore = None):
+        """
+        :param max_workers: Number of writer threads
+        :param max_pending: (optional) Maximum number of artifacts queued or being written, 2 * max_workers by default
+        :param on_written: (optional) Callback receiving a performance record (Dict) for every artifact written
+        :param store: (optional) ArtifactStore recording the written artifacts, artifacts identical to one already
+        written are linked to its file instead of being serialized
+        """
+        self.max_workers = max_workers
+        self.executor = None  # Started on the first write, and again after close()
+        self.slots = threading.BoundedSemaphore(max_pending or 2 * max_workers)
+        self.on_written = on_written
+        self.store = store
+        self.futures = {}
+        self.written = {}
+
+    def submit(self, artifact: Artifact, filename: str) -> None:
+        """
+        Queue an artifact to be serialized to filename
+        :param artifact: The artifact to be written
+        :param filename: Filename to serialize the artifact to
+        """
+        self.written.pop(artifact.label, None)
+        if not artifact.in_memory and artifact.filename and os.path.exists(filename) and \
+                os.path.abspath(artifact.filename) == os.path.abspath(filename):
+            # Artifact was generated straight to its file, nothing to write
+            if self.store:
+                self.store.add(artifact, filename)
+            now = time.perf_counter()
+            self._written(artifact.label, filename, now, now)
+            return
+        self.slots.acquire()
+        try:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='fuzzydata-writer')
+            self.futures[artifact.label] = self.executor.submit(self._write, artifact, filename)
+        except Exception:
+            self.slots.release()
+            raise
+
+    def _write(self, artifact: Artifact, filename: str) -> None:
+        try:
+            tmp_filename = f'{filename}.tmp'
+            start_time = time.perf_counter()
+            if not self.store or not self.store.link(artifact, filename):
+                artifact.serialize(filename=tmp_filename)
+                os.replace(tmp_filename, filename)
+                if self.store:
+                    self.store.add(artifact, filename)
+            end_time = time.perf_counter()
+            logger.debug(f'Wrote {artifact.label} to {filename} in {end_time - start_time:.3f}s')
+            self._written(artifact.label, filename, start_time, end_time)
+        finally:
+            self.slots.release()
+
+    def _written(self, label, filename, start_time, end_time) -> None:
+        self.written[label] = os.path.abspath(filename)
+        if self.on_written:
+            self.on_written({
+                'kind': 'serialize',
+                'src': label,
+                'dst': filename,
+                'bytes': os.path.getsize(filename),
+                'start_time': start_time,
+                'end_time': end_time,
+                'elapsed_time': end_time - start_time
+            })
+
+    def mark_written(self, label, filename) -> None:
+        """
+        Record that an artifact is already written to filename, e.g. by an earlier run that is being resumed
+        :param label: Label of the artifact
+        :param filename: Filename the artifact is written to
+        """
+        self.written[label] = os.path.abspath(filename)
+
+    def wait(self, label) -> str:
+        """
+        Wait for the pending write of an artifact, if any
+        :param label: Label of the artifact
+        :return: Absolute filename the artifact was written to, None if it was not submitted
+        """
+        future = self.futures.get(label)
+        if future is not None:
+            future.result()
+        return self.written.get(label)
+
+    def is_written(self, label, filename) -> bool:
+        """
+        Check whether an artifact has already been written to filename
+        :param label: Label of the artifact
+        :param filename: Filename the artifact should be written to
+        :return: True if it was
+        """
+        return self.wait(label) == os.path.abspath(filename)
+
+    def flush(self) -> None:
+        """ Wait for all pending writes, raising the first error encountered """
+        for label in list(self.futures):
+            self.wait(label)
+
+    def close(self) -> None:
+        """ Wait for all pending writes and stop the writer threads. Artifacts submitted later start new threads. """
+        try:
+            self.flush()
+        finally:
+            if self.executor is not None:
+                self.executor.shutdown(wait=True)
+                self.executor = None
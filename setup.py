@@ -31,6 +31,7 @@ setup(
         'SQLAlchemy>=1.4.31'
     ],
     extras_require={
-        'modin': ['modin[all]>=0.13.2']
+        'modin': ['modin[all]>=0.13.2'],
+        'arrow': ['pyarrow>=7.0.0']
     }
 )
@@ -6,10 +6,19 @@ import modin.pandas
 from fuzzydata.clients.modin import ModinArtifact, ModinWorkflow
 from fuzzydata.clients.sqlite import SQLArtifact, SQLWorkflow
 from fuzzydata.clients.pandas import DataFrameArtifact, DataFrameWorkflow
-from fuzzydata.core.generator import generate_schema
+from fuzzydata.core.generator import generate_schema, generate_workflow
 
 logger = logging.getLogger(__name__)
 
+try:
+    import pyarrow  # noqa: F401
+    _has_pyarrow = True
+except ImportError:
+    _has_pyarrow = False
+
+# Parquet and feather artifacts need pyarrow
+requires_pyarrow = pytest.mark.skipif(not _has_pyarrow, reason='pyarrow is not available')
+
 _static_schema_test = {'EafKN__rgb_color': 'rgb_color',
                        'RFD4U__uuid4': 'uuid4',
                        'M8OoL__postcode': 'postcode',
@@ -31,6 +40,21 @@ static_artifact_fixtures = ['dataframe_artifact_static', 'sql_artifact_static',
 workflow_fixtures = ['df_workflow', 'sql_workflow', 'modin_workflow']
 
 
+def generate_test_workflow(wf_class, name, out_directory, exclude_ops=(), **kwargs):
+    """
+    generate_workflow() for the tests, SQLite has no pivot so SQLWorkflow never generates one
+    :param wf_class: Workflow class to be used
+    :param name: Name for the workflow
+    :param out_directory: output directory to use for generation
+    :param exclude_ops: (optional) Operations to be avoided during generation by every workflow class
+    :param kwargs: Other generate_workflow() arguments
+    :return: Workflow object of desired type.
+    """
+    if wf_class.__name__ == 'SQLWorkflow':
+        exclude_ops = ['pivot', *exclude_ops]
+    return generate_workflow(wf_class, name=name, out_directory=out_directory, exclude_ops=list(exclude_ops), **kwargs)
+
+
 @pytest.fixture(scope="session")
 def dataframe_artifact(tmpdir_factory):
     tmp_dir = tmpdir_factory.mktemp("fuzzydata_df_test")
@@ -1,9 +1,14 @@
+import numpy as np
 import pandas as pd
 import pytest
 import os
+import sqlalchemy
 
-from fuzzydata.core.generator import generate_schema
-from tests.conftest import artifact_fixtures
+from fuzzydata.clients.pandas import DataFrameArtifact
+from fuzzydata.clients.sqlite import SQLArtifact
+from fuzzydata.core.artifact import file_format_of, flatten_table, schema_dtypes, StatsAccumulator
+from fuzzydata.core.generator import generate_schema, generate_table
+from tests.conftest import artifact_fixtures, requires_pyarrow
 
 
 @pytest.mark.dependency()
@@ -23,4 +28,131 @@ def test_serialize_deserialize(artifact, request):
     assert os.path.exists(df_file)
     concrete_artifact.destroy()
     concrete_artifact.deserialize()
-    assert isinstance(concrete_artifact.to_df(), concrete_artifact.pd.DataFrame)
\ No newline at end of file
+    assert isinstance(concrete_artifact.to_df(), concrete_artifact.pd.DataFrame)
+
+def test_flatten_table():
+    df = pd.DataFrame({'a': ['x', 'y', 'x'], 'b': ['u', 'v', 'v'], 'c': [1, 2, 3]})
+    pivoted = flatten_table(df.pivot_table(index=['a'], columns=['b'], values=['c'], aggfunc='sum'))
+    assert list(pivoted.columns) == ['a', 'c__u', 'c__v']
+    sampled = flatten_table(df.iloc[[2, 0]])
+    assert isinstance(sampled.index, pd.RangeIndex)
+    assert list(sampled.columns) == ['a', 'b', 'c']
+
+
+def test_file_format_of():
+    assert file_format_of('artifacts/artifact_0.parquet') == 'parquet'
+    assert file_format_of('artifacts/artifact_0.feather.tmp', default='feather') == 'feather'
+    with pytest.raises(ValueError):
+        DataFrameArtifact('bad_format', file_format='xlsx')
+
+
+def test_schema_dtypes():
+    schema = {'a': 'postcode', 'b': 'pyint', 'c': 'city', 'd': 'pybool'}
+    assert schema_dtypes(schema) == {'a': str, 'c': str}
+    assert schema_dtypes(schema, categorical=True) == {'a': 'category', 'c': 'category'}
+
+
+@pytest.mark.parametrize('csv_chunk_size', [None, 2])
+def test_read_csv_schema(csv_chunk_size, tmpdir):
+    schema = {'a': 'postcode', 'b': 'pyint', 'c': 'city'}
+    df = pd.DataFrame({'a': ['01234', '56789', '01234'], 'b': [1, 2, 3], 'c': ['Rome', 'Oslo', 'Lima']})
+    filename = tmpdir.join('test_schema.csv')
+    DataFrameArtifact('test_schema', filename=filename, from_df=df, schema_map=schema).serialize()
+
+    artifact = DataFrameArtifact('test_schema', filename=filename, schema_map=schema, categorical=True,
+                                 csv_chunk_size=csv_chunk_size)
+    artifact.deserialize()
+    loaded = artifact.to_df()
+    assert list(loaded.columns) == ['a', 'b', 'c']
+    assert list(loaded['a']) == ['01234', '56789', '01234']
+    assert loaded['c'].dtype == 'category' and set(loaded['c'].cat.categories) == {'Rome', 'Oslo', 'Lima'}
+
+    artifact.deserialize(columns=['c', 'b'])
+    assert list(artifact.to_df().columns) == ['b', 'c']
+
+
+@pytest.mark.parametrize('csv_chunk_size', [None, 7])
+def test_read_csv_round_trip(csv_chunk_size, tmpdir):
+    # Floats must be parsed back to the same bits and unix_time columns to their integer dtype
+    schema = {'a': 'pyfloat', 'b': 'unix_time', 'c': 'pyint'}
+    df = generate_table(20, schema, seed=1)
+    filename = tmpdir.join('test_round_trip.csv')
+    written = DataFrameArtifact('test_round_trip', filename=filename, from_df=df, schema_map=schema)
+    written.serialize()
+
+    loaded = DataFrameArtifact('test_round_trip', filename=filename, schema_map=schema, csv_chunk_size=csv_chunk_size,
+                               csv_exact_floats=True)
+    loaded.deserialize()
+    assert loaded.content_hashes() == written.content_hashes()
+
+
+def test_stats(tmpdir):
+    df = pd.DataFrame({'a': ['x', 'y', 'x', None], 'b': [1.0, np.nan, 1.0, 2.0]})
+    expected = {'a': {'nulls': 1, 'distinct': 2}, 'b': {'nulls': 1, 'distinct': 2}}
+    df_artifact = DataFrameArtifact('test_stats', from_df=df)
+    sql_artifact = SQLArtifact('test_stats', from_df=df, sql_engine=sqlalchemy.create_engine('sqlite://'))
+    for artifact in (df_artifact, sql_artifact):
+        stats = artifact.stats()
+        assert stats['num_rows'] == 4 and len(artifact) == 4
+        assert stats['columns'] == expected
+        assert artifact.stats() is stats
+    assert df_artifact.stats()['bytes'] > 0
+
+    accumulator = StatsAccumulator()
+    for chunk in (df.iloc[:2], df.iloc[2:]):
+        accumulator.add(chunk)
+    assert accumulator.result() == {'num_rows': 4, 'bytes': None, 'columns': expected}
+
+    seeded = DataFrameArtifact('test_seeded', from_df=df[['b']])
+    seeded.seed_stats(df_artifact.stats(), columns=['b'])
+    assert seeded.has_stats and seeded.stats()['columns'] == {'b': expected['b']}
+
+
+def _mapped_ranges(filename):
+    """ Address ranges of the current process mapping filename, from /proc/self/maps """
+    ranges = []
+    with open('/proc/self/maps') as maps:
+        for line in maps:
+            fields = line.split()
+            if len(fields) >= 6 and os.path.realpath(fields[5]) == os.path.realpath(filename):
+                start, end = (int(x, 16) for x in fields[0].split('-'))
+                ranges.append((start, end))
+    return ranges
+
+
+@requires_pyarrow
+@pytest.mark.skipif(not os.path.exists('/proc/self/maps'), reason='needs /proc/self/maps')
+def test_memory_map_feather(tmpdir, caplog):
+    df = pd.DataFrame({'a': np.arange(100000, dtype=np.int64), 'b': np.linspace(0, 1, 100000)})
+    filename = str(tmpdir.join('test_mmap.feather'))
+    DataFrameArtifact('test_mmap', filename=filename, from_df=df, file_format='feather',
+                      compression='uncompressed').serialize()
+    artifact = DataFrameArtifact('test_mmap', filename=filename, file_format='feather')
+    artifact.deserialize(memory_map=True)
+    # The numeric columns are backed by the pages of the mapped file, not by copies
+    ranges = _mapped_ranges(filename)
+    for col in ('a', 'b'):
+        address = artifact.to_df()[col].to_numpy().__array_interface__['data'][0]
+        assert any(start <= address < end for start, end in ranges)
+    assert 'compressed' not in caplog.text
+
+    compressed = str(tmpdir.join('test_mmap_lz4.feather'))
+    DataFrameArtifact('test_mmap_lz4', filename=compressed, from_df=df, file_format='feather',
+                      compression='lz4').serialize()
+    DataFrameArtifact('test_mmap_lz4', filename=compressed, file_format='feather').deserialize(memory_map=True)
+    assert 'compressed' in caplog.text
+
+
+@requires_pyarrow
+@pytest.mark.parametrize('file_format', ['parquet', 'feather'])
+def test_serialize_columnar(file_format, tmpdir):
+    schema = generate_schema(10)
+    artifact = DataFrameArtifact('test_columnar', filename=tmpdir.join(f'test_columnar.{file_format}'),
+                                 file_format=file_format, compression='zstd', categorical=True)
+    artifact.generate(100, schema)
+    df = artifact.to_df().sample(frac=0.5)
+    artifact.from_df(df)
+    artifact.serialize()
+    loaded = DataFrameArtifact('test_columnar', filename=artifact.filename, file_format=file_format)
+    loaded.deserialize()
+    pd.testing.assert_frame_equal(loaded.to_df(), df.reset_index(drop=True))
@@ -0,0 +1,63 @@
+import glob
+import os
+
+import pandas as pd
+import pytest
+
+from fuzzydata.clients import DataFrameWorkflow
+from fuzzydata.core import cache as cache_module
+from fuzzydata.core.cache import TableCache
+from fuzzydata.core.generator import generate_schema, generate_table
+
+
+@pytest.fixture(scope="module")
+def schema():
+    return generate_schema(10)
+
+
+def test_table_cache_hit_miss(schema, tmpdir_factory):
+    cache = TableCache(tmpdir_factory.mktemp('table_cache'))
+    first = generate_table(100, column_dict=schema, seed=5, cache=cache)
+    second = generate_table(100, column_dict=schema, seed=5, cache=cache)
+    generate_table(100, column_dict=schema, cache=cache)  # Tables without a seed are not cached
+    assert (cache.hits, cache.misses) == (1, 1)
+    pd.testing.assert_frame_equal(first, second)
+
+
+def test_table_cache_key_versions(monkeypatch):
+    key = TableCache.make_key(num_rows=100, seed=5)
+    assert TableCache.make_key(num_rows=100, seed=5) == key
+    # Tables cached by another version of the generator are not served
+    monkeypatch.setattr(cache_module, 'CACHE_VERSION', cache_module.CACHE_VERSION + 1)
+    assert TableCache.make_key(num_rows=100, seed=5) != key
+    monkeypatch.undo()
+    monkeypatch.setattr(cache_module.np, '__version__', '0.0.0')
+    assert TableCache.make_key(num_rows=100, seed=5) != key
+
+
+def test_table_cache_eviction(schema, tmpdir_factory):
+    cache_dir = tmpdir_factory.mktemp('table_cache_lru')
+    cache = TableCache(cache_dir)
+    for seed in range(3):
+        generate_table(1000, column_dict=schema, seed=seed, cache=cache)
+    entry_size = max(os.path.getsize(f) for f in glob.glob(f'{cache_dir}/*.pkl'))
+
+    # Touch the oldest entry, then add a new one to a cache that fits three entries
+    cache = TableCache(cache_dir, max_bytes=int(entry_size * 3.5))
+    generate_table(1000, column_dict=schema, seed=0, cache=cache)
+    generate_table(1000, column_dict=schema, seed=3, cache=cache)
+    assert len(glob.glob(f'{cache_dir}/*.pkl')) == 3
+    generate_table(1000, column_dict=schema, seed=0, cache=cache)
+    generate_table(1000, column_dict=schema, seed=1, cache=cache)
+    assert (cache.hits, cache.misses) == (2, 2)
+
+
+def test_workflow_table_cache(schema, tmpdir_factory):
+    cache_dir = tmpdir_factory.mktemp('wf_table_cache')
+    tables = []
+    for run in range(2):
+        workflow = DataFrameWorkflow(name='test_cache_wf', out_directory=tmpdir_factory.mktemp('wf_cache'),
+                                     seed=42, cache_dir=cache_dir)
+        tables.append(workflow.generate_base_artifact(num_rows=100, column_maps=schema).to_df())
+        assert workflow.perf.to_df()['cache'].iloc[-1] == ('miss' if run == 0 else 'hit')
+    pd.testing.assert_frame_equal(tables[0], tables[1])
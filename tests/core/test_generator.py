@@ -7,7 +7,8 @@ import pandas as pd
 import pytest
 
 from fuzzydata.clients import supported_workflows, SQLWorkflow, travis_workflows, DataFrameWorkflow, ModinWorkflow
-from fuzzydata.core.generator import generate_schema, generate_table, generate_workflow
+from fuzzydata.core.generator import generate_schema, generate_table, generate_table_chunks, generate_workflow, \
+    get_schema_type_mapping, generate_pkfk_join_table
 
 logger = logging.getLogger(__name__)
 
@@ -60,4 +61,110 @@ def test_generate_workflow(wf_class, num_versions, base_shape, tmpdir_factory):
         assert os.path.exists(f"{output_path}/{workflow.name}_gt_graph.csv")
     except Exception as e:
         logger.error(f"Error in Workflow Path: {output_path}")
-        raise e
\ No newline at end of file
+        raise e
+
+@pytest.mark.parametrize('pool_size', [1, 5, 50])
+def test_generate_table_pool_sizes(schema, pool_size):
+    num_rows = 1000
+    table = generate_table(num_rows, column_dict=schema, pool_sizes={p: pool_size for p in schema.values()})
+    assert num_rows == len(table.index)
+    for col in table.columns:
+        assert table[col].nunique() <= pool_size
+
+
+@pytest.mark.parametrize('num_workers', [1, 2, 4])
+def test_generate_table_seed_workers(schema, num_workers):
+    expected = generate_table(1000, column_dict=schema, seed=42)
+    table = generate_table(1000, column_dict=schema, seed=42, num_workers=num_workers)
+    pd.testing.assert_frame_equal(expected, table)
+
+
+@pytest.mark.parametrize('chunk_size', [1, 333, 1000, 5000])
+def test_generate_table_chunks(schema, chunk_size):
+    expected = generate_table(1000, column_dict=schema, seed=7)
+    chunks = list(generate_table_chunks(1000, column_dict=schema, chunk_size=chunk_size, seed=7))
+    assert all(len(c.index) <= chunk_size for c in chunks)
+    pd.testing.assert_frame_equal(expected, pd.concat(chunks))
+
+
+@pytest.mark.parametrize('provider,dtype,low,high', [('pyint', 'int64', 0, 9999),
+                                                     ('random_int', 'int64', 0, 9999),
+                                                     ('random_digit', 'int64', 0, 9),
+                                                     ('random_number', 'int64', 0, 999999999),
+                                                     ('randomize_nb_elements', 'int64', 6, 14),
+                                                     ('pyfloat', 'float64', -1e14, 1e14)])
+def test_generate_table_numeric_providers(provider, dtype, low, high):
+    table = generate_table(10000, column_dict={f'col__{provider}': provider}, seed=3)
+    column = table[f'col__{provider}']
+    assert column.dtype == dtype
+    assert column.min() >= low
+    assert column.max() <= high
+
+
+def test_generate_table_categorical(schema):
+    table = generate_table(1000, column_dict=schema, categorical=True)
+    groupable = get_schema_type_mapping(schema)['groupable']
+    for col in table.columns:
+        if col in groupable and table[col].dtype != bool:
+            assert table[col].dtype == 'category'
+        else:
+            assert table[col].dtype != 'category'
+
+
+def test_generate_workflow_op_count(tmpdir_factory):
+    # A merge ends its chain and is counted as one of its operations, so that the chain is executed
+    output_path = tmpdir_factory.mktemp('test_op_count')
+    exclude = ['apply', 'sample', 'groupby', 'project', 'select', 'pivot', 'fill']
+    workflow = generate_workflow(DataFrameWorkflow, name='test_op_count', num_versions=7, base_shape=(5, 200),
+                                 out_directory=output_path, exclude_ops=exclude)
+    # Every merge adds its generated right side and its result
+    assert len(workflow) == 7
+    assert [[x['op'] for x in opl['op_list']] for opl in workflow.operation_list] == [['merge']] * 3
+
+
+def test_generate_workflow_merge_first(tmpdir_factory):
+    output_path = tmpdir_factory.mktemp('test_merge_first')
+    exclude = ['apply', 'sample', 'groupby', 'project', 'select', 'pivot', 'fill']
+    workflow = generate_workflow(DataFrameWorkflow, name='test_merge_first', num_versions=5, base_shape=(5, 200),
+                                 out_directory=output_path, exclude_ops=exclude)
+    merges = [opl for opl in workflow.operation_list if opl['op_list'][0]['op'] == 'merge']
+    assert merges
+    for opl in merges:
+        # The merge was executed: the result holds the columns of the generated right side
+        result_columns = set(workflow[opl['new_label']].to_df().columns)
+        assert set(workflow[opl['sources'][1]].to_df().columns) <= result_columns
+
+
+def test_generate_workflow_categorical(tmpdir_factory):
+    output_path = tmpdir_factory.mktemp('test_categorical')
+    workflow = generate_workflow(DataFrameWorkflow, name='test_categorical', num_versions=10, base_shape=(20, 1000),
+                                 out_directory=output_path, matfreq=2, wf_options={'categorical': True})
+    assert len(workflow) == 10
+    base_table = workflow['artifact_0'].to_df()
+    assert 'category' in set(str(t) for t in base_table.dtypes)
+
+
+def test_generate_table_column_specs():
+    column_dict = {'uniform__city': {'provider': 'city', 'cardinality': 20},
+                   'zipf__city': {'provider': 'city', 'cardinality': 100, 'distribution': 'zipf', 'exponent': 1.5},
+                   'hot__pyint': {'provider': 'pyint', 'hot_fraction': 0.5}}
+    table = generate_table(10000, column_dict=column_dict, seed=11)
+    assert table['uniform__city'].nunique() <= 20
+    assert table['zipf__city'].nunique() <= 100
+    # Rank 1 of a zipf(1.5) distribution over 100 values has probability ~0.4, uniform would be 0.01
+    assert table['zipf__city'].value_counts(normalize=True).iloc[0] > 0.3
+    assert table['hot__pyint'].value_counts(normalize=True).iloc[0] >= 0.45
+    assert get_schema_type_mapping(column_dict)['numeric'] == ['hot__pyint']
+
+    with pytest.raises(ValueError):
+        generate_table(10, column_dict={'bad__city': {'provider': 'city', 'distribution': 'normal'}})
+
+
+def test_generate_pkfk_join_table_skewed():
+    source_schema = {'key__uuid4': {'provider': 'uuid4', 'cardinality': 500, 'distribution': 'zipf'},
+                     'val__pyint': 'pyint'}
+    source_table = generate_table(5000, column_dict=source_schema)
+    right_df, right_schema = generate_pkfk_join_table(source_table, source_schema, 'key__uuid4', new_col_size=3)
+    assert right_schema['key__uuid4'] == source_schema['key__uuid4']
+    assert not right_df['key__uuid4'].is_unique
+    assert source_table['key__uuid4'].value_counts().index[0] == right_df['key__uuid4'].value_counts().index[0]
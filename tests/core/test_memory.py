@@ -0,0 +1,43 @@
+import os
+
+import pytest
+
+from fuzzydata.clients.pandas import DataFrameWorkflow
+from tests.conftest import generate_test_workflow
+
+
+def test_memory_budget_spills_artifacts(tmpdir_factory):
+    output_path = tmpdir_factory.mktemp('memory_budget_wf')
+    workflow = generate_test_workflow(DataFrameWorkflow, name='memory_budget_wf', num_versions=8,
+                                      base_shape=(10, 5000), out_directory=output_path, exclude_ops=['pivot'],
+                                      wf_options={'memory_budget': 500000})
+    manager = workflow.memory_manager
+    assert manager.spills > 0
+    assert sum(manager.resident.values()) <= 500000
+    # Spilled artifacts are reloaded transparently
+    for label, artifact in workflow.artifact_dict.items():
+        assert len(artifact.to_df().index) == len(artifact)
+    assert len(list(os.listdir(f'{output_path}/artifacts/'))) == len(workflow.artifact_dict)
+
+
+def test_evict_consumed_artifacts(tmpdir_factory):
+    output_path = tmpdir_factory.mktemp('evict_wf')
+    generate_test_workflow(DataFrameWorkflow, name='evict_wf', num_versions=8, base_shape=(10, 1000),
+                           out_directory=output_path, exclude_ops=['pivot'])
+    replay_path = tmpdir_factory.mktemp('evict_replay')
+    replayed = DataFrameWorkflow.load_workflow(output_path, replay_path, replay=True,
+                                               wf_options={'evict_artifacts': True})
+    assert replayed.memory_manager.evictions == len(replayed.artifact_dict)
+    assert not any(a.in_memory for a in replayed.artifact_dict.values())
+    for label in replayed.artifact_dict:
+        assert os.path.exists(f'{replay_path}/artifacts/{label}.csv')
+
+
+def test_failed_operation_releases_sources(tmpdir_factory):
+    output_path = tmpdir_factory.mktemp('release_wf')
+    workflow = DataFrameWorkflow(name='release_wf', out_directory=output_path, memory_budget=10 ** 9)
+    source = workflow.generate_base_artifact(num_rows=100, num_cols=5)
+    with pytest.raises(Exception):
+        workflow.generate_artifact_from_operation_list(
+            [source], [{'op': 'project', 'args': {'output_cols': ['no_such_column']}}])
+    assert workflow.memory_manager.pinned[source.label] == 0
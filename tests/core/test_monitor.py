@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+
+from fuzzydata.clients.pandas import DataFrameWorkflow
+from fuzzydata.core.monitor import Monitor, MetricsCollector, read_peak_rss
+
+
+def test_monitor_peak_rss():
+    monitor = Monitor(interval=0.001).start()
+    block = np.ones(50 * 1024 * 1024, dtype=np.uint8)
+    del block
+    stats = monitor.stop()
+    assert stats['peak_rss'] >= monitor.start_rss + 40 * 1024 * 1024
+    assert stats['monitor_samples'] >= 2
+    assert 0 <= stats['monitor_overhead'] < 1
+    assert 0 < stats['mem'] <= 100
+
+
+def test_nested_monitors():
+    outer = Monitor(interval=0.001).start()
+    block = np.ones(60 * 1024 * 1024, dtype=np.uint8)
+    del block
+    # A nested monitor must not reset the kernel's peak counter, which still holds the peak of the outer one
+    inner = Monitor(interval=0.001).start()
+    kernel_peak = read_peak_rss(outer.p.pid)
+    assert kernel_peak is None or kernel_peak >= outer.start_rss + 50 * 1024 * 1024
+    # It allocates more than the outer monitor did and reports the peak of its own samples
+    block = np.ones(100 * 1024 * 1024, dtype=np.uint8)
+    del block
+    inner_stats = inner.stop()
+    outer_stats = outer.stop()
+    assert inner_stats['peak_rss'] >= inner.start_rss + 80 * 1024 * 1024
+    assert outer_stats['peak_rss'] >= inner_stats['peak_rss']
+
+
+def test_monitor_without_sampling_thread():
+    monitor = Monitor(interval=0).start()
+    stats = monitor.stop()
+    assert stats['monitor_samples'] == 2
+    assert stats['peak_rss'] > 0
+
+
+class CountingCollector(MetricsCollector):
+    fields = ('steps',)
+
+    def __init__(self):
+        self.steps = 0
+
+    def stop(self, state):
+        self.steps += 1
+        return {'steps': self.steps}
+
+
+def test_workflow_metrics_collectors(tmpdir_factory):
+    output_path = tmpdir_factory.mktemp('metrics_wf')
+    workflow = DataFrameWorkflow(name='metrics_wf', out_directory=output_path, trace_allocations=True)
+    workflow.add_metrics_collector(CountingCollector())
+    artifact = workflow.generate_base_artifact(num_rows=100, num_cols=5)
+    workflow.generate_artifact_from_operation_list([artifact], [{'op': 'sample', 'args': {'frac': 0.5}}])
+    workflow.write_perf()
+    perf = pd.read_csv(f'{output_path}/metrics_wf_perf.csv', index_col=0)
+    fields = [f for c in workflow.metrics_collectors for f in c.fields]
+    assert set(fields) <= set(perf.columns)
+    assert list(perf['steps']) == [1, 2]
+    assert (perf['cpu_user'] >= 0).all()
+    assert (perf['gc_collections'] >= 0).all()
+    assert (perf['alloc_peak'] > 0).all()
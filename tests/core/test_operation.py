@@ -4,6 +4,7 @@ import os
 
 import pytest
 import numpy as np
+import pandas as pd
 
 from fuzzydata.core.generator import generate_pkfk_join_table
 from tests.conftest import static_artifact_fixtures, generated_artifact_fixtures
@@ -113,3 +114,21 @@ def test_merge_op(source_artifact, request):
     expected_join_result_cols = set(concrete_artifact.to_df().columns).union(set(join_artifact.to_df().columns))
     assert set(result_artifact.to_df().columns) == expected_join_result_cols
 
+
+def test_compiled_plan(dataframe_artifact_static):
+    op_list = [{'op': 'apply', 'args': {'numeric_col': 'zmpoV__randomize_nb_elements', 'a': 0.5, 'b': 1.0}},
+               {'op': 'fill', 'args': {'col_name': '9YjpC__credit_card_provider', 'old_value': '"Maestro"',
+                                       'new_value': '"RuPay"'}},
+               {'op': 'select', 'args': {'condition': 'zmpoV__randomize_nb_elements > 10'}}]
+    operation = dataframe_artifact_static.operation_class(sources=[dataframe_artifact_static])
+    for op_dict in op_list:
+        operation.chain_operation(op_dict['op'], op_dict['args'])
+    result = operation.execute('after_plan')
+
+    expected = dataframe_artifact_static.to_df().copy()
+    expected['zmpoV__randomize_nb_elements__0x_1'] = expected['zmpoV__randomize_nb_elements'] * 0.5 + 1.0
+    expected['9YjpC__credit_card_provider'] = expected['9YjpC__credit_card_provider'].replace('Maestro', 'RuPay')
+    expected = expected[expected['zmpoV__randomize_nb_elements'] > 10]
+    pd.testing.assert_frame_equal(result.to_df(), expected)
+    assert [t['op'] for t in operation.step_timings()] == [op_dict['op'] for op_dict in op_list]
+    assert all(t['elapsed_time'] >= 0 for t in operation.step_timings())
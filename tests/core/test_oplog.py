@@ -0,0 +1,57 @@
+import os
+
+import pandas as pd
+import pytest
+
+from fuzzydata.clients import travis_workflows
+from fuzzydata.core.oplog import OperationLog, is_complete, marker_filename
+from tests.conftest import generate_test_workflow
+
+
+def test_oplog_ignores_truncated_record(tmpdir):
+    oplog = OperationLog(f'{tmpdir}/wf_oplog.jsonl')
+    oplog.append({'label': 'artifact_0'})
+    oplog.append({'label': 'artifact_1'})
+    with open(oplog.filename, 'a') as f:
+        f.write('{"label": "artif')
+    assert [r['label'] for r in oplog.read()] == ['artifact_0', 'artifact_1']
+
+
+@pytest.mark.parametrize('wf_class', travis_workflows.values())
+def test_resume_generate_workflow(wf_class, tmpdir_factory):
+    output_path = tmpdir_factory.mktemp(f'resume_{wf_class.__name__}')
+    workflow = generate_test_workflow(wf_class, name='resume_wf', num_versions=6, base_shape=(10, 1000),
+                                      out_directory=output_path, wf_options={'checkpoint': True})
+    for label in workflow.artifact_dict:
+        assert is_complete(f'{output_path}/artifacts/{label}.csv')
+
+    # Simulate a crash while artifact_3 was being written
+    os.remove(marker_filename(f'{output_path}/artifacts/artifact_3.csv'))
+
+    resumed = generate_test_workflow(wf_class, name='resume_wf', num_versions=8, base_shape=(10, 1000),
+                                     out_directory=output_path, resume=True)
+    assert len(resumed) == 8
+    for label in ['artifact_0', 'artifact_1', 'artifact_2']:
+        assert resumed[label].schema_map == workflow[label].schema_map
+    for label in resumed.artifact_dict:
+        assert is_complete(f'{output_path}/artifacts/{label}.csv')
+    assert len(resumed.operation_list) == len(set(op['new_label'] for op in resumed.operation_list))
+
+
+def test_resume_replay(tmpdir_factory):
+    wf_class = travis_workflows['pandas']
+    output_path = tmpdir_factory.mktemp('resume_replay_src')
+    generate_test_workflow(wf_class, name='resume_replay_wf', num_versions=6, base_shape=(10, 1000),
+                           out_directory=output_path)
+    replay_path = tmpdir_factory.mktemp('resume_replay')
+    replayed = wf_class.load_workflow(output_path, replay_path, replay=True, wf_options={'checkpoint': True})
+    replayed.serialize_workflow()
+    last_label = replayed.operation_list[-1]['new_label']
+    os.remove(marker_filename(f'{replay_path}/artifacts/{last_label}.csv'))
+
+    resumed = wf_class.load_workflow(output_path, replay_path, replay=True, resume=True)
+    assert set(resumed.artifact_dict) == set(replayed.artifact_dict)
+    resumed.serialize_workflow()
+    perf = pd.read_csv(f'{replay_path}/resume_replay_wf_perf.csv', index_col=0)
+    # Only the operation producing the incomplete artifact is executed again
+    assert list(perf['dst'][perf['kind'] == 'operation']) == [last_label]
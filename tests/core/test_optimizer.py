@@ -0,0 +1,66 @@
+import pandas as pd
+
+from fuzzydata.clients.pandas import DataFrameArtifact
+from fuzzydata.core.optimizer import condition_columns, optimize_op_list, required_columns
+
+_left_columns = ['key', 'a', 'b', 'c']
+_right_columns = ['key', 'd', 'e']
+
+_merge = {'op': 'merge', 'args': {'key_col': 'key'}}
+_project = {'op': 'project', 'args': {'output_cols': ['a', 'd']}}
+_select_left = {'op': 'select', 'args': {'condition': 'a > 2'}}
+_select_right = {'op': 'select', 'args': {'condition': 'd > 2'}}
+_sample = {'op': 'sample', 'args': {'frac': 0.5}}
+
+
+def test_condition_columns():
+    assert condition_columns('a > 2 and `d` < b', _left_columns + _right_columns) == {'a', 'b', 'd'}
+
+
+def test_project_pushdown():
+    optimized = optimize_op_list([_merge, _project], [_left_columns, _right_columns])
+    assert optimized == [{'op': 'project', 'args': {'output_cols': ['key', 'a']}}, _merge, _project]
+    # Nothing left to push down
+    assert optimize_op_list(optimized, [_left_columns, _right_columns]) is optimized
+
+
+def test_select_pushdown():
+    assert optimize_op_list([_merge, _select_left], [_left_columns, _right_columns]) == [_select_left, _merge]
+    assert optimize_op_list([_merge, _select_right], [_left_columns, _right_columns]) == [_merge, _select_right]
+
+
+def test_sample_before_merge():
+    op_list = [_merge, _sample]
+    assert optimize_op_list(op_list, [_left_columns, _right_columns]) == op_list
+    assert optimize_op_list(op_list, [_left_columns, _right_columns],
+                            merge_preserves_rows=lambda k, key_col: False) == op_list
+    assert optimize_op_list(op_list, [_left_columns, _right_columns],
+                            merge_preserves_rows=lambda k, key_col: True) == [_sample, _merge]
+
+
+def test_required_columns():
+    assert required_columns([_merge, _select_left, _project], [_left_columns, _right_columns]) == \
+           [{'key', 'a'}, {'key', 'd'}]
+    # The result keeps every column
+    assert required_columns([_merge, _sample], [_left_columns, _right_columns]) == [None, None]
+    apply = {'op': 'apply', 'args': {'numeric_col': 'c', 'a': 1.0, 'b': 2.0}}
+    groupby = {'op': 'groupby', 'args': {'group_columns': ['a'], 'agg_columns': ['c__1.0x_2.0'], 'agg_function': 'sum'}}
+    assert required_columns([apply, groupby], [_left_columns]) == [{'a', 'c'}]
+
+
+def test_optimized_result(tmpdir):
+    left = pd.DataFrame({'key': range(10), 'a': range(10), 'b': range(10), 'c': range(10)})
+    right = pd.DataFrame({'key': range(10), 'd': range(10, 20), 'e': range(10)})
+    schema = {c: 'pyint' for c in left.columns}
+    right_schema = {c: 'pyint' for c in right.columns}
+    results = []
+    for op_list in ([_merge, _select_left, _project],
+                    optimize_op_list([_merge, _select_left, _project], [_left_columns, _right_columns])):
+        left_artifact = DataFrameArtifact('left', filename=tmpdir.join('left.csv'), from_df=left, schema_map=schema)
+        right_artifact = DataFrameArtifact('right', filename=tmpdir.join('right.csv'), from_df=right,
+                                           schema_map=right_schema)
+        operation = left_artifact.operation_class(sources=[left_artifact, right_artifact])
+        for op_dict in op_list:
+            operation.chain_operation(op_dict['op'], op_dict['args'])
+        results.append(operation.execute('result').to_df().reset_index(drop=True))
+    pd.testing.assert_frame_equal(results[0], results[1])
@@ -0,0 +1,83 @@
+import json
+
+import pandas as pd
+import pytest
+
+from fuzzydata.clients.pandas import DataFrameWorkflow
+from fuzzydata.core.perf import PerfRecorder, PERF_COLUMNS
+
+
+@pytest.mark.parametrize('stream_format', ['csv', 'jsonl'])
+def test_perf_recorder_streams_records(stream_format, tmpdir):
+    filename = f'{tmpdir}/perf.{stream_format}'
+    recorder = PerfRecorder(stream_filename=filename, stream_format=stream_format)
+    recorder.add_columns(['peak_rss'])
+    recorder.record('generate', dst='artifact_0', peak_rss=100, start_time=1.0, end_time=2.0, elapsed_time=1.0)
+    assert recorder.record('operation', src=('artifact_0',), dst='artifact_1', op='sample+project',
+                           elapsed_time=0.5) == 1
+    with pytest.raises(ValueError):
+        recorder.record('load', unknown_column=1)
+    with pytest.raises(ValueError):
+        recorder.add_columns(['cpu_user'])
+
+    df = recorder.to_df()
+    assert list(df.columns) == list(PERF_COLUMNS) + ['peak_rss']
+    assert list(df['kind']) == ['generate', 'operation']
+    assert df['elapsed_time'].dtype == float
+    assert pd.isna(df['peak_rss'].iloc[1])
+
+    # Records are on disk before the recorder is closed
+    if stream_format == 'csv':
+        streamed = pd.read_csv(filename, index_col=0)
+    else:
+        with open(filename) as f:
+            streamed = pd.DataFrame([json.loads(line) for line in f])
+    assert list(streamed.columns) == list(df.columns)
+    assert list(streamed['dst']) == ['artifact_0', 'artifact_1']
+    recorder.close()
+
+
+@pytest.mark.parametrize('stream_format', ['csv', 'jsonl'])
+def test_perf_recorder_append(stream_format, tmpdir):
+    filename = f'{tmpdir}/perf.{stream_format}'
+    recorder = PerfRecorder(stream_filename=filename, stream_format=stream_format)
+    recorder.record('operation', dst='artifact_1', code='a\nb')
+    recorder.record('operation', dst='artifact_2')
+    recorder.close()
+
+    # A resumed run continues the indices of the records already streamed, e.g. for parent links of step records
+    resumed = PerfRecorder(stream_filename=filename, stream_format=stream_format, append=True)
+    assert resumed.record('operation', dst='artifact_3') == 2
+    assert list(resumed.to_df().index) == [2]
+    resumed.close()
+    if stream_format == 'csv':
+        assert list(pd.read_csv(filename, index_col=0).index) == [0, 1, 2]
+
+
+def test_workflow_perf_schema(tmpdir_factory):
+    output_path = tmpdir_factory.mktemp('perf_wf')
+    workflow = DataFrameWorkflow(name='perf_wf', out_directory=output_path, perf_stream_format='jsonl')
+    artifact = workflow.generate_base_artifact(num_rows=100, num_cols=5)
+    workflow.generate_artifact_from_operation_list([artifact], [{'op': 'sample', 'args': {'frac': 0.5}}])
+    workflow.serialize_workflow()
+    perf = pd.read_csv(f'{output_path}/perf_wf_perf.csv', index_col=0)
+    assert list(perf['kind']) == ['generate', 'operation', 'serialize', 'serialize']
+    assert perf['op'].iloc[1] == 'sample'
+    with open(f'{output_path}/perf_wf_perf.jsonl') as f:
+        assert [json.loads(line)['kind'] for line in f] == list(perf['kind'])
+    # write_perf() closed the stream, later records are appended to it
+    assert workflow.perf._stream is None
+    workflow.generate_base_artifact(num_rows=10, num_cols=5)
+    workflow.write_perf()
+    with open(f'{output_path}/perf_wf_perf.jsonl') as f:
+        assert [json.loads(line)['kind'] for line in f] == list(perf['kind']) + ['generate']
+
+
+def test_workflow_perf_stream_off_by_default(tmpdir_factory):
+    output_path = tmpdir_factory.mktemp('perf_default_wf')
+    workflow = DataFrameWorkflow(name='perf_wf', out_directory=output_path)
+    workflow.generate_base_artifact(num_rows=100, num_cols=5)
+    workflow.serialize_workflow()
+    assert workflow.perf.stream_filename is None
+    assert sorted(p.basename for p in output_path.listdir() if p.basename.startswith('perf_wf_perf')) == \
+        ['perf_wf_perf.csv']
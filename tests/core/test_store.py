@@ -0,0 +1,57 @@
+import os
+
+import pandas as pd
+
+from fuzzydata.clients.pandas import DataFrameArtifact
+from fuzzydata.core.store import ArtifactStore, verify_hashes
+from tests.conftest import requires_pyarrow
+
+_df = pd.DataFrame({'a': ['x', 'y', 'z'], 'b': [1, 2, 3]})
+
+
+def _artifact(label, df, tmpdir, file_format='csv'):
+    return DataFrameArtifact(label, filename=tmpdir.join(f'{label}.{file_format}'), from_df=df, file_format=file_format)
+
+
+def test_content_hash(tmpdir):
+    first = _artifact('first', _df, tmpdir)
+    assert first.content_hash() == _artifact('second', _df.copy(), tmpdir).content_hash()
+    category = _artifact('category', _df.astype({'a': 'category'}), tmpdir)
+    assert first.content_hash() == category.content_hash()
+    assert first.content_hash(with_dtypes=True) != category.content_hash(with_dtypes=True)
+    assert first.content_hash() != _artifact('renamed', _df.rename(columns={'b': 'c'}), tmpdir).content_hash()
+    assert first.content_hash() != _artifact('sampled', _df.iloc[[2, 0, 1]], tmpdir).content_hash()
+
+
+def test_artifact_store(tmpdir):
+    store = ArtifactStore()
+    first, second = _artifact('first', _df, tmpdir), _artifact('second', _df.copy(), tmpdir)
+    other = _artifact('other', _df.assign(b=[4, 5, 6]), tmpdir)
+    assert not store.link(first, first.filename)
+    first.serialize()
+    store.add(first, first.filename)
+
+    assert store.link(second, second.filename)
+    assert os.path.samefile(first.filename, second.filename)
+    assert not store.link(other, other.filename)
+    assert store.hashes['second']['duplicate_of'] == 'first'
+
+    store.write(tmpdir.join('hashes.json'))
+    assert os.path.exists(tmpdir.join('hashes.json'))
+    assert verify_hashes({'first': first, 'other': other}, {'first': store.hashes['first'],
+                                                            'other': store.hashes['second']}) == {'other': ['b']}
+
+
+@requires_pyarrow
+def test_artifact_store_dtypes(tmpdir):
+    # Parquet files keep the dtypes, a string column must not be linked to a file holding a category column
+    store = ArtifactStore()
+    category = _artifact('category', _df.astype({'a': 'category'}), tmpdir, file_format='parquet')
+    category.serialize()
+    store.add(category, category.filename)
+    strings = _artifact('strings', _df, tmpdir, file_format='parquet')
+    assert not store.link(strings, strings.filename)
+    strings.serialize()
+    store.add(strings, strings.filename)
+    assert not os.path.samefile(category.filename, strings.filename)
+    assert store.hashes['strings']['hash'] == store.hashes['category']['hash']
@@ -1,10 +1,17 @@
 import glob
+import json
 import os.path
 import logging
+import networkx as nx
+import pandas as pd
 import pytest
 
-from fuzzydata.core.artifact import Artifact
-from tests.conftest import workflow_fixtures
+from fuzzydata.clients import travis_workflows
+from fuzzydata.clients.pandas import DataFrameWorkflow
+from fuzzydata.clients.sqlite import SQLWorkflow
+from fuzzydata.core.artifact import Artifact, table_stats
+from fuzzydata.core.monitor import read_peak_rss
+from tests.conftest import workflow_fixtures, requires_pyarrow, generate_test_workflow
 
 # Disable Faker log spam in DEBUG mode
 logger = logging.getLogger(__name__)
@@ -30,6 +37,17 @@ def test_generate_base_artifact(abstract_workflow, request):
     assert new_label in workflow.graph.nodes()
 
 
+@pytest.mark.parametrize('wf_class', travis_workflows.values())
+def test_generate_base_artifact_chunked(wf_class, tmpdir_factory):
+    output_path = tmpdir_factory.mktemp(f'chunked_{wf_class.__name__}')
+    workflow = wf_class(name='test_chunked_wf', out_directory=output_path, stream_chunk_size=30)
+    artifact = workflow.generate_base_artifact(num_rows=100, num_cols=10)
+    assert len(artifact.to_df().index) == 100
+    workflow.generate_artifact_from_operation_list([artifact], _operation_list)
+    workflow.serialize_workflow()
+    assert len(list(glob.glob(f"{output_path}/artifacts/*.csv"))) == len(workflow.artifact_dict)
+
+
 @pytest.mark.dependency(depends=['test_generate_base_artifact'])
 @pytest.mark.parametrize('abstract_workflow', workflow_fixtures)
 def test_generate_artifact_from_operation_list(abstract_workflow, request):
@@ -63,3 +81,231 @@ def test_serialize_deserialize_workflow(abstract_workflow, request, tmpdir_facto
     new_out_dir = tmpdir_factory.mktemp('replay_wf')
     new_wf_cls = workflow.__class__
     new_wf_cls.load_workflow(output_path, new_out_dir, replay=True)
+
+
+@pytest.mark.parametrize('wf_class', travis_workflows.values())
+def test_replay_parallel(wf_class, tmpdir_factory):
+    output_path = tmpdir_factory.mktemp(f'parallel_{wf_class.__name__}')
+    workflow = generate_test_workflow(wf_class, name='test_parallel_wf', num_versions=10, base_shape=(10, 1000),
+                                      out_directory=output_path, bfactor=5.0)
+    serial = wf_class.load_workflow(output_path, tmpdir_factory.mktemp('serial_replay'), replay=True)
+    replay_path = tmpdir_factory.mktemp(f'parallel_replay_{wf_class.__name__}')
+    replayed = wf_class.load_workflow(output_path, replay_path, replay=True, wf_options={'replay_workers': 4})
+    assert set(replayed.artifact_dict) == set(serial.artifact_dict)
+    assert set(replayed.graph.edges()) == set(serial.graph.edges())
+    for label, artifact in replayed.artifact_dict.items():
+        assert list(artifact.to_df().columns) == list(serial.artifact_dict[label].to_df().columns)
+    perf = pd.read_csv(f'{replay_path}/test_parallel_wf_perf.csv', index_col=0)
+    assert (perf['kind'] == 'operation').sum() == len(serial.operation_list)
+
+
+@pytest.mark.parametrize('wf_class', travis_workflows.values())
+def test_replay_targets(wf_class, tmpdir_factory):
+    output_path = tmpdir_factory.mktemp(f'targets_{wf_class.__name__}')
+    workflow = generate_test_workflow(wf_class, name='test_targets_wf', num_versions=10, base_shape=(10, 1000),
+                                      out_directory=output_path, bfactor=5.0)
+    target = workflow.operation_list[-1]['new_label']
+    needed = nx.ancestors(workflow.graph, target) | {target}
+    replayed = wf_class.load_workflow(output_path, tmpdir_factory.mktemp('targets_replay'), replay=True,
+                                      targets=[target])
+    assert set(replayed.artifact_dict) == needed
+    assert len(replayed.operation_list) == len([opl for opl in workflow.operation_list if opl['new_label'] in needed])
+
+    with pytest.raises(ValueError):
+        wf_class.load_workflow(output_path, tmpdir_factory.mktemp('targets_unknown'), replay=True,
+                               targets=['no_such_artifact'])
+
+
+def test_csv_options(tmpdir):
+    with pytest.raises(ValueError):
+        DataFrameWorkflow(name='test_csv_wf', out_directory=tmpdir, csv_engine='pyarrow', csv_chunk_size=100)
+
+
+def test_memory_map_compression(tmpdir):
+    workflow = DataFrameWorkflow(name='test_mmap_wf', out_directory=tmpdir, file_format='feather', memory_map=True)
+    assert workflow.compression == 'uncompressed'
+    workflow = DataFrameWorkflow(name='test_mmap_wf', out_directory=tmpdir, file_format='feather', memory_map=True,
+                                 compression='zstd')
+    assert workflow.compression == 'zstd'
+
+
+def test_required_source_columns():
+    all_schema_maps = {'artifact_0': {'a': 'pyint', 'b': 'pyint', 'c': 'pyint'},
+                       'artifact_1': {'a': 'pyint', 'd': 'pyint'}}
+    op_list = [
+        {'sources': ['artifact_0'], 'new_label': 'artifact_2',
+         'op_list': [{'op': 'project', 'args': {'output_cols': ['b', 'a']}}]},
+        {'sources': ['artifact_0', 'artifact_1'], 'new_label': 'artifact_3',
+         'op_list': [{'op': 'merge', 'args': {'key_col': 'a'}}, {'op': 'project', 'args': {'output_cols': ['d']}}]},
+    ]
+    assert DataFrameWorkflow.required_source_columns(op_list, all_schema_maps) == {'artifact_0': ['a', 'b']}
+    op_list.append({'sources': ['artifact_0'], 'new_label': 'artifact_4',
+                    'op_list': [{'op': 'sample', 'args': {'frac': 0.5}}]})
+    assert DataFrameWorkflow.required_source_columns(op_list, all_schema_maps) == {}
+
+
+@pytest.mark.parametrize('file_format', ['csv', pytest.param('feather', marks=requires_pyarrow)])
+@pytest.mark.parametrize('wf_class', travis_workflows.values())
+def test_replay_pruned(wf_class, file_format, tmpdir_factory):
+    output_path = tmpdir_factory.mktemp(f'pruned_{file_format}_{wf_class.__name__}')
+    workflow = wf_class(name='test_pruned_wf', out_directory=output_path, file_format=file_format,
+                        compression='uncompressed' if file_format == 'feather' else None)
+    source = workflow.generate_base_artifact(num_rows=100, num_cols=10)
+    columns = list(source.schema_map)[:2]
+    projected = workflow.generate_artifact_from_operation_list(
+        [source], [{'op': 'project', 'args': {'output_cols': columns}}])
+    workflow.serialize_workflow()
+
+    replayed = wf_class.load_workflow(output_path, tmpdir_factory.mktemp('pruned_replay'), replay=True,
+                                      wf_options={'prune_columns': True, 'memory_map': True})
+    assert list(replayed.artifact_dict[source.label].schema_map) == columns
+    assert set(replayed.artifact_dict[source.label].to_df().columns) & set(source.schema_map) == set(columns)
+    assert replayed.artifact_dict[projected.label].to_df().shape == projected.to_df().shape
+
+
+@pytest.mark.parametrize('wf_class', travis_workflows.values())
+def test_dedup_artifacts(wf_class, tmpdir_factory):
+    output_path = tmpdir_factory.mktemp(f'dedup_{wf_class.__name__}')
+    workflow = wf_class(name='test_dedup_wf', out_directory=output_path, dedup_artifacts=True)
+    source = workflow.generate_base_artifact(num_rows=100, num_cols=5)
+    copy = workflow.generate_artifact_from_operation_list(
+        [source], [{'op': 'project', 'args': {'output_cols': list(source.to_df().columns)}}])
+    workflow.serialize_workflow()
+    assert os.path.samefile(f'{output_path}/artifacts/{source.label}.csv', f'{output_path}/artifacts/{copy.label}.csv')
+    assert workflow.artifact_store.hashes[copy.label]['duplicate_of'] == source.label
+    assert os.path.exists(f'{output_path}/test_dedup_wf_artifact_hashes.json')
+
+    replayed = wf_class.load_workflow(output_path, tmpdir_factory.mktemp('dedup_replay'), replay=True,
+                                      wf_options={'verify_hashes': True})
+    assert replayed.hash_mismatches == {}
+
+
+@pytest.mark.parametrize('wf_class', travis_workflows.values())
+def test_artifact_stats(wf_class, tmpdir_factory):
+    output_path = tmpdir_factory.mktemp(f'stats_{wf_class.__name__}')
+    # SQL samples are views drawn again on every query, the rows of artifacts derived from them change between queries
+    exclude = ['sample'] if wf_class.__name__ == 'SQLWorkflow' else []
+    workflow = generate_test_workflow(wf_class, name='test_stats_wf', num_versions=5, base_shape=(5, 200),
+                                      out_directory=output_path, exclude_ops=exclude,
+                                      wf_options={'artifact_stats': True})
+    with open(f'{output_path}/test_stats_wf_artifact_stats.json') as infile:
+        stats = json.load(infile)
+    assert set(stats) == set(workflow.artifact_dict)
+    for label, artifact in workflow.artifact_dict.items():
+        df = artifact.to_df()
+        assert stats[label]['num_rows'] == len(df.index) == len(artifact)
+        assert set(stats[label]['columns']) == {str(c) for c in df.columns}
+    perf = pd.read_csv(f'{output_path}/test_stats_wf_perf.csv', index_col=0)
+    assert (perf['kind'] == 'stats').sum() == len(workflow.artifact_dict)
+
+    # Replayed source artifacts take the recorded statistics instead of computing them again
+    replay_path = tmpdir_factory.mktemp(f'stats_replay_{wf_class.__name__}')
+    replayed = wf_class.load_workflow(output_path, replay_path, replay=True, wf_options={'artifact_stats': True})
+    perf = pd.read_csv(f'{replay_path}/test_stats_wf_perf.csv', index_col=0)
+    loaded = set(perf.loc[perf['kind'] == 'load', 'src'])
+    assert loaded and not loaded & set(perf.loc[perf['kind'] == 'stats', 'src'])
+    for label in loaded:
+        assert replayed.artifact_dict[label].stats()['columns'] == stats[label]['columns']
+
+
+def test_artifact_stats_chunked(tmpdir):
+    workflow = DataFrameWorkflow(name='test_stats_chunked_wf', out_directory=tmpdir, stream_chunk_size=30,
+                                 artifact_stats=True)
+    artifact = workflow.generate_base_artifact(num_rows=100, num_cols=10)
+    # Computed from the chunks while they were written, the table was not read back
+    assert artifact.has_stats and not artifact.in_memory
+    assert artifact.stats() == table_stats(artifact.to_df())
+
+
+def test_fuse_op_list():
+    op_list = [
+        {'sources': ['artifact_0'], 'new_label': 'artifact_1', 'op_list': [{'op': 'sample', 'args': {'frac': 0.5}}]},
+        {'sources': ['artifact_1', 'artifact_2'], 'new_label': 'artifact_3',
+         'op_list': [{'op': 'merge', 'args': {'key_col': 'a'}}]},
+        {'sources': ['artifact_3'], 'new_label': 'artifact_4', 'op_list': [{'op': 'project', 'args': {}}]},
+        {'sources': ['artifact_3'], 'new_label': 'artifact_5', 'op_list': [{'op': 'select', 'args': {}}]},
+    ]
+    fused = DataFrameWorkflow.fuse_op_list(op_list)
+    assert [opl['new_label'] for opl in fused] == ['artifact_3', 'artifact_4', 'artifact_5']
+    assert fused[0]['sources'] == ['artifact_0', 'artifact_2']
+    assert [x['op'] for x in fused[0]['op_list']] == ['sample', 'merge']
+    assert fused[0]['fused'] == ['artifact_1']
+    assert DataFrameWorkflow.fuse_op_list(op_list, keep=['artifact_1']) == op_list
+    # One operation per fused operation: artifact_1 is materialized before the merge
+    assert [opl['new_label'] for opl in DataFrameWorkflow.fuse_op_list(op_list, max_ops=1)] == \
+        ['artifact_1', 'artifact_3', 'artifact_4', 'artifact_5']
+
+
+def test_replay_lazy_long_chain(tmpdir_factory):
+    # A chain longer than SQLite can parse as one nested query is split into several fused operations
+    output_path = tmpdir_factory.mktemp('lazy_chain')
+    workflow = SQLWorkflow(name='test_chain_wf', out_directory=output_path)
+    artifact = workflow.generate_base_artifact(num_rows=200, column_maps={'a': 'century', 'b': 'pyint'})
+    groupby = {'op': 'groupby', 'args': {'group_columns': ['a'], 'agg_columns': ['b'], 'agg_function': 'sum'}}
+    for _ in range(12):
+        artifact = workflow.generate_artifact_from_operation_list([artifact], [groupby, groupby])
+    workflow.serialize_workflow()
+
+    lazy = SQLWorkflow.load_workflow(output_path, tmpdir_factory.mktemp('lazy_chain_replay'), replay=True,
+                                     wf_options={'lazy': True})
+    assert len(lazy.operation_list) > 1
+    assert all(len(opl['op_list']) <= lazy.max_fused_ops for opl in lazy.operation_list)
+    pd.testing.assert_frame_equal(lazy.artifact_dict[artifact.label].to_df(), artifact.to_df())
+
+
+@pytest.mark.parametrize('wf_class', travis_workflows.values())
+def test_replay_lazy(wf_class, tmpdir_factory):
+    output_path = tmpdir_factory.mktemp(f'lazy_{wf_class.__name__}')
+    # A high branch factor derives almost every artifact from the previous one, which makes chains to fuse
+    workflow = generate_test_workflow(wf_class, name='test_lazy_wf', num_versions=10, base_shape=(10, 1000),
+                                      out_directory=output_path, bfactor=10.0, wf_options={'seed': 7})
+    eager = wf_class.load_workflow(output_path, tmpdir_factory.mktemp('eager_replay'), replay=True)
+    lazy = wf_class.load_workflow(output_path, tmpdir_factory.mktemp('lazy_replay'), replay=True,
+                                  wf_options={'lazy': True})
+    fused = [label for opl in lazy.operation_list for label in opl.get('fused', [])]
+    assert fused
+    assert set(lazy.artifact_dict) == set(eager.artifact_dict) - set(fused)
+    for label, artifact in lazy.artifact_dict.items():
+        assert list(artifact.to_df().columns) == list(eager.artifact_dict[label].to_df().columns)
+
+    optimized = wf_class.load_workflow(output_path, tmpdir_factory.mktemp('optimized_replay'), replay=True,
+                                       wf_options={'lazy': True, 'optimize': True})
+    assert set(optimized.artifact_dict) == set(lazy.artifact_dict)
+    for label, artifact in optimized.artifact_dict.items():
+        assert list(artifact.to_df().columns) == list(lazy.artifact_dict[label].to_df().columns)
+
+
+@pytest.mark.parametrize('wf_class', travis_workflows.values())
+def test_profile_steps(wf_class, tmpdir_factory):
+    output_path = tmpdir_factory.mktemp(f'steps_{wf_class.__name__}')
+    workflow = generate_test_workflow(wf_class, name='test_steps_wf', num_versions=6, base_shape=(10, 1000),
+                                      out_directory=output_path, matfreq=3, wf_options={'profile_steps': True})
+    workflow.serialize_workflow()
+    perf = pd.read_csv(f'{output_path}/test_steps_wf_perf.csv', index_col=0)
+    steps = pd.read_csv(f'{output_path}/test_steps_wf_step_perf.csv', index_col=0)
+    operations = perf[perf['kind'] == 'operation']
+    assert set(steps['parent']) == set(operations.index)
+    for parent, row in operations.iterrows():
+        parent_steps = steps[steps['parent'] == parent]
+        assert '+'.join(parent_steps['op']) == row['op']
+        assert (parent_steps['elapsed_time'] >= 0).all()
+        assert parent_steps['peak_rss'].notna().all()
+        # Step monitors run inside the operation's and must not reset the peak it reports
+        if read_peak_rss(os.getpid()) is not None:
+            assert parent_steps['peak_rss'].max() <= row['peak_rss']
+
+
+@requires_pyarrow
+@pytest.mark.parametrize('file_format', ['parquet', 'feather'])
+@pytest.mark.parametrize('wf_class', travis_workflows.values())
+def test_columnar_formats(wf_class, file_format, tmpdir_factory):
+    output_path = tmpdir_factory.mktemp(f'{file_format}_{wf_class.__name__}')
+    workflow = generate_test_workflow(wf_class, name='test_format_wf', num_versions=6, base_shape=(10, 1000),
+                                      out_directory=output_path,
+                                      wf_options={'file_format': file_format, 'stream_chunk_size': 300})
+    workflow.serialize_workflow()
+    assert len(glob.glob(f"{output_path}/artifacts/*.{file_format}")) == len(workflow.artifact_dict)
+
+    replayed = wf_class.load_workflow(output_path, tmpdir_factory.mktemp(f'{file_format}_replay'), replay=True)
+    assert replayed.file_format == file_format
+    assert set(replayed.artifact_dict) == set(workflow.artifact_dict)
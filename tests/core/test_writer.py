@@ -0,0 +1,28 @@
+import glob
+import os
+
+import pandas as pd
+import pytest
+
+from fuzzydata.clients import travis_workflows
+from tests.conftest import generate_test_workflow
+
+
+@pytest.mark.parametrize('wf_class', travis_workflows.values())
+def test_write_behind_serialization(wf_class, tmpdir_factory):
+    output_path = tmpdir_factory.mktemp(f'write_behind_{wf_class.__name__}')
+    workflow = generate_test_workflow(wf_class, name='write_behind_wf', num_versions=6, base_shape=(10, 1000),
+                                      out_directory=output_path, wf_options={'write_workers': 2})
+    writer = workflow.artifact_writer
+    assert set(writer.written) == set(workflow.artifact_dict)
+    # serialize_workflow() stopped the writer threads
+    assert writer.executor is None
+    for label in workflow.artifact_dict:
+        assert os.path.exists(f'{output_path}/artifacts/{label}.csv')
+    assert not glob.glob(f'{output_path}/artifacts/*.tmp')
+
+    perf = pd.read_csv(f'{output_path}/write_behind_wf_perf.csv', index_col=0)
+    serialized = perf[perf['kind'] == 'serialize']
+    # Every artifact is written exactly once, by the background writer
+    assert sorted(serialized['src']) == sorted(workflow.artifact_dict)
+    assert (serialized['bytes'] > 0).all()
@@ -1,3 +1,7 @@
+import os
+import subprocess
+import sys
+
 import pytest
 from fuzzydata.cli import main
 
@@ -13,3 +17,13 @@ def test_main(tmpdir_factory):
         "--matfreq=2"
     ]
     main(args)
+
+
+def test_help_does_not_import_engines():
+    probe = 'import sys\n' \
+            'from fuzzydata.cli import setup_arguments\n' \
+            'try:\n    setup_arguments(["--help"])\nexcept SystemExit:\n    pass\n' \
+            'print("loaded:" + ",".join(m for m in ("pandas", "sqlalchemy", "faker", "modin") if m in sys.modules))'
+    output = subprocess.run([sys.executable, '-c', probe], capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout
+    assert output.strip().splitlines()[-1] == 'loaded:'